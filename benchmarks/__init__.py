@@ -0,0 +1,7 @@
+"""
+Benchmarks for pybacked. These are not part of the test suite and are not
+shipped with the package. Each module can be run on its own, e.g.::
+
+    python -m benchmarks.e2e --files 10000 --generations 5 --output out.json
+    python -m benchmarks.hashing --sizes 1M 64M
+"""
@@ -0,0 +1,178 @@
+"""
+End-to-end benchmark of diff.collect(), backup.backup() and
+restore.restore_archive_state() on a synthetic tree over several archive
+generations. Results are written as JSON, so they can be compared between
+releases.
+
+Usage::
+
+    python -m benchmarks.e2e --files 10000 --generations 5 --output out.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import zipfile
+
+import pybacked
+import pybacked.backup
+import pybacked.config
+import pybacked.diff
+import pybacked.restore
+from benchmarks.generator import TreeGenerator, tree_size
+
+
+def read_io_counters():
+    """
+    Read the syscall and byte counters of the current process from
+    /proc/self/io. Returns None on platforms without procfs.
+
+    :return: A dictionary with the counters (syscr, syscw, rchar, wchar...)
+    :rtype: dict
+    """
+    try:
+        file = open("/proc/self/io", "r")
+    except OSError:
+        return None
+    counters = {}
+    for line in file:
+        key, value = line.split(":")
+        counters[key] = int(value)
+    file.close()
+    return counters
+
+
+def measure(name, function, files, size):
+    """
+    Run a function and record wall time, throughput and syscall counts.
+
+    :param name: The name of the measured phase
+    :type name: str
+    :param function: The function to run
+    :type function: callable
+    :param files: The number of files processed by the function
+    :type files: int
+    :param size: The number of bytes processed by the function
+    :type size: int
+    :return: The result dictionary
+    :rtype: dict
+    """
+    before = read_io_counters()
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    after = read_io_counters()
+
+    result = {"phase": name, "seconds": elapsed, "files": files,
+              "bytes": size, "files_per_s": files / elapsed,
+              "mb_per_s": size / elapsed / 1024 ** 2}
+    if before is not None and after is not None:
+        result["syscalls_read"] = after["syscr"] - before["syscr"]
+        result["syscalls_write"] = after["syscw"] - before["syscw"]
+    return result
+
+
+def run(files, generations, mean_size, depth, change_rate, diff_algorithm,
+        seed=0, directory=None):
+    """
+    Run the end-to-end benchmark.
+
+    :param files: The number of files in the synthetic tree
+    :type files: int
+    :param generations: The number of backup generations after the initial
+        backup
+    :type generations: int
+    :param mean_size: The median file size in bytes
+    :type mean_size: int
+    :param depth: The directory depth of the tree
+    :type depth: int
+    :param change_rate: The fraction of files changed per generation
+    :type change_rate: float
+    :param diff_algorithm: The diff algorithm used for the backups
+    :type diff_algorithm: int
+    :param seed: The seed of the tree generator
+    :type seed: int, optional
+    :param directory: The directory in which the benchmark is run
+    :type directory: str, optional
+    :return: The list of result dictionaries
+    :rtype: list
+    """
+    results = []
+    with tempfile.TemporaryDirectory(dir=directory) as tmpdir:
+        storage = os.path.join(tmpdir, "storage")
+        archive = os.path.join(tmpdir, "archive")
+        os.mkdir(storage)
+        os.mkdir(archive)
+        config = pybacked.config.Configuration(
+            "benchmark", storage, archive, diff_algorithm,
+            zipfile.ZIP_DEFLATED, 6, pybacked.HASH_SHA256)
+
+        generator = TreeGenerator(storage, files, mean_size=mean_size,
+                                  depth=depth, change_rate=change_rate,
+                                  seed=seed)
+        generator.create()
+
+        for generation in range(generations + 1):
+            if generation > 0:
+                generator.mutate()
+            count = len(generator.paths)
+            size = tree_size(storage)
+
+            phases = [
+                ("collect", lambda: pybacked.diff.collect(
+                    storage, archive, diff_algorithm, pybacked.HASH_SHA256)),
+                ("backup", lambda: pybacked.backup.backup(config))]
+            for name, function in phases:
+                result = measure(name, function, count, size)
+                result["generation"] = generation
+                results.append(result)
+
+            last_archive = pybacked.restore.get_archive_list(archive)[0]
+            restore_dir = os.path.join(tmpdir,
+                                       "restore-{}".format(generation))
+            result = measure("restore", lambda: (
+                pybacked.restore.restore_archive_state(last_archive,
+                                                       restore_dir)),
+                             count, size)
+            result["generation"] = generation
+            results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--files", type=int, default=1000)
+    parser.add_argument("--generations", type=int, default=3)
+    parser.add_argument("--mean-size", type=int, default=4096)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--change-rate", type=float, default=0.05)
+    parser.add_argument("--diff", type=int, default=pybacked.DIFF_HASH,
+                        help="diff algorithm constant (default DIFF_HASH)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dir", default=None,
+                        help="directory on the filesystem to benchmark")
+    parser.add_argument("--output", default=None,
+                        help="JSON output file (default stdout)")
+    args = parser.parse_args()
+
+    results = run(args.files, args.generations, args.mean_size, args.depth,
+                  args.change_rate, args.diff, args.seed, args.dir)
+    report = {"pybacked": pybacked.__version__,
+              "python": sys.version.split()[0],
+              "platform": platform.platform(),
+              "parameters": vars(args),
+              "results": results}
+    output = json.dumps(report, indent=pybacked.JSON_INDENT)
+    if args.output is None:
+        print(output)
+    else:
+        file = open(args.output, "w")
+        file.write(output)
+        file.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Deterministic generator for synthetic storage trees. The same parameters and
+seed always produce the same tree and the same sequence of changes, so
+benchmark results of different releases can be compared.
+"""
+import os
+import random
+
+POOL_SIZE = 1048576
+
+
+class TreeGenerator:
+    """
+    Creates a synthetic directory tree and mutates it generation by
+    generation.
+
+    :param root: The directory in which the tree is created
+    :type root: str
+    :param files: The number of files in the initial tree
+    :type files: int
+    :param mean_size: The median file size in bytes. File sizes follow a
+        log-normal distribution around this value.
+    :type mean_size: int, optional
+    :param size_sigma: The sigma of the log-normal size distribution
+    :type size_sigma: float, optional
+    :param depth: The maximum directory depth
+    :type depth: int, optional
+    :param fanout: The number of subdirectories per directory
+    :type fanout: int, optional
+    :param change_rate: The fraction of files that is modified per generation.
+        A tenth of that fraction is additionally added and removed.
+    :type change_rate: float, optional
+    :param seed: The seed of the random number generator
+    :type seed: int, optional
+    """
+    def __init__(self, root, files, mean_size=4096, size_sigma=1.5, depth=3,
+                 fanout=4, change_rate=0.05, seed=0):
+        self.root = root
+        self.files = files
+        self.mean_size = mean_size
+        self.size_sigma = size_sigma
+        self.depth = depth
+        self.fanout = fanout
+        self.change_rate = change_rate
+        self.random = random.Random(seed)
+        self.pool = self.random.getrandbits(POOL_SIZE * 8).to_bytes(
+            POOL_SIZE, "little")
+        self.directories = self._create_directories()
+        self.paths = []
+        self.generation = 0
+        self.counter = 0
+
+    def _create_directories(self):
+        directories = [""]
+        level = [""]
+        for _ in range(self.depth):
+            next_level = []
+            for parent in level:
+                for index in range(self.fanout):
+                    next_level.append(parent + "dir{}/".format(index))
+            directories.extend(next_level)
+            level = next_level
+        return directories
+
+    def _random_size(self):
+        size = int(self.random.lognormvariate(0, self.size_sigma) *
+                   self.mean_size)
+        return max(0, min(size, 64 * POOL_SIZE))
+
+    def _write(self, relpath, append=False):
+        path = os.path.join(self.root, relpath)
+        size = self._random_size()
+        file = open(path, "ab" if append else "wb")
+        while size > 0:
+            offset = self.random.randrange(POOL_SIZE)
+            chunk = self.pool[offset:offset + size]
+            file.write(chunk)
+            size -= len(chunk)
+        file.close()
+
+    def _new_path(self):
+        directory = self.random.choice(self.directories)
+        self.counter += 1
+        return directory + "file{}.bin".format(self.counter)
+
+    def create(self):
+        """
+        Create the initial tree (generation 0).
+
+        :return: The number of files and bytes written
+        :rtype: tuple
+        """
+        for directory in self.directories:
+            os.makedirs(os.path.join(self.root, directory), exist_ok=True)
+        for _ in range(self.files):
+            path = self._new_path()
+            self._write(path)
+            self.paths.append(path)
+        return len(self.paths), tree_size(self.root)
+
+    def mutate(self):
+        """
+        Advance the tree by one generation: modify change_rate of the files
+        (half of them by appending), and add and remove a tenth of that.
+
+        :return: A dictionary with the number of modified, added and removed
+            files
+        :rtype: dict
+        """
+        self.generation += 1
+        count = len(self.paths)
+        modified = int(count * self.change_rate)
+        churn = max(1, modified // 10) if modified else 0
+
+        for path in self.random.sample(self.paths, min(modified, count)):
+            self._write(path, append=self.random.random() < 0.5)
+
+        for path in self.random.sample(self.paths, min(churn, count)):
+            os.remove(os.path.join(self.root, path))
+            self.paths.remove(path)
+
+        for _ in range(churn):
+            path = self._new_path()
+            self._write(path)
+            self.paths.append(path)
+
+        return {"modified": modified, "added": churn, "removed": churn}
+
+
+def tree_size(root):
+    """
+    Return the total size of all files in a tree.
+
+    :param root: The root of the tree
+    :type root: str
+    :return: The size in bytes
+    :rtype: int
+    """
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            total += os.path.getsize(os.path.join(dirpath, filename))
+    return total
@@ -0,0 +1,146 @@
+"""
+Compare the throughput of different ways of feeding a file to hashlib: a
+single read(), a readinto() loop over a preallocated buffer and slices of a
+memory mapped file. Every strategy is run on files of several sizes in a
+temporary directory on the local filesystem.
+
+Usage::
+
+    python benchmarks/hashing.py [--sizes 1M 16M 256M] [--repeat 3]
+"""
+import argparse
+import hashlib
+import mmap
+import os
+import tempfile
+import time
+
+CHUNK_SIZE = 1048576
+UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+def parse_size(text):
+    """
+    Parse a size like 64K, 16M or 1G to a number of bytes.
+
+    :param text: The size string
+    :type text: str
+    :return: The size in bytes
+    :rtype: int
+    """
+    unit = text[-1].upper()
+    if unit in UNITS:
+        return int(text[:-1]) * UNITS[unit]
+    return int(text)
+
+
+def hash_read(filepath, algorithm):
+    file = open(filepath, "rb")
+    hash_handler = hashlib.new(algorithm)
+    hash_handler.update(file.read())
+    file.close()
+    return hash_handler.hexdigest()
+
+
+def hash_readinto(filepath, algorithm):
+    file = open(filepath, "rb", buffering=0)
+    hash_handler = hashlib.new(algorithm)
+    buffer = bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    count = file.readinto(buffer)
+    while count:
+        hash_handler.update(view[:count])
+        count = file.readinto(buffer)
+    file.close()
+    return hash_handler.hexdigest()
+
+
+def hash_mmap(filepath, algorithm):
+    file = open(filepath, "rb")
+    hash_handler = hashlib.new(algorithm)
+    size = os.fstat(file.fileno()).st_size
+    if size > 0:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(mapped, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+        view = memoryview(mapped)
+        for position in range(0, size, CHUNK_SIZE):
+            hash_handler.update(view[position:position + CHUNK_SIZE])
+        view.release()
+        mapped.close()
+    file.close()
+    return hash_handler.hexdigest()
+
+
+STRATEGIES = {"read": hash_read, "readinto": hash_readinto, "mmap": hash_mmap}
+
+
+def run(sizes, repeat, algorithm, directory=None):
+    """
+    Run all hashing strategies on files of the given sizes.
+
+    :param sizes: The file sizes in bytes
+    :type sizes: list
+    :param repeat: How often each strategy is run per file. The best run is
+        reported.
+    :type repeat: int
+    :param algorithm: The hash algorithm
+    :type algorithm: str
+    :param directory: The directory in which the test files are created
+    :type directory: str, optional
+    :return: A list of result dictionaries
+    :rtype: list
+    """
+    results = []
+    with tempfile.TemporaryDirectory(dir=directory) as tmpdir:
+        for size in sizes:
+            filepath = os.path.join(tmpdir, "sample-{}.bin".format(size))
+            file = open(filepath, "wb")
+            remaining = size
+            while remaining > 0:
+                block = min(remaining, CHUNK_SIZE)
+                file.write(os.urandom(block))
+                remaining -= block
+            file.close()
+
+            expected = None
+            for name, strategy in STRATEGIES.items():
+                best = None
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    digest = strategy(filepath, algorithm)
+                    elapsed = time.perf_counter() - start
+                    if best is None or elapsed < best:
+                        best = elapsed
+                if expected is None:
+                    expected = digest
+                elif digest != expected:
+                    raise RuntimeError(name + " produced a different digest")
+                results.append({"strategy": name, "size": size,
+                                "seconds": best,
+                                "mb_per_s": size / best / 1024 ** 2})
+            os.remove(filepath)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", nargs="+",
+                        default=["64K", "1M", "16M", "256M"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--algorithm", default="sha256")
+    parser.add_argument("--dir", default=None,
+                        help="directory on the filesystem to benchmark")
+    args = parser.parse_args()
+
+    sizes = [parse_size(size) for size in args.sizes]
+    results = run(sizes, args.repeat, args.algorithm, args.dir)
+    print("{:>12} {:>10} {:>12}".format("size", "strategy", "MB/s"))
+    for result in results:
+        print("{:>12} {:>10} {:>12.1f}".format(result["size"],
+                                               result["strategy"],
+                                               result["mb_per_s"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Scaling-curve benchmark of the peak memory and the allocations of the
+DiffCache and diff-log code paths. Every target is run at several entry
+counts, so super-linear growth shows up as a rising cost per entry.
+
+Usage::
+
+    python -m benchmarks.memory --sizes 10000 100000 --output out.json
+"""
+import argparse
+import gc
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+
+import pybacked
+import pybacked.backup
+import pybacked.diff
+import pybacked.logging
+
+DEFAULT_SIZES = [10000, 100000, 1000000, 5000000]
+FANOUT = 100
+
+
+class RssSampler(threading.Thread):
+    """
+    Samples the resident set size of the process in a background thread and
+    keeps the maximum. On platforms without /proc/self/statm the maximum RSS
+    reported by getrusage() is used instead, which can't be reset between
+    measurements.
+
+    :param interval: The sampling interval in seconds
+    :type interval: float, optional
+    """
+    def __init__(self, interval=0.005):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = 0
+        self.running = True
+        try:
+            self.page_size = os.sysconf("SC_PAGE_SIZE")
+            open("/proc/self/statm").close()
+            self.procfs = True
+        except (OSError, ValueError, AttributeError):
+            self.procfs = False
+
+    def current(self):
+        if not self.procfs:
+            # ru_maxrss is reported in kilobytes on linux and bytes on macOS
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return maxrss if sys.platform == "darwin" else maxrss * 1024
+        file = open("/proc/self/statm")
+        resident = int(file.read().split()[1])
+        file.close()
+        return resident * self.page_size
+
+    def run(self):
+        while self.running:
+            self.peak = max(self.peak, self.current())
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+        self.join()
+        self.peak = max(self.peak, self.current())
+        return self.peak
+
+
+def build_diffcache(entries, fanout=FANOUT):
+    """
+    Build a nested DiffCache with the given number of file entries. Every
+    directory holds at most fanout files and fanout subdirectories.
+
+    :param entries: The number of file entries
+    :type entries: int
+    :param fanout: The maximum number of entries per directory
+    :type fanout: int, optional
+    :return: The DiffCache
+    :rtype: pybacked.diff.DiffCache
+    """
+    def build(path, count):
+        diffcache = pybacked.diff.DiffCache()
+        files = min(count, fanout)
+        for index in range(files):
+            filepath = "{}/file{}.txt".format(path, index)
+            diff = pybacked.diff.Diff('+', "{:040x}".format(index))
+            diffcache.add_diff(filepath, diff, False)
+        remaining = count - files
+        subdirs = min(fanout, -(-remaining // fanout)) if remaining else 0
+        for index in range(subdirs):
+            share = remaining // subdirs + (index < remaining % subdirs)
+            subpath = "{}/dir{}".format(path, index)
+            diffcache.add_diff(subpath, build(subpath, share), True)
+        return diffcache
+
+    return build("/storage", entries)
+
+
+def measure(function):
+    """
+    Run a function twice: once while sampling the RSS and once under
+    tracemalloc.
+
+    :param function: The function to measure
+    :type function: callable
+    :return: A dictionary with seconds, rss_peak, traced_peak and the number
+        of allocated blocks still alive at the end of the call
+    :rtype: dict
+    """
+    gc.collect()
+    sampler = RssSampler()
+    baseline = sampler.current()
+    sampler.start()
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    rss_peak = sampler.stop() - baseline
+    del result
+
+    gc.collect()
+    tracemalloc.start()
+    result = function()
+    snapshot = tracemalloc.take_snapshot()
+    current, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    blocks = sum(stat.count for stat in snapshot.statistics("filename"))
+    del result
+    return {"seconds": elapsed, "rss_peak": max(rss_peak, 0),
+            "traced_peak": traced_peak, "allocated_blocks": blocks}
+
+
+def run(sizes):
+    """
+    Run all targets at all sizes.
+
+    :param sizes: The entry counts
+    :type sizes: list
+    :return: A dictionary mapping each target to its list of results
+    :rtype: dict
+    """
+    results = {"DiffCache": [], "create_log": [],
+               "diff_log_deserialize_str": [], "create_filedict": []}
+    for size in sizes:
+        diffcache = build_diffcache(size)
+        log = pybacked.logging.create_log(diffcache)
+        targets = {
+            "DiffCache": lambda: build_diffcache(size),
+            "create_log": lambda: pybacked.logging.create_log(diffcache),
+            "diff_log_deserialize_str": lambda: (
+                pybacked.diff.diff_log_deserialize_str(log)),
+            "create_filedict": lambda: (
+                pybacked.backup.create_filedict(diffcache))}
+        for name, function in targets.items():
+            result = measure(function)
+            result["entries"] = size
+            result["bytes_per_entry"] = result["traced_peak"] / size
+            results[name].append(result)
+
+    # the growth of the per entry cost between consecutive sizes, values
+    # clearly above 1 indicate super-linear memory growth
+    for curve in results.values():
+        for previous, result in zip(curve, curve[1:]):
+            result["per_entry_growth"] = result["bytes_per_entry"] / \
+                previous["bytes_per_entry"]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--output", default=None,
+                        help="JSON output file (default stdout)")
+    args = parser.parse_args()
+
+    results = run(args.sizes)
+    for name, curve in results.items():
+        print(name, file=sys.stderr)
+        for result in curve:
+            print("  {:>9} entries {:>12.1f} MB peak {:>8.1f} B/entry".format(
+                result["entries"], result["traced_peak"] / 1024 ** 2,
+                result["bytes_per_entry"]), file=sys.stderr)
+
+    report = {"pybacked": pybacked.__version__,
+              "python": sys.version.split()[0],
+              "parameters": vars(args),
+              "results": results}
+    output = json.dumps(report, indent=pybacked.JSON_INDENT)
+    if args.output is None:
+        print(output)
+    else:
+        file = open(args.output, "w")
+        file.write(output)
+        file.close()
+
+
+if __name__ == "__main__":
+    main()
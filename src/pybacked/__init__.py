@@ -9,6 +9,16 @@ HASH_BLAKE_2S = 'blake2s'
 DIFF_DATE = 0
 DIFF_HASH = 1
 DIFF_CONT = 2
+DIFF_STAT = 3
+
+ARCHIVE_INCREMENTAL = 'incremental'
+ARCHIVE_FULL = 'full'
+ARCHIVE_REVERSE = 'reverse'
 
 JSON_SORT = False
 JSON_INDENT = 4
+
+SAMPLE_BLOCK_SIZE = 65536
+HASH_CHUNK_SIZE = 1048576
+COPY_CHUNK_SIZE = 1048576
+MMAP_THRESHOLD = 16777216
@@ -0,0 +1,4 @@
+import pybacked.cli
+import sys
+
+sys.exit(pybacked.cli.main())
@@ -0,0 +1,130 @@
+import asyncio
+import functools
+import pybacked.backup
+import pybacked.cancellation
+import pybacked.restore
+
+
+async def run_in_executor(func, *args, executor=None, progress=None):
+    """
+    Run a blocking backup or restore function in an executor. If the awaiting
+    task is cancelled, the run is stopped at its next safe point and the
+    cancellation is only propagated once the run has cleaned up.
+
+    :param func: The blocking function, which has to accept a progress
+        keyword argument
+    :type func: callable
+    :param args: The positional arguments for func
+    :param executor: The executor to run func in. The default executor of the
+        event loop is used if this is None.
+    :type executor: concurrent.futures.Executor, optional
+    :param progress: Function called in the event loop with each
+        pybacked.progress.ProgressEvent of the run
+    :type progress: callable, optional
+    :return: The return value of func
+    """
+    loop = asyncio.get_event_loop()
+    token = pybacked.cancellation.CancelToken()
+    if progress is None:
+        callback = None
+    else:
+        # events are passed to the event loop thread, so progress doesn't
+        # need to be thread safe
+        callback = functools.partial(loop.call_soon_threadsafe, progress)
+
+    def target():
+        with pybacked.cancellation.activate(token):
+            return func(*args, progress=callback)
+
+    future = loop.run_in_executor(executor, target)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        token.cancel()
+        try:
+            await future
+        except pybacked.cancellation.Cancelled:
+            pass
+        raise
+
+
+async def backup(config, executor=None, progress=None):
+    """
+    Perform a backup with the given configuration without blocking the event
+    loop. Cancelling the task removes the partially written archive.
+
+    :param config: The configuration for the backup
+    :type config: Configuration
+    :param executor: The executor to run the backup in
+    :type executor: concurrent.futures.Executor, optional
+    :param progress: Function called in the event loop with each
+        pybacked.progress.ProgressEvent of the backup
+    :type progress: callable, optional
+    :return: The timing and counters of the backup run
+    :rtype: pybacked.instrumentation.Stats
+    """
+    return await run_in_executor(pybacked.backup.backup, config,
+                                 executor=executor, progress=progress)
+
+
+async def restore(config, archname, alt_dir=None, executor=None,
+                  progress=None):
+    """
+    Restore a given backup without blocking the event loop. Cancelling the
+    task stops the restore between two files, the files restored so far are
+    kept.
+
+    :param config: The configuration for the backup
+    :type config: Configuration
+    :param archname: The name of the archive which holds the state which
+        should be restored
+    :type archname: str
+    :param alt_dir: An alternative directory to restore to
+    :type alt_dir: str, optional
+    :param executor: The executor to run the restore in
+    :type executor: concurrent.futures.Executor, optional
+    :param progress: Function called in the event loop with each
+        pybacked.progress.ProgressEvent of the restore
+    :type progress: callable, optional
+    :return: The timing and counters of the restore run
+    :rtype: pybacked.instrumentation.Stats
+    """
+    return await run_in_executor(pybacked.restore.restore, config, archname,
+                                 alt_dir, executor=executor,
+                                 progress=progress)
+
+
+async def backup_many(configs, limit=4, executor=None, progress=None,
+                      return_exceptions=False):
+    """
+    Perform the backups of many configurations concurrently, with at most
+    limit backups running at the same time.
+
+    :param configs: The configurations to back up
+    :type configs: list
+    :param limit: The maximum number of concurrently running backups
+        (default is 4)
+    :type limit: int, optional
+    :param executor: The executor to run the backups in
+    :type executor: concurrent.futures.Executor, optional
+    :param progress: Function called in the event loop with the
+        configuration and each pybacked.progress.ProgressEvent of its backup
+    :type progress: callable, optional
+    :param return_exceptions: Return exceptions of failed backups in the
+        result list instead of raising the first one
+    :type return_exceptions: bool, optional
+    :return: The Stats of each backup in the order of configs
+    :rtype: list
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(config):
+        if progress is None:
+            callback = None
+        else:
+            callback = functools.partial(progress, config)
+        async with semaphore:
+            return await backup(config, executor, callback)
+
+    return await asyncio.gather(*(run(config) for config in configs),
+                                return_exceptions=return_exceptions)
@@ -1,42 +1,231 @@
 import os.path
 import pybacked.diff
+import pybacked.hash_cache
+import pybacked.index
+import pybacked.instrumentation
 import pybacked.logging
+import pybacked.manifest
+import pybacked.progress
+import pybacked.prometheus
 import pybacked.restore
+import pybacked.reverse
+import pybacked.throttle
 import pybacked.zip_handler
 import time
 
 
-def backup(config):
+def backup(config, progress=None, index=None, hash_cache=None):
     """
-    Perform a backup with the given configuration
+    Perform a backup with the given configuration. The time spent in each
+    phase of the backup and counters of the performed work are recorded to
+    the metadata.json of the new archive and returned to the caller.
+
+    A full archive is written instead of an incremental one, when the
+    configured full_every, full_interval or full_chain_size is reached (see
+    is_full_due()). In reverse-incremental mode the new archive is always a
+    full archive and the previous full archive is rewritten into a reverse
+    delta, so the newest state is restored from a single archive.
 
     :param config: The configuration for the backup. All the needed data
         should be stored inside a Configuration class object.
     :type config: Configuration
+    :param progress: Function called with pybacked.progress.ProgressEvent
+        objects during the "scan" and "archive" phases of the backup
+    :type progress: callable, optional
+    :param index: An up to date index of the archive directory, which is
+        used to look up the archived states. The new archive is added to it.
+    :type index: pybacked.index.ArchiveIndex, optional
+    :param hash_cache: The hash cache for tiered hashing. If this is None,
+        the hash cache is read from the archive directory.
+    :type hash_cache: pybacked.hash_cache.HashCache, optional
+    :return: The timing and counters of the backup run
+    :rtype: pybacked.instrumentation.Stats
+    """
+    if progress is None:
+        reporter = None
+    else:
+        reporter = pybacked.progress.ProgressReporter(progress)
+
+    stats = pybacked.instrumentation.Stats()
+    start = time.perf_counter()
+    with pybacked.instrumentation.activate(stats), \
+            pybacked.progress.activate(reporter), \
+            pybacked.throttle.activate(pybacked.throttle.from_config(config)):
+        if config.full_verify_interval is None:
+            hash_cache = None
+        elif hash_cache is None:
+            hash_cache = pybacked.hash_cache.read_hash_cache(
+                config.archive, config.full_verify_interval)
+
+        # changes and archives left behind by an interrupted run are
+        # completed, recorded or removed, before their numbers or states are
+        # looked at
+        recovered = pybacked.manifest.recover(config.archive)
+        if pybacked.manifest.reconcile_manifest(config.archive):
+            recovered = True
+        if recovered and index is not None:
+            index.refresh()
+
+        base = None
+        lookup_index = index
+        if config.reverse_incremental:
+            kind = pybacked.ARCHIVE_FULL
+            base = pybacked.reverse.get_base(config.archive)
+        elif is_full_due(config, time.time()):
+            kind = pybacked.ARCHIVE_FULL
+        else:
+            kind = pybacked.ARCHIVE_INCREMENTAL
+        if kind == pybacked.ARCHIVE_FULL and base is None:
+            # without a previous full archive every file is archived, an
+            # empty index doesn't know any archived state
+            lookup_index = pybacked.index.ArchiveIndex(config.archive)
+
+        if reporter is not None:
+            reporter.start_phase(
+                "scan", pybacked.progress.count_files(config.storage))
+        diffcache = pybacked.diff.collect(config.storage, config.archive,
+                                          config.diff_algorithm,
+                                          config.hash_algorithm,
+                                          detect_append=config.detect_append,
+                                          hash_cache=hash_cache,
+                                          fadvise=config.fadvise,
+                                          index=lookup_index)
+        file_dict = create_filedict(diffcache)
+        offsets = create_offsetdict(diffcache)
+        if config.reverse_incremental:
+            # the full archive holds the whole content of appended files
+            offsets = dict()
+        count_changes(diffcache)
+        pybacked.progress.finish_phase()
+        archname = get_new_archive_name(config.archive)
+        arch_full_path = os.path.abspath(config.archive + "/" + archname)
+        members = len(file_dict)
+        reverse_path = None
+
+        try:
+            # write files to archive
+            if reporter is not None:
+                reporter.start_phase("archive", len(file_dict),
+                                     count_bytes(file_dict, offsets))
+            pybacked.zip_handler.create_archive(arch_full_path, file_dict,
+                                                config.compression_algorithm,
+                                                config.compresslevel, offsets,
+                                                config.fadvise)
+            pybacked.progress.finish_phase()
+
+            # write log to archive
+            if base is None:
+                pybacked.logging.write_log(diffcache, arch_full_path,
+                                           config.compression_algorithm,
+                                           config.compresslevel)
+            else:
+                base_path = os.path.abspath(config.archive + "/" +
+                                            base.filename)
+                base_log = pybacked.reverse.get_log(base_path)
+                changes = pybacked.reverse.get_changes(diffcache)
+                removed, members = pybacked.reverse.complete_full(
+                    arch_full_path, base_path, base_log, changes,
+                    config.storage, config.compression_algorithm,
+                    config.compresslevel)
+                reverse_path, reverse_members = \
+                    pybacked.reverse.write_reverse_delta(
+                        base_path, base_log, base.timestamp, changes,
+                        removed, config.compression_algorithm,
+                        config.compresslevel)
+
+            # write metadata.json
+            timestamp = time.time()
+            stats.total = time.perf_counter() - start
+            metadata = pybacked.logging.MetadataContainer(
+                timestamp=timestamp, stats=stats.get_dict())
+            if kind != pybacked.ARCHIVE_INCREMENTAL:
+                metadata.kind = kind
+            pybacked.logging.write_metadata(metadata, arch_full_path,
+                                            config.compression_algorithm,
+                                            config.compresslevel)
+
+            # record the archive in the manifest once it is complete
+            entry = pybacked.manifest.ManifestEntry(
+                pybacked.manifest.get_archive_number(archname), archname,
+                timestamp, os.path.getsize(arch_full_path), members, kind)
+            if base is None:
+                pybacked.manifest.append_entry(config.archive, entry)
+        except FileExistsError:
+            raise
+        except BaseException:
+            # never leave an incomplete archive behind, as restores would
+            # read it as the newest state
+            if os.path.isfile(arch_full_path):
+                os.remove(arch_full_path)
+            if reverse_path is not None and os.path.isfile(reverse_path):
+                os.remove(reverse_path)
+            raise
+
+        if base is not None:
+            reverse_entry = pybacked.manifest.ManifestEntry(
+                base.sequence, base.filename, base.timestamp,
+                os.path.getsize(reverse_path), reverse_members,
+                pybacked.ARCHIVE_REVERSE)
+            pybacked.reverse.commit(config.archive, reverse_entry,
+                                    reverse_path, entry)
+
+        # the hash cache is only written once the archive is complete
+        if hash_cache is not None:
+            pybacked.hash_cache.write_hash_cache(hash_cache, config.archive)
+        if index is not None:
+            if base is None:
+                index.add_archive(arch_full_path, entry.kind, entry.size)
+            else:
+                # the previous full archive was replaced
+                index.refresh()
+    stats.total = time.perf_counter() - start
+
+    if config.metrics_dir is not None:
+        pybacked.prometheus.export(config, "backup", stats,
+                                   os.path.getsize(arch_full_path))
+    return stats
+
+
+def count_changes(diffcache):
+    """
+    Count the files and bytes of all the changes in the DiffCache per
+    difftype in the active Stats object.
+
+    :param diffcache: The DiffCache with the detected changes
+    :type diffcache: DiffCache
+    :return: void
+    :rtype: None
     """
-    diffcache = pybacked.diff.collect(config.storage, config.archive,
-                                      config.diff_algorithm,
-                                      config.hash_algorithm, )
-    file_dict = create_filedict(diffcache)
-    archname = get_new_archive_name(config.archive)
-    arch_full_path = os.path.abspath(config.archive + "/" + archname)
+    for element in diffcache:
+        if element[2]:
+            count_changes(element[1])
+        elif element[1].difftype == '-':
+            pybacked.instrumentation.count_change('-', 0)
+        elif element[1].difftype == 'a':
+            size = os.path.getsize(element[0]) - element[1].offset
+            pybacked.instrumentation.count_change('a', size)
+        else:
+            size = os.path.getsize(element[0])
+            pybacked.instrumentation.count_change(element[1].difftype, size)
 
-    # write files to archive
-    pybacked.zip_handler.create_archive(arch_full_path, file_dict,
-                                        config.compression_algorithm,
-                                        config.compresslevel)
 
-    # write log to archive
-    pybacked.logging.write_log(diffcache, arch_full_path,
-                               config.compression_algorithm,
-                               config.compresslevel)
+def count_bytes(filedict, offsets):
+    """
+    Count the bytes that have to be written to the archive for the files of
+    a filedict.
 
-    # write metadata.json
-    timestamp = time.time()
-    metadata = pybacked.logging.MetadataContainer(timestamp=timestamp)
-    pybacked.logging.write_metadata(metadata, arch_full_path,
-                                    config.compression_algorithm,
-                                    config.compresslevel)
+    :param filedict: Dictionary of filepath, filename key-value pairs
+    :type filedict: dict
+    :param offsets: Dictionary of filepath, offset key-value pairs of the
+        appended files
+    :type offsets: dict
+    :return: The number of bytes to archive
+    :rtype: int
+    """
+    size = 0
+    for filepath in filedict:
+        size += os.path.getsize(filepath) - offsets.get(filepath, 0)
+    return size
 
 
 def create_filedict(diffcache, subdir=""):
@@ -68,18 +257,101 @@ def create_filedict(diffcache, subdir=""):
     return dictionary
 
 
+def create_offsetdict(diffcache):
+    """
+    Create a dictionary of filepath, offset key-value pairs for each appended
+    file in the DiffCache. Only the data after the offset has to be written
+    to the archive for these files.
+
+    :param diffcache: The DiffCache from which the dictionary should be
+        created.
+    :type diffcache: DiffCache
+    :return: Returns a dictionary of filepath, offset key-value pairs which
+        can be passed to zip_handler.create_archive().
+    :rtype: dict
+    """
+    dictionary = {}
+    for element in diffcache:
+        if element[2]:
+            dictionary.update(create_offsetdict(element[1]))
+        elif element[1].difftype == 'a':
+            dictionary[element[0]] = element[1].offset
+    return dictionary
+
+
+def get_chain(entries):
+    """
+    Return the archives, which a restore of the newest archive replays: the
+    newest full archive and all archives after it, or all archives if there
+    is no full archive.
+
+    :param entries: The manifest entries ordered by sequence
+    :type entries: list
+    :return: The entries of the chain
+    :rtype: list
+    """
+    for position in range(len(entries) - 1, -1, -1):
+        if entries[position].kind == pybacked.ARCHIVE_FULL:
+            return entries[position:]
+    return entries
+
+
 def get_new_archive_name(archive_dir):
     """
     Checks for existing archives and returns the name of the next archive to
-    be created.
+    be created. The number of the newest archive is read from the end of the
+    manifest, which backup() reconciled with the archives in the directory
+    before (see manifest.reconcile_manifest()).
 
     :param archive_dir: The directory in which the archives are located
     :type archive_dir: str
     :return: Returns the name, that the next archive should have
     :rtype: str
     """
-    archive_list = pybacked.restore.get_archive_list(archive_dir)
-    last_archive = os.path.basename(archive_list[0])
-    archive_number = int(last_archive.split('.')[0][-1]) + 1
+    last_entry = pybacked.manifest.read_last_entry(archive_dir)
+    if last_entry is not None:
+        archive_number = last_entry.sequence + 1
+    else:
+        archive_number = 1
+        for archivepath in pybacked.restore.get_archive_list(archive_dir):
+            number = pybacked.manifest.get_archive_number(
+                os.path.basename(archivepath))
+            if number is not None:
+                archive_number = max(archive_number, number + 1)
     archive_name = "arch" + str(archive_number) + ".zip"
     return archive_name
+
+
+def is_full_due(config, now):
+    """
+    Check whether the next backup of a configuration has to be a full
+    archive, because the restore chain of the newest archive reached the
+    full_every length or full_chain_size, or its root is older than
+    full_interval. The sizes and timestamps are taken from the manifest.
+
+    :param config: The configuration
+    :type config: Configuration
+    :param now: The current timestamp
+    :type now: float
+    :return: True if a full archive has to be written
+    :rtype: bool
+    """
+    if config.full_every is None and config.full_interval is None and \
+            config.full_chain_size is None:
+        return False
+    entries = pybacked.manifest.read_manifest(config.archive)
+    if entries is None:
+        entries = pybacked.manifest.rebuild_manifest(config.archive)
+    chain = get_chain(entries)
+    if not chain:
+        return True
+    if config.full_every is not None and len(chain) >= config.full_every:
+        return True
+    if config.full_interval is not None and (
+            chain[0].timestamp is None or
+            chain[0].timestamp <= now - config.full_interval):
+        return True
+    if config.full_chain_size is not None and \
+            sum(entry.size for entry in chain) >= config.full_chain_size:
+        return True
+    return False
@@ -0,0 +1,71 @@
+import contextlib
+import threading
+
+_local = threading.local()
+
+
+class Cancelled(Exception):
+    """
+    Raised at a safe point of a backup or restore run, after the active
+    CancelToken was cancelled.
+    """
+
+
+class CancelToken:
+    """
+    A flag that can be set from any thread to stop a backup or restore run
+    running in another thread. The run checks the token of its thread at safe
+    points, where stopping leaves nothing behind that can't be cleaned up.
+    Tokens are activated with activate().
+    """
+    def __init__(self):
+        self.event = threading.Event()
+
+    def cancel(self):
+        """
+        Request the cancellation of the run.
+
+        :return: void
+        :rtype: None
+        """
+        self.event.set()
+
+    def is_cancelled(self):
+        """
+        Check whether the cancellation was requested.
+
+        :return: True if cancel() was called
+        :rtype: bool
+        """
+        return self.event.is_set()
+
+
+@contextlib.contextmanager
+def activate(token):
+    """
+    Activate a CancelToken for the current thread. Every check() inside of the
+    context raises Cancelled once the token is cancelled.
+
+    :param token: The token to check
+    :type token: CancelToken
+    """
+    previous = getattr(_local, "token", None)
+    _local.token = token
+    try:
+        yield token
+    finally:
+        _local.token = previous
+
+
+def check():
+    """
+    Raise Cancelled if the CancelToken active in the current thread was
+    cancelled. Does nothing if no token is active.
+
+    :raises Cancelled: if the active token was cancelled
+    :return: void
+    :rtype: None
+    """
+    token = getattr(_local, "token", None)
+    if token is not None and token.event.is_set():
+        raise Cancelled("The run was cancelled")
@@ -0,0 +1,256 @@
+import bisect
+import fnmatch
+import os
+import pybacked.index
+import pybacked.manifest
+import re
+
+SEARCH_GLOB = "glob"
+SEARCH_REGEX = "regex"
+SEARCH_PREFIX = "prefix"
+
+# characters which end the literal part of a glob pattern
+GLOB_SPECIAL = "*?[]"
+
+
+class CatalogRow:
+    """
+    The diff-log entry of a file in an archive, as found by a search.
+
+    :param path: The archive relative filename
+    :type path: str
+    :param archive: The name of the archive
+    :type archive: str
+    :param modtype: The modtype of the diff-log entry
+    :type modtype: str
+    :param state: The diff of the diff-log entry (the hash, date or size of
+        the archived file)
+    :type state: str
+    :param timestamp: The timestamp of the archive, None if it is unknown
+    :type timestamp: float
+    """
+    def __init__(self, path, archive, modtype, state, timestamp):
+        self.path = path
+        self.archive = archive
+        self.modtype = modtype
+        self.state = state
+        self.timestamp = timestamp
+
+    def __eq__(self, other):
+        return self.get_tuple() == other.get_tuple()
+
+    def __repr__(self):
+        return "CatalogRow" + repr(self.get_tuple())
+
+    def get_tuple(self):
+        """
+        :return: The path, archive, modtype, state and timestamp of the row
+        :rtype: tuple
+        """
+        return (self.path, self.archive, self.modtype, self.state,
+                self.timestamp)
+
+
+class Catalog:
+    """
+    A searchable catalog of the diff-log entries of all archives of an
+    archive directory. Every archived filename is kept once in a sorted list,
+    and once reversed in another sorted list, so prefix queries and glob
+    patterns starting or ending with a literal part are answered by a binary
+    search instead of a scan. The rows of a filename are kept in the order of
+    the archives. Like the ArchiveIndex it is built on, the catalog is built
+    once and updated incrementally by refresh().
+
+    :param archive_dir: The directory in which the archives are stored
+    :type archive_dir: str
+    :param index: The index of the archive directory the diff-logs are
+        taken from. A new index is created if this is None.
+    :type index: pybacked.index.ArchiveIndex, optional
+    """
+    def __init__(self, archive_dir, index=None):
+        self.archive_dir = archive_dir
+        if index is None:
+            index = pybacked.index.ArchiveIndex(archive_dir)
+        self.index = index
+        self.clear()
+
+    def clear(self):
+        """
+        Remove all rows from the catalog.
+
+        :return: void
+        :rtype: None
+        """
+        self.rows = dict()
+        self.paths = []
+        self.reversed_paths = []
+        self.signature = []
+
+    def refresh(self):
+        """
+        Bring the catalog up to date with the archive directory. The rows of
+        new archives are added incrementally, if archives were removed,
+        replaced or inserted in between, the catalog is rebuilt.
+
+        :return: void
+        :rtype: None
+        """
+        self.index.refresh()
+        signature = self.index.signature
+        if signature[:len(self.signature)] != self.signature:
+            self.clear()
+        if len(signature) == len(self.signature):
+            return
+        timestamps = dict()
+        entries = pybacked.manifest.read_manifest(self.archive_dir)
+        if entries is not None:
+            for entry in entries:
+                timestamps[entry.filename] = entry.timestamp
+        added = []
+        for archivepath, kind, size in signature[len(self.signature):]:
+            archive = os.path.basename(archivepath)
+            timestamp = timestamps.get(archive)
+            for filename, diff, dirflag in self.index.get_diffcache(
+                    archivepath):
+                rows = self.rows.get(filename)
+                if rows is None:
+                    rows = []
+                    self.rows[filename] = rows
+                    added.append(filename)
+                rows.append(CatalogRow(filename, archive, diff.difftype,
+                                       diff.state, timestamp))
+        self.signature = list(signature)
+        if added:
+            # sorting the concatenation of two sorted runs merges them
+            self.paths.extend(added)
+            self.paths.sort()
+            self.reversed_paths.extend(path[::-1] for path in added)
+            self.reversed_paths.sort()
+
+    def glob(self, pattern):
+        """
+        Find the rows of the filenames matching a glob pattern. As with
+        fnmatch, "*" also matches "/", so "*/settings.yaml" matches that
+        filename in every subdirectory.
+
+        :param pattern: The glob pattern
+        :type pattern: str
+        :return: A generator of CatalogRow objects ordered by path and archive
+        :rtype: generator
+        """
+        prefix = get_literal_prefix(pattern)
+        suffix = get_literal_prefix(pattern[::-1])[::-1]
+        if len(suffix) > len(prefix):
+            candidates = sorted(path[::-1] for path in
+                                get_prefixed(self.reversed_paths,
+                                             suffix[::-1]))
+        else:
+            candidates = get_prefixed(self.paths, prefix)
+        for path in candidates:
+            if fnmatch.fnmatchcase(path, pattern):
+                for row in self.rows[path]:
+                    yield row
+
+    def prefix(self, prefix):
+        """
+        Find the rows of the filenames starting with a prefix.
+
+        :param prefix: The prefix, e.g. a directory followed by "/"
+        :type prefix: str
+        :return: A generator of CatalogRow objects ordered by path and archive
+        :rtype: generator
+        """
+        for path in get_prefixed(self.paths, prefix):
+            for row in self.rows[path]:
+                yield row
+
+    def regex(self, pattern):
+        """
+        Find the rows of the filenames containing a match of a regular
+        expression. This tests every archived filename once.
+
+        :param pattern: The regular expression
+        :type pattern: str or re.Pattern
+        :return: A generator of CatalogRow objects ordered by path and archive
+        :rtype: generator
+        """
+        expression = re.compile(pattern)
+        for path in self.paths:
+            if expression.search(path) is not None:
+                for row in self.rows[path]:
+                    yield row
+
+    def search(self, pattern, mode=SEARCH_GLOB):
+        """
+        Find the rows of the filenames matching a query.
+
+        :param pattern: The glob pattern, regular expression or prefix
+        :type pattern: str
+        :param mode: One of SEARCH_GLOB, SEARCH_REGEX or SEARCH_PREFIX
+            (default is SEARCH_GLOB)
+        :type mode: str, optional
+        :return: A generator of CatalogRow objects ordered by path and archive
+        :rtype: generator
+        """
+        if mode == SEARCH_GLOB:
+            return self.glob(pattern)
+        elif mode == SEARCH_REGEX:
+            return self.regex(pattern)
+        elif mode == SEARCH_PREFIX:
+            return self.prefix(pattern)
+        raise ValueError("Unknown search mode: " + repr(mode))
+
+
+def get_literal_prefix(pattern):
+    """
+    Get the part of a glob pattern before its first special character.
+
+    :param pattern: The glob pattern
+    :type pattern: str
+    :return: The literal prefix
+    :rtype: str
+    """
+    for position, char in enumerate(pattern):
+        if char in GLOB_SPECIAL:
+            return pattern[:position]
+    return pattern
+
+
+def get_prefixed(paths, prefix):
+    """
+    Iterate over the paths of a sorted list starting with a prefix.
+
+    :param paths: The sorted paths
+    :type paths: list
+    :param prefix: The prefix
+    :type prefix: str
+    :return: A generator of the paths in order
+    :rtype: generator
+    """
+    position = bisect.bisect_left(paths, prefix)
+    while position < len(paths) and paths[position].startswith(prefix):
+        yield paths[position]
+        position += 1
+
+
+def search(config, pattern, mode=SEARCH_GLOB, catalog=None):
+    """
+    Search the diff-logs of all archives of a configuration.
+
+    :param config: The configuration of the archive directory
+    :type config: Configuration
+    :param pattern: The glob pattern, regular expression or prefix
+    :type pattern: str
+    :param mode: One of SEARCH_GLOB, SEARCH_REGEX or SEARCH_PREFIX
+        (default is SEARCH_GLOB)
+    :type mode: str, optional
+    :param catalog: A catalog of the archive directory, which is refreshed
+        and reused instead of building a new one
+    :type catalog: Catalog, optional
+    :return: A list of CatalogRow objects ordered by path and archive
+    :rtype: list
+    """
+    if catalog is None:
+        catalog = Catalog(config.archive)
+    catalog.refresh()
+    return list(catalog.search(pattern, mode))
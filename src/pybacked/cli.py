@@ -0,0 +1,220 @@
+import argparse
+import datetime
+import os
+import pybacked.catalog
+import pybacked.config
+import pybacked.restore
+import pybacked.snapshot
+import sys
+
+CHANGE_SYMBOLS = {pybacked.snapshot.CHANGE_ADDED: '+',
+                  pybacked.snapshot.CHANGE_REMOVED: '-',
+                  pybacked.snapshot.CHANGE_MODIFIED: '*'}
+
+
+def create_parser():
+    """
+    Create the parser of the command line arguments.
+
+    :return: The parser with one subparser per command
+    :rtype: argparse.ArgumentParser
+    """
+    parser = argparse.ArgumentParser(prog="pybacked")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    diff_parser = subparsers.add_parser(
+        "diff", help="list the files changed between two archives")
+    diff_parser.add_argument("config_file", help="the path to the config file")
+    diff_parser.add_argument("name", help="the name of the configuration")
+    diff_parser.add_argument("old", help="the archive of the old state")
+    diff_parser.add_argument("new", help="the archive of the new state")
+    diff_parser.set_defaults(function=run_diff)
+
+    search_parser = subparsers.add_parser(
+        "search", help="find the archived versions of files")
+    search_parser.add_argument("config_file",
+                               help="the path to the config file")
+    search_parser.add_argument("name", help="the name of the configuration")
+    search_parser.add_argument("pattern",
+                               help="a glob pattern (default), a regular "
+                                    "expression or a prefix")
+    mode_group = search_parser.add_mutually_exclusive_group()
+    mode_group.add_argument("--regex", dest="mode", action="store_const",
+                            const=pybacked.catalog.SEARCH_REGEX,
+                            help="the pattern is a regular expression")
+    mode_group.add_argument("--prefix", dest="mode", action="store_const",
+                            const=pybacked.catalog.SEARCH_PREFIX,
+                            help="the pattern is a filename prefix")
+    search_parser.set_defaults(function=run_search,
+                               mode=pybacked.catalog.SEARCH_GLOB)
+
+    restore_parser = subparsers.add_parser(
+        "restore", help="restore the state of an archive or point in time")
+    restore_parser.add_argument("config_file",
+                                help="the path to the config file")
+    restore_parser.add_argument("name", help="the name of the configuration")
+    target_group = restore_parser.add_mutually_exclusive_group(required=True)
+    target_group.add_argument("archive", nargs="?",
+                              help="the archive to restore")
+    target_group.add_argument("--at", type=parse_time,
+                              help="restore the newest archive created at "
+                                   "or before this time, an ISO 8601 date "
+                                   "(local time if it has no offset) or a "
+                                   "timestamp")
+    restore_parser.add_argument("--alt-dir",
+                                help="restore to this directory instead of "
+                                     "the storage directory")
+    restore_parser.add_argument("--path",
+                                help="restore only this file (by default to "
+                                     "its path in the storage directory)")
+    restore_parser.set_defaults(function=run_restore)
+    return parser
+
+
+def get_config(filepath, name):
+    """
+    Read a configuration from a config file.
+
+    :param filepath: The path to the config file
+    :type filepath: str
+    :param name: The name of the configuration
+    :type name: str
+    :return: The configuration
+    :rtype: Configuration
+    :raises KeyError: If the config file has no configuration of that name
+    """
+    file = open(filepath, 'r')
+    configs = pybacked.config.deserialize_config(file.read())
+    file.close()
+    for config in configs:
+        if config.name == name:
+            return config
+    raise KeyError("Unknown configuration: " + repr(name))
+
+
+def parse_time(value):
+    """
+    Parse a point in time given on the command line.
+
+    :param value: An ISO 8601 date, which is in local time if it has no UTC
+        offset, or a timestamp
+    :type value: str
+    :return: The timestamp
+    :rtype: float
+    :raises ValueError: If the value is neither
+    """
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+
+
+def run_diff(config, args, output):
+    """
+    Write the files changed between two archives, one per line prefixed with
+    '+' (added), '-' (removed) or '*' (modified).
+
+    :param config: The configuration of the archive directory
+    :type config: Configuration
+    :param args: The parsed arguments of the diff command
+    :type args: argparse.Namespace
+    :param output: The stream the changes are written to
+    :type output: file object
+    :return: The exit status
+    :rtype: int
+    """
+    for change in pybacked.snapshot.compare(config, args.old, args.new):
+        output.write(CHANGE_SYMBOLS[change.change] + " " + change.path + "\n")
+    return 0
+
+
+def run_restore(config, args, output):
+    """
+    Restore the state of an archive, or of the newest archive created at or
+    before the given time, and write the name of the restored archive. With
+    a path only that file is restored, to the alternative directory if one
+    is given.
+
+    :param config: The configuration of the archive directory
+    :type config: Configuration
+    :param args: The parsed arguments of the restore command
+    :type args: argparse.Namespace
+    :param output: The stream the archive name is written to
+    :type output: file object
+    :return: The exit status, 1 if there is no archive of that time or the
+        file wasn't found
+    :rtype: int
+    """
+    if args.at is not None:
+        try:
+            archname = pybacked.restore.get_archive_at(config, args.at)
+        except ValueError as error:
+            sys.stderr.write(str(error) + "\n")
+            return 1
+    else:
+        archname = args.archive
+    if args.path is None:
+        pybacked.restore.restore(config, archname, args.alt_dir)
+        output.write(archname + "\n")
+        return 0
+    dest = None
+    if args.alt_dir is not None:
+        dest = os.path.abspath(args.alt_dir + "/" + args.path)
+    result = pybacked.restore.fetch(config, args.path, archname, dest)
+    output.write(archname + ": " + result.filename + " " + result.status +
+                 "\n")
+    if result.status != pybacked.restore.FETCH_RESTORED:
+        return 1
+    return 0
+
+
+def run_search(config, args, output):
+    """
+    Write the archived versions of the files matching a pattern, one per
+    line with the tab separated filename, archive, modtype, archive time (in
+    UTC) and state.
+
+    :param config: The configuration of the archive directory
+    :type config: Configuration
+    :param args: The parsed arguments of the search command
+    :type args: argparse.Namespace
+    :param output: The stream the rows are written to
+    :type output: file object
+    :return: The exit status
+    :rtype: int
+    """
+    catalog = pybacked.catalog.Catalog(config.archive)
+    catalog.refresh()
+    for row in catalog.search(args.pattern, args.mode):
+        if row.timestamp is None:
+            time = "-"
+        else:
+            time = datetime.datetime.fromtimestamp(
+                row.timestamp, datetime.timezone.utc).isoformat()
+        output.write("\t".join([row.path, row.archive, row.modtype, time,
+                                row.state or ""]) + "\n")
+    return 0
+
+
+def main(argv=None, output=None):
+    """
+    Run the command line interface.
+
+    :param argv: The command line arguments (default is sys.argv[1:])
+    :type argv: list, optional
+    :param output: The stream the output is written to (default is
+        sys.stdout)
+    :type output: file object, optional
+    :return: The exit status
+    :rtype: int
+    """
+    if output is None:
+        output = sys.stdout
+    parser = create_parser()
+    args = parser.parse_args(argv)
+    try:
+        config = get_config(args.config_file, args.name)
+    except KeyError as error:
+        parser.error(error.args[0])
+    return args.function(config, args, output)
@@ -17,7 +17,7 @@ class Configuration:
     :param archive: The directory where for the backup-archive
     :type archive: str
     :param diff_algorithm: The desired diff method. One of (DIFF_CONT,
-        DIFF_DATE, DIFF_HASH)
+        DIFF_DATE, DIFF_HASH, DIFF_STAT)
     :type diff_algorithm: int
     :param compression_algorithm: The desired zip compression algorithm as
         given by the zipfile module.
@@ -31,9 +31,73 @@ class Configuration:
         DIFF_HASH is selected as the diff method). The available options can
         be found in the __init__.py file.
     :type hash_algorithm: str, optional
+    :param detect_append: If True, files which only grew at the end since the
+        last archived state are recognized as appended and only the new tail
+        is archived. Only supported by DIFF_HASH and DIFF_CONT, as the other
+        diff methods don't store a fingerprint of the file content.
+        (default is False)
+    :type detect_append: bool, optional
+    :param full_verify_interval: If set, DIFF_HASH uses tiered hashing: the
+        full hash of a file is only computed if its size or the hash of
+        sampled blocks changed, or if the last full hash is older than
+        full_verify_interval seconds. (default is None, which always computes
+        the full hash)
+    :type full_verify_interval: float, optional
+    :param fadvise: If True, the kernel is advised to read files sequentially
+        and to drop them from the page cache once they were hashed, archived
+        or restored. This keeps backups from evicting the working set of other
+        services on the host. (default is False)
+    :type fadvise: bool, optional
+    :param metrics_dir: If set, the metrics of each backup and restore run
+        are written to a .prom file in this directory, which can be read by
+        the textfile collector of the prometheus node_exporter.
+        (default is None)
+    :type metrics_dir: str, optional
+    :param read_limit: The maximum read bandwidth in bytes per second for
+        hashing, archiving and extracting files. (default is None, which
+        doesn't limit the bandwidth)
+    :type read_limit: int, optional
+    :param write_limit: The maximum write bandwidth in bytes per second for
+        writing archives and restored files. (default is None)
+    :type write_limit: int, optional
+    :param cpu_limit: The maximum fraction of a CPU core a backup or restore
+        may use, for example 0.5 for half a core. (default is None)
+    :type cpu_limit: float, optional
+    :param throttle_control: The path to a json file which overrides the
+        read_limit, write_limit and cpu_limit while a backup or restore is
+        running. The file is reread when it changes. (default is None)
+    :type throttle_control: str, optional
+    :param retention: The retention rules applied by
+        pybacked.retention.apply_retention(), a dictionary mapping a period
+        ("hour", "day", "week", "month" or "year") to the number of seconds
+        for which the newest archive of each period is kept, None keeping it
+        forever. (default is None, which uses
+        pybacked.retention.DEFAULT_RULES)
+    :type retention: dict, optional
+    :param reverse_incremental: If True, every backup writes a full archive
+        and rewrites the previous full archive into a reverse delta, which
+        only holds what is needed to step back to its state. Restoring the
+        newest state then reads a single archive. (default is False)
+    :type reverse_incremental: bool, optional
+    :param full_every: Write a full archive once the restore chain since the
+        last full archive holds full_every archives, which bounds the number
+        of archives replayed by a restore. (default is None)
+    :type full_every: int, optional
+    :param full_interval: Write a full archive once the last full archive is
+        older than full_interval seconds. (default is None)
+    :type full_interval: float, optional
+    :param full_chain_size: Write a full archive once the archives since the
+        last full archive, which a restore has to read, hold at least
+        full_chain_size bytes. (default is None)
+    :type full_chain_size: int, optional
     """
     def __init__(self, name, storage, archive, diff_algorithm,
-                 compression_algorithm, compresslevel, hash_algorithm=None):
+                 compression_algorithm, compresslevel, hash_algorithm=None,
+                 detect_append=False, full_verify_interval=None,
+                 fadvise=False, metrics_dir=None, read_limit=None,
+                 write_limit=None, cpu_limit=None, throttle_control=None,
+                 retention=None, reverse_incremental=False,
+                 full_every=None, full_interval=None, full_chain_size=None):
         self.name = name
         self.storage = storage
         self.archive = archive
@@ -41,6 +105,19 @@ class Configuration:
         self.compression_algorithm = compression_algorithm
         self.compresslevel = compresslevel
         self.hash_algorithm = hash_algorithm
+        self.detect_append = detect_append
+        self.full_verify_interval = full_verify_interval
+        self.fadvise = fadvise
+        self.metrics_dir = metrics_dir
+        self.read_limit = read_limit
+        self.write_limit = write_limit
+        self.cpu_limit = cpu_limit
+        self.throttle_control = throttle_control
+        self.retention = retention
+        self.reverse_incremental = reverse_incremental
+        self.full_every = full_every
+        self.full_interval = full_interval
+        self.full_chain_size = full_chain_size
 
     def __eq__(self, other):
         if self.name != other.name:
@@ -57,6 +134,32 @@ class Configuration:
             return False
         elif self.hash_algorithm != other.hash_algorithm:
             return False
+        elif self.detect_append != other.detect_append:
+            return False
+        elif self.full_verify_interval != other.full_verify_interval:
+            return False
+        elif self.fadvise != other.fadvise:
+            return False
+        elif self.metrics_dir != other.metrics_dir:
+            return False
+        elif self.read_limit != other.read_limit:
+            return False
+        elif self.write_limit != other.write_limit:
+            return False
+        elif self.cpu_limit != other.cpu_limit:
+            return False
+        elif self.throttle_control != other.throttle_control:
+            return False
+        elif self.retention != other.retention:
+            return False
+        elif self.reverse_incremental != other.reverse_incremental:
+            return False
+        elif self.full_every != other.full_every:
+            return False
+        elif self.full_interval != other.full_interval:
+            return False
+        elif self.full_chain_size != other.full_chain_size:
+            return False
         else:
             return True
 
@@ -76,13 +179,39 @@ class Configuration:
         compression_alg = self.compression_algorithm
         compresslevel = self.compresslevel
         hash_algorithm = self.hash_algorithm
+        detect_append = self.detect_append
+        full_verify_interval = self.full_verify_interval
+        fadvise = self.fadvise
+        metrics_dir = self.metrics_dir
+        read_limit = self.read_limit
+        write_limit = self.write_limit
+        cpu_limit = self.cpu_limit
+        throttle_control = self.throttle_control
+        retention = self.retention
+        reverse_incremental = self.reverse_incremental
+        full_every = self.full_every
+        full_interval = self.full_interval
+        full_chain_size = self.full_chain_size
 
         configuration_dir = {"name": name, "storage": storage,
                              "archive": archive,
                              "diff_algorithm": diff_algorithm,
                              "compression_algorithm": compression_alg,
                              "compresslevel": compresslevel,
-                             "hash_algorithm": hash_algorithm}
+                             "hash_algorithm": hash_algorithm,
+                             "detect_append": detect_append,
+                             "full_verify_interval": full_verify_interval,
+                             "fadvise": fadvise,
+                             "metrics_dir": metrics_dir,
+                             "read_limit": read_limit,
+                             "write_limit": write_limit,
+                             "cpu_limit": cpu_limit,
+                             "throttle_control": throttle_control,
+                             "retention": retention,
+                             "reverse_incremental": reverse_incremental,
+                             "full_every": full_every,
+                             "full_interval": full_interval,
+                             "full_chain_size": full_chain_size}
 
         return configuration_dir
 
@@ -107,7 +236,21 @@ def deserialize_config(data):
                                current_config['diff_algorithm'],
                                current_config['compression_algorithm'],
                                current_config['compresslevel'],
-                               current_config['hash_algorithm'])
+                               current_config['hash_algorithm'],
+                               current_config.get('detect_append', False),
+                               current_config.get('full_verify_interval'),
+                               current_config.get('fadvise', False),
+                               current_config.get('metrics_dir'),
+                               current_config.get('read_limit'),
+                               current_config.get('write_limit'),
+                               current_config.get('cpu_limit'),
+                               current_config.get('throttle_control'),
+                               current_config.get('retention'),
+                               current_config.get('reverse_incremental',
+                                                  False),
+                               current_config.get('full_every'),
+                               current_config.get('full_interval'),
+                               current_config.get('full_chain_size'))
         config_list.append(config)
     return config_list
 
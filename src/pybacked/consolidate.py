@@ -0,0 +1,240 @@
+import os
+import pybacked
+import pybacked.diff
+import pybacked.logging
+import pybacked.manifest
+import pybacked.restore
+import pybacked.zip_handler
+import tempfile
+import zipfile
+
+
+class FileChange:
+    """
+    The change of a file over one or more archives.
+
+    :param modtype: The modtype of the change ('+', '-', '*' or 'a')
+    :type modtype: str
+    :param diff: The diff of the newest diff-log entry of the file
+    :type diff: str
+    :param parts: The archives holding the data of the file. For appends the
+        data of all parts is concatenated. Empty for removed files.
+    :type parts: list
+    """
+    def __init__(self, modtype, diff, parts):
+        self.modtype = modtype
+        self.diff = diff
+        self.parts = parts
+
+
+def consolidate(config, archname=None, prune=False):
+    """
+    Merge the archives, which have to be replayed to restore the state of an
+    archive, into a synthetic full archive. The full archive replaces the
+    archive and holds the complete state at its creation, so restores and
+    lookups no longer read the archives before it. Member data is copied
+    without recompressing it, only files archived as a chain of appended
+    tails are recompressed into a single member. The source files aren't
+    read.
+
+    The full archive is written to a temporary file first and then committed
+    together with the manifest through a journal, which the next run
+    completes if this one is killed (see manifest.recover()).
+
+    This must not run concurrently with a backup of the same archive
+    directory.
+
+    :param config: The configuration of the archive directory
+    :type config: Configuration
+    :param archname: The name of the archive to consolidate (default is the
+        newest archive)
+    :type archname: str, optional
+    :param prune: Remove the merged archives before the consolidated archive.
+        Their states can't be restored afterwards.
+    :type prune: bool, optional
+    :return: The manifest entry of the consolidated archive
+    :rtype: pybacked.manifest.ManifestEntry
+    """
+    pybacked.manifest.recover(config.archive)
+    entries = pybacked.manifest.read_manifest(config.archive)
+    if entries is None:
+        entries = pybacked.manifest.rebuild_manifest(config.archive)
+    # the entries read by read_manifest() are cached, they aren't changed
+    entries = list(entries)
+    archive_list = [get_archive_path(config.archive, entry)
+                    for entry in entries]
+    kinds = pybacked.restore.get_archive_kinds(config.archive)
+    if archname is None:
+        position = len(entries) - 1
+    else:
+        position = archive_list.index(
+            os.path.abspath(config.archive + "/" + archname))
+    target = entries[position]
+    if target.kind == pybacked.ARCHIVE_FULL:
+        return target
+
+    positions = pybacked.restore.get_restore_chain(archive_list, kinds,
+                                                   position)
+    chain = [archive_list[i] for i in positions]
+    state = dict()
+    for filename, change in fold_archives(chain).items():
+        if change.modtype != '-':
+            # the chain starts with the complete state, so every file is new
+            change.modtype = '+'
+            state[filename] = change
+
+    temp_descriptor, temp_path = tempfile.mkstemp(
+        dir=config.archive, prefix=".consolidate-", suffix=".tmp")
+    os.close(temp_descriptor)
+    try:
+        write_archive(temp_path, state, target.timestamp,
+                      config.compression_algorithm, config.compresslevel,
+                      pybacked.ARCHIVE_FULL)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+    consolidated = pybacked.manifest.create_entry(temp_path, target.sequence)
+    consolidated.filename = target.filename
+    entries[position] = consolidated
+    removed = []
+    if prune:
+        # the archives after a reverse delta stay, they hold newer states
+        removed = [entries[i].filename for i in positions if i < position]
+        entries = [entry for entry in entries
+                   if entry.filename not in removed]
+    pybacked.manifest.commit_changes(
+        config.archive, entries,
+        {os.path.basename(temp_path): target.filename}, removed)
+    return consolidated
+
+
+def get_archive_path(archive_dir, entry):
+    """
+    Return the path of the archive of a manifest entry.
+
+    :param archive_dir: The directory in which the archives are stored
+    :type archive_dir: str
+    :param entry: The manifest entry
+    :type entry: pybacked.manifest.ManifestEntry
+    :return: The path to the archive
+    :rtype: str
+    """
+    return os.path.abspath(archive_dir + "/" + entry.filename)
+
+
+def fold_archives(archives, index=None):
+    """
+    Fold the diff-logs of consecutive archives into the changes of every file
+    from before the first to after the last archive.
+
+    :param archives: The paths to the archives in the order they are
+        replayed
+    :type archives: list
+    :param index: An index of the archive directory, from which the
+        diff-logs are taken instead of reading them from the archives
+    :type index: pybacked.index.ArchiveIndex, optional
+    :return: A dictionary of filename, FileChange key-value pairs
+    :rtype: dict
+    """
+    changes = dict()
+    for archivepath in archives:
+        if index is not None:
+            diffcache = index.get_diffcache(archivepath)
+        else:
+            diffcache = pybacked.diff.diff_log_deserialize(archivepath)
+        for filename, diff, dirflag in diffcache:
+            if diff.difftype == '-':
+                change = FileChange('-', diff.state, [])
+            else:
+                change = FileChange(diff.difftype, diff.state, [archivepath])
+            if filename in changes:
+                change = merge_changes(changes[filename], change)
+            if change is None:
+                del changes[filename]
+            else:
+                changes[filename] = change
+    return changes
+
+
+def merge_changes(older, newer):
+    """
+    Merge two consecutive changes of a file into a single change.
+
+    :param older: The older change
+    :type older: FileChange
+    :param newer: The newer change
+    :type newer: FileChange
+    :return: The merged change, or None if the changes cancel out (a file
+        that was added and removed again)
+    :rtype: FileChange
+    """
+    if newer.modtype == '-':
+        if older.modtype == '+':
+            return None
+        return newer
+    elif newer.modtype == 'a':
+        if older.modtype == '-':
+            return newer
+        return FileChange(older.modtype, newer.diff,
+                          older.parts + newer.parts)
+    elif older.modtype == '+':
+        return FileChange('+', newer.diff, newer.parts)
+    else:
+        return FileChange('*', newer.diff, newer.parts)
+
+
+def write_archive(archivepath, changes, timestamp, compression,
+                  compresslevel, kind=None):
+    """
+    Write an archive holding the given changes. Data held by a single archive
+    is copied raw, data of append chains is recompressed.
+
+    :param archivepath: The path of the new archive
+    :type archivepath: str
+    :param changes: A dictionary of filename, FileChange key-value pairs
+    :type changes: dict
+    :param timestamp: The timestamp of the archive
+    :type timestamp: float
+    :param compression: The compression of recompressed members, the
+        diff-log and the metadata
+    :type compression: int
+    :param compresslevel: The compression level
+    :type compresslevel: int
+    :param kind: The kind of the archive, None for incremental archives
+    :type kind: str, optional
+    :return: void
+    :rtype: None
+    """
+    members = dict()
+    archive = zipfile.ZipFile(archivepath, mode='w', compression=compression,
+                              compresslevel=compresslevel)
+    try:
+        rows = []
+        for filename, change in changes.items():
+            arcname = "data/" + filename
+            if len(change.parts) == 1:
+                sourcepath = change.parts[0]
+                if sourcepath not in members:
+                    # only the member infos are kept, so a long chain
+                    # doesn't hold a file descriptor per source archive
+                    source = zipfile.ZipFile(sourcepath, mode='r')
+                    members[sourcepath] = dict(
+                        (info.filename, info) for info in source.infolist())
+                    source.close()
+                info = members[sourcepath][arcname]
+                pybacked.zip_handler.copy_member_raw(sourcepath, info,
+                                                     archive)
+            elif len(change.parts) > 1:
+                pybacked.zip_handler.write_member_chain(
+                    archive, arcname,
+                    [(part, arcname) for part in change.parts])
+            rows.append([filename, change.modtype, change.diff])
+        archive.writestr("diff-log.csv",
+                         pybacked.logging.create_log_rows(rows))
+        metadata = pybacked.logging.MetadataContainer(timestamp=timestamp,
+                                                      kind=kind)
+        archive.writestr("metadata.json",
+                         pybacked.logging.create_metadata_string(metadata))
+    finally:
+        archive.close()
@@ -0,0 +1,334 @@
+import json
+import os
+import pybacked.backup
+import pybacked.catalog
+import pybacked.hash_cache
+import pybacked.index
+import pybacked.restore
+import socket
+import socketserver
+import threading
+
+
+class Daemon:
+    """
+    Serves backup and restore requests for a set of configurations over a
+    local UNIX socket. The index of each archive directory and the hash
+    caches are kept in memory between the requests, so a backup doesn't have
+    to reread every diff-log of the archive directory.
+
+    Requests and responses are json objects, one per line. A request has an
+    "op" key, which is one of "backup", "restore", "fetch", "search",
+    "status" or "shutdown", and a "config" key with the name of the
+    configuration for backup, restore, fetch and search. A restore request
+    has an "archive" key with the name of the archive to restore, or a
+    "timestamp" key to restore the newest archive created at or before that
+    time, and an optional "alt_dir" key. A fetch request has a "path" key
+    and optional "archive" (or "timestamp") and "dest" keys. A search
+    request has a "pattern" key and an optional "mode" key. The response has
+    an "ok" key and either the "stats" of the run, the "status", "archives"
+    and "size" of a fetch, the "rows" of a search or an "error" message.
+
+    :param configs: The configurations served by the daemon
+    :type configs: list
+    :param socket_path: The path of the UNIX socket
+    :type socket_path: str
+    """
+    def __init__(self, configs, socket_path):
+        self.configs = dict()
+        self.locks = dict()
+        self.indexes = dict()
+        self.catalogs = dict()
+        self.hash_caches = dict()
+        for config in configs:
+            self.configs[config.name] = config
+            self.locks[config.name] = threading.Lock()
+        self.socket_path = socket_path
+        self.server = None
+
+    def get_index(self, config):
+        """
+        Return the up to date index of the archive directory of a
+        configuration. Has to be called with the lock of the configuration.
+
+        :param config: The configuration
+        :type config: Configuration
+        :return: The index
+        :rtype: pybacked.index.ArchiveIndex
+        """
+        index = self.indexes.get(config.name)
+        if index is None:
+            index = pybacked.index.ArchiveIndex(config.archive)
+            self.indexes[config.name] = index
+        # picks up archives written without the daemon
+        index.refresh()
+        return index
+
+    def get_archive_at(self, name, timestamp):
+        """
+        Get the name of the archive of a configuration holding the state at
+        a point in time.
+
+        :param name: The name of the configuration
+        :type name: str
+        :param timestamp: The point in time
+        :type timestamp: float
+        :return: The name of the archive
+        :rtype: str
+        """
+        config = self.configs[name]
+        with self.locks[name]:
+            return pybacked.restore.get_archive_at(config, timestamp)
+
+    def get_catalog(self, config):
+        """
+        Return the up to date catalog of the archive directory of a
+        configuration, which shares the index of the configuration. Has to be
+        called with the lock of the configuration.
+
+        :param config: The configuration
+        :type config: Configuration
+        :return: The catalog
+        :rtype: pybacked.catalog.Catalog
+        """
+        catalog = self.catalogs.get(config.name)
+        if catalog is None:
+            catalog = pybacked.catalog.Catalog(config.archive,
+                                               self.get_index(config))
+            self.catalogs[config.name] = catalog
+        catalog.refresh()
+        return catalog
+
+    def get_hash_cache(self, config):
+        """
+        Return the hash cache of a configuration, reading it from the archive
+        directory on first use. Has to be called with the lock of the
+        configuration.
+
+        :param config: The configuration
+        :type config: Configuration
+        :return: The hash cache or None if tiered hashing is disabled
+        :rtype: pybacked.hash_cache.HashCache
+        """
+        if config.full_verify_interval is None:
+            return None
+        hash_cache = self.hash_caches.get(config.name)
+        if hash_cache is None:
+            hash_cache = pybacked.hash_cache.read_hash_cache(
+                config.archive, config.full_verify_interval)
+            self.hash_caches[config.name] = hash_cache
+        return hash_cache
+
+    def warm(self):
+        """
+        Build the indexes and read the hash caches of all configurations.
+
+        :return: void
+        :rtype: None
+        """
+        for name, config in self.configs.items():
+            with self.locks[name]:
+                self.get_index(config)
+                self.get_hash_cache(config)
+
+    def backup(self, name):
+        """
+        Back up a configuration.
+
+        :param name: The name of the configuration
+        :type name: str
+        :return: The timing and counters of the backup run
+        :rtype: pybacked.instrumentation.Stats
+        """
+        config = self.configs[name]
+        with self.locks[name]:
+            return pybacked.backup.backup(
+                config, index=self.get_index(config),
+                hash_cache=self.get_hash_cache(config))
+
+    def restore(self, name, archname, alt_dir=None):
+        """
+        Restore an archive of a configuration.
+
+        :param name: The name of the configuration
+        :type name: str
+        :param archname: The name of the archive to restore
+        :type archname: str
+        :param alt_dir: An alternative directory to restore to
+        :type alt_dir: str, optional
+        :return: The timing and counters of the restore run
+        :rtype: pybacked.instrumentation.Stats
+        """
+        config = self.configs[name]
+        with self.locks[name]:
+            return pybacked.restore.restore(config, archname, alt_dir,
+                                            index=self.get_index(config))
+
+    def fetch(self, name, path, archname=None, dest=None):
+        """
+        Restore a single file of a configuration.
+
+        :param name: The name of the configuration
+        :type name: str
+        :param path: The archive relative filename of the file
+        :type path: str
+        :param archname: The name of the archive (default is the newest)
+        :type archname: str, optional
+        :param dest: The path the file is written to
+        :type dest: str, optional
+        :return: The result of the fetch
+        :rtype: pybacked.restore.FetchResult
+        """
+        config = self.configs[name]
+        with self.locks[name]:
+            return pybacked.restore.fetch(config, path, archname, dest,
+                                          index=self.get_index(config))
+
+    def search(self, name, pattern, mode=pybacked.catalog.SEARCH_GLOB):
+        """
+        Search the diff-logs of all archives of a configuration.
+
+        :param name: The name of the configuration
+        :type name: str
+        :param pattern: The glob pattern, regular expression or prefix
+        :type pattern: str
+        :param mode: One of the search modes of pybacked.catalog
+        :type mode: str, optional
+        :return: A list of CatalogRow objects ordered by path and archive
+        :rtype: list
+        """
+        config = self.configs[name]
+        with self.locks[name]:
+            return list(self.get_catalog(config).search(pattern, mode))
+
+    def handle(self, request):
+        """
+        Handle a single request.
+
+        :param request: The deserialized request
+        :type request: dict
+        :return: The response
+        :rtype: dict
+        """
+        try:
+            op = request.get("op")
+            if op == "backup":
+                stats = self.backup(request["config"])
+                return {"ok": True, "stats": stats.get_dict()}
+            elif op == "restore":
+                if "timestamp" in request:
+                    archname = self.get_archive_at(request["config"],
+                                                   request["timestamp"])
+                else:
+                    archname = request["archive"]
+                stats = self.restore(request["config"], archname,
+                                     request.get("alt_dir"))
+                return {"ok": True, "stats": stats.get_dict()}
+            elif op == "fetch":
+                archname = request.get("archive")
+                if "timestamp" in request:
+                    archname = self.get_archive_at(request["config"],
+                                                   request["timestamp"])
+                result = self.fetch(request["config"], request["path"],
+                                    archname, request.get("dest"))
+                return {"ok": True, "status": result.status,
+                        "archives": result.archives, "size": result.size}
+            elif op == "search":
+                rows = self.search(request["config"], request["pattern"],
+                                   request.get("mode",
+                                               pybacked.catalog.SEARCH_GLOB))
+                return {"ok": True,
+                        "rows": [list(row.get_tuple()) for row in rows]}
+            elif op == "status":
+                archives = dict()
+                for name, index in self.indexes.items():
+                    archives[name] = len(index.archives)
+                return {"ok": True, "configs": sorted(self.configs),
+                        "archives": archives}
+            elif op == "shutdown":
+                # shutdown() waits for serve_forever(), which is blocked by
+                # this request, so it has to be called from another thread
+                threading.Thread(target=self.shutdown).start()
+                return {"ok": True}
+            else:
+                return {"ok": False, "error": "Unknown op: " + repr(op)}
+        except KeyError as error:
+            return {"ok": False, "error": "Unknown key: " + str(error)}
+        except Exception as error:
+            return {"ok": False, "error": repr(error)}
+
+    def serve_forever(self):
+        """
+        Warm the indexes, bind the socket and serve requests until shutdown()
+        is called. A stale socket file is replaced.
+
+        :return: void
+        :rtype: None
+        """
+        self.warm()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.server = DaemonServer(self.socket_path, RequestHandler)
+        self.server.owner = self
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def shutdown(self):
+        """
+        Stop serve_forever().
+
+        :return: void
+        :rtype: None
+        """
+        if self.server is not None:
+            self.server.shutdown()
+
+
+class DaemonServer(socketserver.ThreadingMixIn,
+                   socketserver.UnixStreamServer):
+    """
+    The socket server of a Daemon, handling each connection in a thread.
+    """
+    daemon_threads = True
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """
+    Reads json requests line by line from a connection and writes the
+    responses of the Daemon.
+    """
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode("UTF-8"))
+            except ValueError:
+                response = {"ok": False, "error": "Invalid request"}
+            else:
+                response = self.server.owner.handle(request)
+            self.wfile.write(json.dumps(response).encode("UTF-8") + b"\n")
+
+
+def send_request(socket_path, request):
+    """
+    Send a request to a running daemon and wait for its response.
+
+    :param socket_path: The path of the UNIX socket of the daemon
+    :type socket_path: str
+    :param request: The request
+    :type request: dict
+    :return: The response
+    :rtype: dict
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(socket_path)
+    file = client.makefile('rwb')
+    file.write(json.dumps(request).encode("UTF-8") + b"\n")
+    file.flush()
+    response = json.loads(file.readline().decode("UTF-8"))
+    file.close()
+    client.close()
+    return response
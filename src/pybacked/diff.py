@@ -2,7 +2,11 @@ import csv
 import io
 import os
 import pybacked.zip_handler
-from pybacked import DIFF_HASH
+from pybacked import DIFF_CONT, DIFF_HASH
+from pybacked import cancellation
+from pybacked import hooks
+from pybacked import instrumentation
+from pybacked import progress
 from pybacked import restore
 
 
@@ -176,14 +180,19 @@ class Diff:
             '+' - file was created
             '-' - file was deleted
             '*' - file was edited
+            'a' - data was appended to the file
     :type difftype_: str
     :param state: The newer state of the file. Depending on the
             diff-algorithm used can either be a timestamp or a hex hash
     :type state: float or str
+    :param offset: The size of the last archived file version. Only set for
+            appended files, where only the data after offset is archived.
+    :type offset: int, optional
     """
-    def __init__(self, difftype_, state):
+    def __init__(self, difftype_, state, offset=None):
         self.difftype = difftype_
         self.state = state
+        self.offset = offset
 
     def __eq__(self, other):
         """
@@ -210,8 +219,10 @@ class Diff:
         return checks == [True, True]
 
 
+@hooks.hooked("detect", path="filepath", archive="archive_dir")
 def detect(filepath, archive_dir, diff_algorithm, hash_algorithm=None,
-           subdir=""):
+           subdir="", detect_append=False, hash_cache=None, fadvise=False,
+           index=None):
     """
     Detect difference between a working file and an archived file. Meaning
     this function detects whether there has been a change in the file since
@@ -221,13 +232,21 @@ def detect(filepath, archive_dir, diff_algorithm, hash_algorithm=None,
     :type filepath: str
     :param archive_dir: The directory of the archive
     :type archive_dir: str
-    :param diff_algorithm: The diff-detection algorithm used - one of DIFF_DATE
-            or DIFF_HASH
+    :param diff_algorithm: The diff-detection algorithm used - one of
+            (DIFF_DATE, DIFF_HASH, DIFF_CONT, DIFF_STAT)
     :type diff_algorithm: int
     :param hash_algorithm: The desired hashing algorithm
     :type hash_algorithm: str
     :param subdir: The subdirectory prefix for the filename
     :type subdir: str, optional
+    :param detect_append: Check edited files for append-only growth
+    :type detect_append: bool, optional
+    :param hash_cache: The cache used for tiered hashing
+    :type hash_cache: HashCache, optional
+    :param fadvise: Drop hashed files from the page cache afterwards
+    :type fadvise: bool, optional
+    :param index: The index used to look up the archived state
+    :type index: pybacked.index.ArchiveIndex, optional
     :return: The diff class which corresponds to the file change or None if the
             file didn't change.
     :rtype: Diff
@@ -240,10 +259,17 @@ def detect(filepath, archive_dir, diff_algorithm, hash_algorithm=None,
     else:
         filename = subdir + "/" + os.path.basename(os.path.abspath(filepath))
 
-    arch_state = restore.get_arch_state(filename, archive_dir,
-                                        diff_algorithm)
-    current_state = restore.get_current_state(filepath, diff_algorithm,
-                                              hash_algorithm)
+    with instrumentation.phase("lookup"):
+        arch_state = restore.get_arch_state(filename, archive_dir,
+                                            diff_algorithm, index)
+    # compare the content in place, before reading the whole file into memory
+    with instrumentation.phase("hash"):
+        if diff_algorithm == DIFF_CONT and \
+                restore.compare_file_content(filepath, arch_state):
+            return None
+        current_state = restore.get_current_state(filepath, diff_algorithm,
+                                                  hash_algorithm, hash_cache,
+                                                  fadvise)
     if arch_state != current_state:
         if arch_state is None:
             # if the file doesn't exist in the archives, then it was added
@@ -256,13 +282,66 @@ def detect(filepath, archive_dir, diff_algorithm, hash_algorithm=None,
             # if the file existed in both archive and current, then it was
             # edited
             diff_type = '*'
+            if detect_append:
+                offset = get_append_offset(filepath, filename, archive_dir,
+                                           diff_algorithm, arch_state,
+                                           hash_algorithm, index)
+                if offset is not None:
+                    return Diff('a', current_state, offset)
         return Diff(diff_type, current_state)
     else:
         return None
 
 
+def get_append_offset(filepath, filename, archive_dir, diff_algorithm,
+                      arch_state, hash_algorithm=None, index=None):
+    """
+    Check whether a file was only appended to since it was last archived. This
+    is the case if the file grew and the prefix of the file matches the last
+    archived state. Only DIFF_HASH and DIFF_CONT store a fingerprint of the
+    file content, so for all other diff algorithms None is returned.
+
+    :param filepath: The path of the inspected file
+    :type filepath: str
+    :param filename: The archive relative filename
+    :type filename: str
+    :param archive_dir: The directory of the archive
+    :type archive_dir: str
+    :param diff_algorithm: The diff-detection algorithm used
+    :type diff_algorithm: int
+    :param arch_state: The last archived state of the file
+    :param hash_algorithm: The desired hashing algorithm
+    :type hash_algorithm: str, optional
+    :param index: The index used to look up the archived size
+    :type index: pybacked.index.ArchiveIndex, optional
+    :return: The size of the archived file version, from which on the data
+        was appended, or None if the file wasn't appended to
+    :rtype: int
+    """
+    if diff_algorithm not in (DIFF_HASH, DIFF_CONT):
+        return None
+
+    arch_size = restore.get_arch_size(filename, archive_dir, index)
+    if arch_size is None or os.path.getsize(filepath) <= arch_size:
+        return None
+
+    if diff_algorithm == DIFF_HASH:
+        prefix = restore.get_file_hash(filepath, hash_algorithm,
+                                       length=arch_size)
+    else:
+        file = open(filepath, "rb")
+        prefix = file.read(arch_size)
+        file.close()
+
+    if prefix == arch_state:
+        return arch_size
+    else:
+        return None
+
+
 def collect(storage_dir, archive_dir, diff_algorithm, hash_algorithm=None,
-            subdir=""):
+            subdir="", detect_append=False, hash_cache=None, fadvise=False,
+            index=None):
     """
     Collects all the diff information for an entire storage directory.
 
@@ -271,12 +350,20 @@ def collect(storage_dir, archive_dir, diff_algorithm, hash_algorithm=None,
     :param archive_dir: The archive directory
     :type archive_dir: str
     :param diff_algorithm: The desired diff algorithm - one of (DIFF_DATE,
-        DIFF_HASH, DIFF_CONT)
+        DIFF_HASH, DIFF_CONT, DIFF_STAT)
     :type diff_algorithm: int
     :param hash_algorithm: The desired hash algorithm.
     :type hash_algorithm: str
     :param subdir: The subdirectory prefix for the filename
     :type subdir: str, optional
+    :param detect_append: Check edited files for append-only growth
+    :type detect_append: bool, optional
+    :param hash_cache: The cache used for tiered hashing
+    :type hash_cache: HashCache, optional
+    :param fadvise: Drop hashed files from the page cache afterwards
+    :type fadvise: bool, optional
+    :param index: The index used to look up the archived states
+    :type index: pybacked.index.ArchiveIndex, optional
     :return: The DiffCache object holding the diff information
     :rtype: DiffCache
     """
@@ -286,24 +373,34 @@ def collect(storage_dir, archive_dir, diff_algorithm, hash_algorithm=None,
 
     diff_cache = DiffCache()
 
-    for member in os.listdir(storage_dir):
+    with instrumentation.phase("scan"):
+        members = os.listdir(storage_dir)
+
+    for member in members:
+        cancellation.check()
         member_path = os.path.abspath(storage_dir + "/" + member)
+        with instrumentation.phase("scan"):
+            is_dir = os.path.isdir(member_path)
+        instrumentation.count("files_stat")
         # if member is a directory run cullect() on said dir
-        if os.path.isdir(member_path):
+        if is_dir:
             new_subdir = os.path.join(subdir, os.path.basename(member_path))
             # os.path.join adds backslashes(\\) and these need to be replaced
             # as the diff logs in the archives only use slashes(/)
             new_subdir = new_subdir.replace("\\", "/")
 
             diff = collect(member_path, archive_dir, diff_algorithm,
-                           hash_algorithm, new_subdir)
+                           hash_algorithm, new_subdir, detect_append,
+                           hash_cache, fadvise, index)
             diff_cache.add_diff(member_path, diff, True)
         # if member is a file detect the differences and add them to diff_cache
         else:
             diff = detect(member_path, archive_dir, diff_algorithm,
-                          hash_algorithm, subdir)
+                          hash_algorithm, subdir, detect_append, hash_cache,
+                          fadvise, index)
             if diff is not None:
                 diff_cache.add_diff(member_path, diff, False)
+            progress.update(member_path)
     return diff_cache
 
 
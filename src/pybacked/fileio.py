@@ -0,0 +1,39 @@
+import os
+
+
+def advise_dontneed(file, sync=False):
+    """
+    Advise the kernel that the cached pages of a file are not needed anymore,
+    so they can be dropped from the page cache. Dirty pages can't be dropped,
+    therefore files that were written to should be synced first. This is a
+    no-op on platforms without posix_fadvise.
+
+    :param file: The opened file
+    :type file: io.IOBase
+    :param sync: Flush and sync the file before giving the advice
+    :type sync: bool, optional
+    :return: void
+    :rtype: None
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    if sync:
+        file.flush()
+        os.fdatasync(file.fileno())
+    os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def advise_sequential(file):
+    """
+    Advise the kernel that a file will be read sequentially, which enables
+    more aggressive read-ahead. This is a no-op on platforms without
+    posix_fadvise.
+
+    :param file: The opened file
+    :type file: io.IOBase
+    :return: void
+    :rtype: None
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
@@ -0,0 +1,173 @@
+import csv
+import io
+import os.path
+import time
+
+
+class HashCache:
+    """
+    Holds the size, the sample hash and the full hash of files from previous
+    backup runs. This is used for tiered hashing, where the full hash of a file
+    is only computed if the size or the sample hash of the file changed, or if
+    the last full verification is older than verify_interval.
+
+    :param verify_interval: The time in seconds after which a full hash is
+        computed, even though size and sample hash didn't change.
+    :type verify_interval: float
+    :param initialdict: Initial dictionary of filepath, entry key-value pairs
+        which will be copied into entries. An entry is a list of the form
+        [size, sample, hash, algorithm, verified].
+    :type initialdict: dict, optional
+    """
+    def __init__(self, verify_interval, initialdict=None):
+        self.verify_interval = verify_interval
+        if initialdict is None:
+            self.entries = dict()
+        else:
+            self.entries = initialdict
+
+    def __eq__(self, other):
+        """
+        Check if the HashCache objects hold the same values. This is mainly
+        used for testing purposes.
+
+        :param other: The other HashCache object
+        :type other: HashCache
+        :return: True if the objects hold the same values
+        :rtype: bool
+        """
+        if self.verify_interval != other.verify_interval:
+            return False
+        return self.entries == other.entries
+
+    def lookup(self, filepath, size, sample, algorithm, now=None):
+        """
+        Return the cached full hash of a file if the cached entry is still
+        valid. An entry is valid if size, sample hash and hash algorithm match
+        and the last full verification isn't older than verify_interval.
+
+        :param filepath: The path of the file
+        :type filepath: str
+        :param size: The current size of the file
+        :type size: int
+        :param sample: The current sample hash of the file
+        :type sample: str
+        :param algorithm: The hash algorithm used
+        :type algorithm: str
+        :param now: The current unix timestamp (default is time.time())
+        :type now: float, optional
+        :return: The cached hash or None if no valid entry exists
+        :rtype: str
+        """
+        if now is None:
+            now = time.time()
+        entry = self.entries.get(filepath)
+        if entry is None:
+            return None
+        if entry[0] != size or entry[1] != sample or entry[3] != algorithm:
+            return None
+        if now - entry[4] >= self.verify_interval:
+            return None
+        return entry[2]
+
+    def update(self, filepath, size, sample, file_hash, algorithm, now=None):
+        """
+        Add or replace the entry of a file after its full hash was computed.
+
+        :param filepath: The path of the file
+        :type filepath: str
+        :param size: The size of the file
+        :type size: int
+        :param sample: The sample hash of the file
+        :type sample: str
+        :param file_hash: The full hash of the file
+        :type file_hash: str
+        :param algorithm: The hash algorithm used
+        :type algorithm: str
+        :param now: The timestamp of the verification (default is
+            time.time())
+        :type now: float, optional
+        :return: void
+        :rtype: None
+        """
+        if now is None:
+            now = time.time()
+        self.entries[filepath] = [size, sample, file_hash, algorithm, now]
+
+
+def deserialize_hash_cache(data, verify_interval):
+    """
+    Create a HashCache object from the contents of a hash-cache.csv.
+
+    :param data: The contents of the hash-cache.csv
+    :type data: str
+    :param verify_interval: The full verification interval in seconds
+    :type verify_interval: float
+    :return: The deserialized HashCache
+    :rtype: HashCache
+    """
+    hash_cache = HashCache(verify_interval)
+    reader = csv.DictReader(io.StringIO(data))
+    for entry in reader:
+        hash_cache.entries[entry['filepath']] = [int(entry['size']),
+                                                 entry['sample'],
+                                                 entry['hash'],
+                                                 entry['algorithm'],
+                                                 float(entry['verified'])]
+    return hash_cache
+
+
+def read_hash_cache(archive_dir, verify_interval):
+    """
+    Read the hash-cache.csv from the archive directory. If no hash cache was
+    written yet, an empty HashCache is returned.
+
+    :param archive_dir: The archive directory
+    :type archive_dir: str
+    :param verify_interval: The full verification interval in seconds
+    :type verify_interval: float
+    :return: The HashCache object
+    :rtype: HashCache
+    """
+    path = os.path.abspath(archive_dir + "/hash-cache.csv")
+    if not os.path.isfile(path):
+        return HashCache(verify_interval)
+    file = open(path, 'r', newline='')
+    data = file.read()
+    file.close()
+    return deserialize_hash_cache(data, verify_interval)
+
+
+def serialize_hash_cache(hash_cache):
+    """
+    Serialize a HashCache object to csv.
+
+    :param hash_cache: The HashCache object
+    :type hash_cache: HashCache
+    :return: The csv string
+    :rtype: str
+    """
+    stream = io.StringIO()
+    writer = csv.writer(stream)
+    writer.writerow(['filepath', 'size', 'sample', 'hash', 'algorithm',
+                     'verified'])
+    for filepath, entry in hash_cache.entries.items():
+        writer.writerow([filepath] + entry)
+    return stream.getvalue()
+
+
+def write_hash_cache(hash_cache, archive_dir):
+    """
+    Write the HashCache to the hash-cache.csv in the archive directory.
+
+    :param hash_cache: The HashCache object
+    :type hash_cache: HashCache
+    :param archive_dir: The archive directory
+    :type archive_dir: str
+    :return: void
+    :rtype: None
+    """
+    path = os.path.abspath(archive_dir + "/hash-cache.csv")
+    file = open(path, 'w', newline='')
+    file.write(serialize_hash_cache(hash_cache))
+    file.close()
@@ -0,0 +1,281 @@
+import functools
+import heapq
+import inspect
+import sys
+import threading
+import time
+
+_consumers = []
+_local = threading.local()
+
+enabled = False
+
+
+class Record:
+    """
+    Describes one call of a hooked function. Records are passed to the
+    consumers on the start and on the end of the call.
+
+    :param event: The name of the event, usually the name of the function
+    :type event: str
+    :param context: Information about the call (path, bytes, archive...)
+    :type context: dict
+    :param parent: The record of the enclosing hooked call in the same thread
+    :type parent: Record, optional
+    """
+    def __init__(self, event, context, parent=None):
+        self.event = event
+        self.context = context
+        self.parent = parent
+        self.start = time.perf_counter()
+        self.seconds = None
+        self.child_seconds = 0.0
+
+    @property
+    def own_seconds(self):
+        """
+        The time spent in the call itself, excluding nested hooked calls.
+        """
+        return self.seconds - self.child_seconds
+
+
+def register(consumer):
+    """
+    Register a consumer. A consumer is any object with an on_start(record)
+    and an on_end(record) method. Consumers are called from the thread
+    performing the work, so they have to be thread-safe if backups run
+    concurrently.
+
+    :param consumer: The consumer to register
+    :return: void
+    :rtype: None
+    """
+    global enabled
+    _consumers.append(consumer)
+    enabled = True
+
+
+def unregister(consumer):
+    """
+    Remove a registered consumer.
+
+    :param consumer: The consumer to remove
+    :return: void
+    :rtype: None
+    """
+    global enabled
+    _consumers.remove(consumer)
+    enabled = len(_consumers) > 0
+
+
+class registered:
+    """
+    Context manager that registers a consumer for the duration of the
+    context.
+
+    :param consumer: The consumer to register
+    """
+    def __init__(self, consumer):
+        self.consumer = consumer
+
+    def __enter__(self):
+        register(self.consumer)
+        return self.consumer
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        unregister(self.consumer)
+        return False
+
+
+def start(event, **context):
+    """
+    Fire the start event of a call.
+
+    :param event: The name of the event
+    :type event: str
+    :param context: Information about the call
+    :return: The record, which has to be passed to end()
+    :rtype: Record
+    """
+    record = Record(event, context, getattr(_local, "record", None))
+    _local.record = record
+    for consumer in list(_consumers):
+        consumer.on_start(record)
+    return record
+
+
+def end(record):
+    """
+    Fire the end event of a call.
+
+    :param record: The record returned by start()
+    :type record: Record
+    :return: void
+    :rtype: None
+    """
+    record.seconds = time.perf_counter() - record.start
+    if record.parent is not None:
+        record.parent.child_seconds += record.seconds
+    _local.record = record.parent
+    for consumer in list(_consumers):
+        consumer.on_end(record)
+
+
+def annotate(**context):
+    """
+    Add information to the context of the innermost running call in the
+    current thread. This is used to report values that are only known inside
+    the call, e.g. the number of bytes read.
+
+    :param context: The information to add
+    :return: void
+    :rtype: None
+    """
+    record = getattr(_local, "record", None)
+    if record is not None:
+        record.context.update(context)
+
+
+def hooked(event, **arguments):
+    """
+    Decorator that fires start and end events around every call of the
+    decorated function. While no consumer is registered the only overhead is
+    a single check of the registered consumers.
+
+    :param event: The name of the event
+    :type event: str
+    :param arguments: context key, parameter name pairs. The values of these
+        parameters are added to the context of each call.
+    :return: The decorator
+    """
+    def decorator(function):
+        parameters = list(inspect.signature(function).parameters)
+        positions = {key: parameters.index(name)
+                     for key, name in arguments.items()}
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _consumers:
+                return function(*args, **kwargs)
+            context = dict()
+            for key, position in positions.items():
+                if position < len(args):
+                    context[key] = args[position]
+                elif arguments[key] in kwargs:
+                    context[key] = kwargs[arguments[key]]
+            record = start(event, **context)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                end(record)
+        return wrapper
+    return decorator
+
+
+class ProfileAggregator:
+    """
+    Consumer that aggregates the calls per event in the style of cProfile:
+    number of calls, total time excluding nested events (tottime) and
+    cumulative time including nested events (cumtime).
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = dict()
+
+    def on_start(self, record):
+        pass
+
+    def on_end(self, record):
+        with self.lock:
+            entry = self.stats.get(record.event)
+            if entry is None:
+                self.stats[record.event] = [1, record.own_seconds,
+                                            record.seconds]
+            else:
+                entry[0] += 1
+                entry[1] += record.own_seconds
+                entry[2] += record.seconds
+
+    def print_stats(self, stream=None, sort="tottime"):
+        """
+        Print the aggregated statistics as a table.
+
+        :param stream: The output stream (default is sys.stdout)
+        :param sort: The column to sort by - one of (ncalls, tottime, cumtime)
+        :type sort: str, optional
+        :return: void
+        :rtype: None
+        """
+        if stream is None:
+            stream = sys.stdout
+        column = {"ncalls": 0, "tottime": 1, "cumtime": 2}[sort]
+        with self.lock:
+            rows = sorted(self.stats.items(), key=lambda item: item[1][column],
+                          reverse=True)
+        stream.write("{:>9} {:>10} {:>10} {:>10} {:>10}  {}\n".format(
+            "ncalls", "tottime", "percall", "cumtime", "percall", "event"))
+        for event, (ncalls, tottime, cumtime) in rows:
+            stream.write(
+                "{:>9} {:>10.4f} {:>10.6f} {:>10.4f} {:>10.6f}  {}\n".format(
+                    ncalls, tottime, tottime / ncalls, cumtime,
+                    cumtime / ncalls, event))
+
+
+class SlowFileReport:
+    """
+    Consumer that keeps the top_n slowest calls per event, together with
+    their context.
+
+    :param top_n: The number of calls kept per event
+    :type top_n: int, optional
+    """
+    def __init__(self, top_n=10):
+        self.top_n = top_n
+        self.lock = threading.Lock()
+        self.heaps = dict()
+        self.counter = 0
+
+    def on_start(self, record):
+        pass
+
+    def on_end(self, record):
+        with self.lock:
+            heap = self.heaps.setdefault(record.event, [])
+            # the counter breaks ties, so contexts are never compared
+            self.counter += 1
+            item = (record.seconds, self.counter, dict(record.context))
+            if len(heap) < self.top_n:
+                heapq.heappush(heap, item)
+            elif item[0] > heap[0][0]:
+                heapq.heapreplace(heap, item)
+
+    def report(self):
+        """
+        Get the slowest calls per event.
+
+        :return: A dictionary mapping each event to a list of (seconds,
+            context) tuples, slowest first
+        :rtype: dict
+        """
+        with self.lock:
+            result = dict()
+            for event, heap in self.heaps.items():
+                result[event] = [(seconds, context) for seconds, _, context
+                                 in sorted(heap, reverse=True)]
+        return result
+
+    def print_report(self, stream=None):
+        """
+        Print the slowest calls per event.
+
+        :param stream: The output stream (default is sys.stdout)
+        :return: void
+        :rtype: None
+        """
+        if stream is None:
+            stream = sys.stdout
+        for event, calls in self.report().items():
+            stream.write(event + "\n")
+            for seconds, context in calls:
+                stream.write("  {:>10.4f}  {}\n".format(
+                    seconds, context.get("path", "")))
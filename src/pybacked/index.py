@@ -0,0 +1,176 @@
+import os
+import pybacked
+import pybacked.diff
+import pybacked.instrumentation
+import pybacked.manifest
+import pybacked.restore
+import pybacked.zip_handler
+import zipfile
+
+
+class IndexEntry:
+    """
+    The diff-log entry of a file in an archive.
+
+    :param archive: The path to the archive
+    :type archive: str
+    :param modtype: The modtype of the diff-log entry
+    :type modtype: str
+    :param diff: The diff of the diff-log entry
+    :type diff: str
+    :param size: The size of the archived data of the file in bytes
+    :type size: int
+    """
+    def __init__(self, archive, modtype, diff, size):
+        self.archive = archive
+        self.modtype = modtype
+        self.diff = diff
+        self.size = size
+
+
+class ArchiveIndex:
+    """
+    An in-memory index of all the diff-logs of an archive directory. The
+    lookups of the archived state of a file, which otherwise open and parse
+    every archive, are answered from the history of the file kept in the
+    index. The index is updated incrementally with add_archive() when an
+    archive is written and with refresh() to pick up archives written by
+    others.
+
+    :param archive_dir: The directory in which the archives are stored
+    :type archive_dir: str
+    """
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir
+        self.clear()
+
+    def add_archive(self, archivepath, kind=pybacked.ARCHIVE_INCREMENTAL,
+                    size=None):
+        """
+        Add an archive to the index. The archive has to be newer than all
+        archives already in the index.
+
+        :param archivepath: The path to the archive
+        :type archivepath: str
+        :param kind: The kind of the archive (default is ARCHIVE_INCREMENTAL)
+        :type kind: str, optional
+        :param size: The size of the archive as recorded in the manifest,
+            which is used to notice archives that were replaced
+        :type size: int, optional
+        :return: void
+        :rtype: None
+        """
+        diff_log = pybacked.zip_handler.read_diff_log(archivepath)
+        diffcache = pybacked.diff.diff_log_deserialize_str(diff_log)
+        archive = zipfile.ZipFile(archivepath, mode='r')
+        pybacked.instrumentation.count("archives_opened")
+        sizes = dict()
+        for info in archive.infolist():
+            sizes[info.filename] = info.file_size
+        archive.close()
+
+        for filename, diff, dirflag in diffcache:
+            entry = IndexEntry(archivepath, diff.difftype, diff.state,
+                               sizes.get("data/" + filename, 0))
+            self.history.setdefault(filename, []).append(entry)
+        if kind != pybacked.ARCHIVE_INCREMENTAL:
+            self.kinds[archivepath] = kind
+        if kind == pybacked.ARCHIVE_FULL:
+            self.root = len(self.archives)
+        self.positions[archivepath] = len(self.archives)
+        self.archives.append(archivepath)
+        self.signature.append((archivepath, kind, size))
+        self.diffcaches[archivepath] = diffcache
+
+    def clear(self):
+        """
+        Remove all archives from the index.
+
+        :return: void
+        :rtype: None
+        """
+        self.archives = []
+        self.history = dict()
+        self.diffcaches = dict()
+        self.kinds = dict()
+        self.positions = dict()
+        self.signature = []
+        # the position of the newest full archive, lookups stop there
+        self.root = 0
+
+    def refresh(self):
+        """
+        Bring the index up to date with the archive directory. New archives
+        are added incrementally, if archives were removed, replaced or
+        inserted in between, the index is rebuilt.
+
+        :return: void
+        :rtype: None
+        """
+        entries = pybacked.manifest.read_manifest(self.archive_dir)
+        if entries is None:
+            archive_list = pybacked.restore.get_archive_list(self.archive_dir)
+            archive_list.reverse()
+            signature = [(archivepath, pybacked.ARCHIVE_INCREMENTAL, None)
+                         for archivepath in archive_list]
+        else:
+            signature = [(os.path.abspath(
+                self.archive_dir + "/" + entry.filename), entry.kind,
+                entry.size) for entry in entries]
+        if signature[:len(self.signature)] != self.signature:
+            self.clear()
+        for archivepath, kind, size in signature[len(self.signature):]:
+            self.add_archive(archivepath, kind, size)
+
+    def find(self, filename):
+        """
+        Find the newest diff-log entry of a file.
+
+        :param filename: The archive relative filename
+        :type filename: str
+        :return: The entry as returned by restore.find_diff(), or None if the
+            file isn't archived
+        :rtype: dict
+        """
+        history = self.history.get(filename)
+        if not history:
+            return None
+        entry = history[-1]
+        if self.positions[entry.archive] < self.root:
+            # the file isn't part of the newest full archive
+            return None
+        return {"filename": filename, "modtype": entry.modtype,
+                "diff": entry.diff}
+
+    def get_arch_size(self, filename):
+        """
+        Get the size of the last archived version of a file, like
+        restore.get_arch_size().
+
+        :param filename: The archive relative filename
+        :type filename: str
+        :return: The size of the archived file version in bytes, or None if
+            the file isn't archived (or was archived as removed)
+        :rtype: int
+        """
+        size = 0
+        for entry in reversed(self.history.get(filename, [])):
+            if self.positions[entry.archive] < self.root:
+                return None
+            if entry.modtype == '-':
+                return None
+            size += entry.size
+            if entry.modtype != 'a':
+                return size
+        return None
+
+    def get_diffcache(self, archivepath):
+        """
+        Return the deserialized diff-log of an archive in the index.
+
+        :param archivepath: The path to the archive
+        :type archivepath: str
+        :return: The DiffCache with the archive relative filenames
+        :rtype: DiffCache
+        """
+        return self.diffcaches[archivepath]
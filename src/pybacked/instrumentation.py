@@ -0,0 +1,228 @@
+import contextlib
+import threading
+import time
+
+COUNTERS = ("files_stat", "bytes_hashed", "archives_opened",
+            "members_written", "bytes_in", "bytes_out")
+
+# upper bounds in seconds of the duration histogram buckets of each phase
+DURATION_BUCKETS = (0.0001, 0.001, 0.01, 0.1, 1.0, 10.0, 60.0, 600.0)
+
+_local = threading.local()
+
+
+class Stats:
+    """
+    Collects the time spent in each phase of a run and a set of counters.
+    Stats objects are filled by the functions along the hot paths while they
+    are activated with activate().
+
+    :param initialphases: Initial dictionary of phase, [seconds, calls]
+        key-value pairs
+    :type initialphases: dict, optional
+    :param initialcounters: Initial dictionary of counter, value key-value
+        pairs
+    :type initialcounters: dict, optional
+
+    The total duration of the run is kept in the total attribute and has to
+    be set by the caller, as only the caller knows where the run ends. Next to
+    the totals, the durations of the single calls of each phase are counted
+    in the buckets of DURATION_BUCKETS, and the number of files and bytes
+    changed are kept per difftype.
+    """
+    def __init__(self, initialphases=None, initialcounters=None):
+        if initialphases is None:
+            self.phases = dict()
+        else:
+            self.phases = initialphases
+
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        if initialcounters is not None:
+            self.counters.update(initialcounters)
+        self.histograms = dict()
+        self.changes = dict()
+        self.total = 0.0
+
+    def __eq__(self, other):
+        """
+        Check if the Stats objects hold the same values. This is mainly used
+        for testing purposes.
+
+        :param other: The other Stats object
+        :type other: Stats
+        :return: True if phases, counters and total match
+        :rtype: bool
+        """
+        if self.phases != other.phases:
+            return False
+        elif self.counters != other.counters:
+            return False
+        elif self.changes != other.changes:
+            return False
+        return self.total == other.total
+
+    def add_time(self, name, seconds):
+        """
+        Add the duration of one call of a phase.
+
+        :param name: The name of the phase
+        :type name: str
+        :param seconds: The duration in seconds
+        :type seconds: float
+        :return: void
+        :rtype: None
+        """
+        phase = self.phases.get(name)
+        if phase is None:
+            self.phases[name] = [seconds, 1]
+            histogram = self.histograms[name] = [0] * len(DURATION_BUCKETS)
+        else:
+            phase[0] += seconds
+            phase[1] += 1
+            histogram = self.histograms[name]
+        for index, bound in enumerate(DURATION_BUCKETS):
+            if seconds <= bound:
+                histogram[index] += 1
+                break
+
+    def count_change(self, difftype, size):
+        """
+        Count a changed file.
+
+        :param difftype: The type of the change ('+', '-', '*' or 'a')
+        :type difftype: str
+        :param size: The number of bytes of the change
+        :type size: int
+        :return: void
+        :rtype: None
+        """
+        change = self.changes.get(difftype)
+        if change is None:
+            self.changes[difftype] = [1, size]
+        else:
+            change[0] += 1
+            change[1] += size
+
+    def count(self, name, value=1):
+        """
+        Increase a counter.
+
+        :param name: The name of the counter
+        :type name: str
+        :param value: The value that is added to the counter (default is 1)
+        :type value: int, optional
+        :return: void
+        :rtype: None
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Context manager that adds the time spent inside of it to a phase.
+
+        :param name: The name of the phase
+        :type name: str
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def get_dict(self):
+        """
+        Get a dictionary representation of the Stats, which can be serialized
+        to json.
+
+        :return: The dictionary with total_seconds, phases, counters and
+            changes
+        :rtype: dict
+        """
+        phases = dict()
+        for name, (seconds, calls) in self.phases.items():
+            phases[name] = {"seconds": seconds, "calls": calls}
+        changes = dict()
+        for difftype, (files, size) in self.changes.items():
+            changes[difftype] = {"files": files, "bytes": size}
+        return {"total_seconds": self.total, "phases": phases,
+                "counters": dict(self.counters), "changes": changes}
+
+
+@contextlib.contextmanager
+def activate(stats):
+    """
+    Activate a Stats object for the current thread. Everything measured with
+    count() and phase() inside of the context is recorded to it.
+
+    :param stats: The Stats object to record to
+    :type stats: Stats
+    """
+    previous = getattr(_local, "stats", None)
+    _local.stats = stats
+    try:
+        yield stats
+    finally:
+        _local.stats = previous
+
+
+def count(name, value=1):
+    """
+    Increase a counter of the active Stats object. Does nothing if no Stats
+    object is active in the current thread.
+
+    :param name: The name of the counter
+    :type name: str
+    :param value: The value that is added to the counter (default is 1)
+    :type value: int, optional
+    :return: void
+    :rtype: None
+    """
+    stats = getattr(_local, "stats", None)
+    if stats is not None:
+        stats.count(name, value)
+
+
+def count_change(difftype, size):
+    """
+    Count a changed file in the active Stats object. Does nothing if no Stats
+    object is active in the current thread.
+
+    :param difftype: The type of the change ('+', '-', '*' or 'a')
+    :type difftype: str
+    :param size: The number of bytes of the change
+    :type size: int
+    :return: void
+    :rtype: None
+    """
+    stats = getattr(_local, "stats", None)
+    if stats is not None:
+        stats.count_change(difftype, size)
+
+
+def current():
+    """
+    Return the Stats object that is active in the current thread.
+
+    :return: The active Stats object or None
+    :rtype: Stats
+    """
+    return getattr(_local, "stats", None)
+
+
+def phase(name):
+    """
+    Return a context manager that times a phase of the active Stats object.
+    If no Stats object is active, the returned context manager does nothing.
+
+    :param name: The name of the phase
+    :type name: str
+    :return: The context manager
+    """
+    stats = getattr(_local, "stats", None)
+    if stats is None:
+        return _NULL_CONTEXT
+    return stats.phase(name)
+
+
+_NULL_CONTEXT = contextlib.nullcontext()
@@ -11,9 +11,17 @@ class MetadataContainer:
 
     :param timestamp: The timestamp at the creation of the archive
     :type timestamp: float
+    :param stats: The per-phase timing and counters of the backup run, as
+        returned by Stats.get_dict()
+    :type stats: dict, optional
+    :param kind: The kind of the archive, for example ARCHIVE_FULL for
+        archives holding the complete state. None for incremental archives.
+    :type kind: str, optional
     """
-    def __init__(self, timestamp=None):
+    def __init__(self, timestamp=None, stats=None, kind=None):
         self.timestamp = timestamp
+        self.stats = stats
+        self.kind = kind
 
     def __eq__(self, other):
         """
@@ -30,6 +38,10 @@ class MetadataContainer:
             pass
         else:
             return False
+        if self.stats != other.stats:
+            return False
+        if self.kind != other.kind:
+            return False
         return True
 
 
@@ -44,11 +56,23 @@ def create_log(diffcache):
     :return: The Content of the diff-log in string form.
     :rtype: str
     """
+    return create_log_rows(serialize_diff(diffcache))
+
+
+def create_log_rows(rows):
+    """
+    Create a diff-log from already serialized rows.
+
+    :param rows: A List of csv-rows (3-element-Lists) as returned by
+        serialize_diff()
+    :type rows: List
+    :return: The Content of the diff-log in string form.
+    :rtype: str
+    """
     stream = io.StringIO()
     writer = csv.writer(stream)
     writer.writerow(['filename', 'modtype', 'diff'])
-    serialized = serialize_diff(diffcache)
-    for row in serialized:
+    for row in rows:
         writer.writerow(row)
     stream.seek(0)
     log = stream.read()
@@ -66,6 +90,10 @@ def create_metadata_string(metadata):
     :rtype: str
     """
     top_level_object = {"timestamp": metadata.timestamp}
+    if metadata.stats is not None:
+        top_level_object["stats"] = metadata.stats
+    if metadata.kind is not None:
+        top_level_object["kind"] = metadata.kind
     json_string = json.dumps(top_level_object)
     return json_string
 
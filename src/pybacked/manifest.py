@@ -0,0 +1,543 @@
+import bisect
+import csv
+import io
+import json
+import os
+import pybacked
+import re
+import tempfile
+import zipfile
+
+MANIFEST_NAME = "manifest.csv"
+JOURNAL_NAME = "manifest-journal.json"
+MANIFEST_FIELDS = ("sequence", "filename", "timestamp", "size", "members",
+                   "kind")
+
+# size of the block read from the end of the manifest to find the last row
+TAIL_BLOCK_SIZE = 4096
+
+_ARCHIVE_NAME = re.compile(r"^arch(\d+)\.zip$")
+
+# prefixes of the temporary files written to an archive directory, which
+# are left behind if the writer is killed
+TEMP_PREFIXES = (".manifest-", ".retention-", ".consolidate-",
+                 ".reverse-")
+
+# manifest path -> (mtime_ns, size, entries) of the last parsed manifest
+_cache = dict()
+
+# manifest path -> (entries, timestamps, dated entries) of the last built
+# timestamp index
+_timestamp_cache = dict()
+
+
+class ManifestEntry:
+    """
+    A row of the manifest, describing a single archive of an archive
+    directory.
+
+    :param sequence: The number of the archive, archives are ordered by it
+    :type sequence: int
+    :param filename: The filename of the archive
+    :type filename: str
+    :param timestamp: The timestamp stored in the metadata.json of the archive
+    :type timestamp: float
+    :param size: The size of the archive file in bytes
+    :type size: int
+    :param members: The number of files stored in the archive
+    :type members: int
+    :param kind: The kind of the archive, one of (ARCHIVE_INCREMENTAL,
+        ARCHIVE_FULL, ARCHIVE_REVERSE) (default is ARCHIVE_INCREMENTAL)
+    :type kind: str, optional
+    """
+    def __init__(self, sequence, filename, timestamp, size, members,
+                 kind=pybacked.ARCHIVE_INCREMENTAL):
+        self.sequence = sequence
+        self.filename = filename
+        self.timestamp = timestamp
+        self.size = size
+        self.members = members
+        self.kind = kind
+
+    def __eq__(self, other):
+        return self.get_row() == other.get_row()
+
+    def get_row(self):
+        """
+        Get the csv row of the entry.
+
+        :return: The fields in the order of MANIFEST_FIELDS
+        :rtype: list
+        """
+        return [self.sequence, self.filename, self.timestamp, self.size,
+                self.members, self.kind]
+
+
+def append_entry(archive_dir, entry):
+    """
+    Append an entry to the manifest of an archive directory. If the manifest
+    doesn't exist yet, it is created from the existing archives first.
+
+    :param archive_dir: The directory in which the archives are stored
+    :type archive_dir: str
+    :param entry: The entry of the new archive
+    :type entry: ManifestEntry
+    :return: void
+    :rtype: None
+    """
+    path = get_manifest_path(archive_dir)
+    if not os.path.isfile(path):
+        rebuild_manifest(archive_dir, exclude=entry.filename)
+    elif read_header(path) != list(MANIFEST_FIELDS):
+        # manifests written by older versions lack columns, the rows
+        # appended to them wouldn't match the header
+        write_manifest(archive_dir, read_manifest(archive_dir))
+    file = open(path, 'a', newline='')
+    writer = csv.writer(file)
+    writer.writerow(entry.get_row())
+    file.close()
+
+
+def commit_changes(archive_dir, entries, replace=None, remove=None):
+    """
+    Replace the manifest and archives of an archive directory in one step.
+    The change is written to a journal first, so if the writer is killed
+    before the change is complete, recover() completes it.
+
+    :param archive_dir: The directory in which the archives are stored
+    :type archive_dir: str
+    :param entries: The entries of the new manifest
+    :type entries: list
+    :param replace: A dictionary of temporary filename, archive filename
+        key-value pairs of the temporary files in the archive directory
+        which replace archives
+    :type replace: dict, optional
+    :param remove: The filenames of the archives to remove
+    :type remove: list, optional
+    :return: void
+    :rtype: None
+    """
+    if replace is None:
+        replace = dict()
+    if remove is None:
+        remove = []
+    journal = {"manifest": serialize_manifest(entries), "replace": replace,
+               "remove": remove}
+    descriptor, temp_path = tempfile.mkstemp(dir=archive_dir,
+                                             prefix=".manifest-")
+    file = os.fdopen(descriptor, 'w')
+    file.write(json.dumps(journal))
+    file.flush()
+    os.fsync(file.fileno())
+    file.close()
+    os.replace(temp_path, get_journal_path(archive_dir))
+    complete_changes(archive_dir, journal)
+
+
+def complete_changes(archive_dir, journal):
+    """
+    Apply the change recorded in a journal and remove the journal. Every
+    step can be repeated, so an interrupted change is completed by applying
+    it again.
+
+    :param archive_dir: The directory in which the archives are stored
+    :type archive_dir: str
+    :param journal: The deserialized journal
+    :type journal: dict
+    :return: void
+    :rtype: None
+    """
+    write_manifest(archive_dir, deserialize_manifest(journal["manifest"]))
+    for temp_name, filename in journal["replace"].items():
+        temp_path = os.path.abspath(archive_dir + "/" + temp_name)
+        if os.path.exists(temp_path):
+            os.replace(temp_path,
+                       os.path.abspath(archive_dir + "/" + filename))
+    for filename in journal["remove"]:
+        path = os.path.abspath(archive_dir + "/" + filename)
+        if os.path.exists(path):
+            os.remove(path)
+    os.remove(get_journal_path(archive_dir))
+
+
+def create_entry(archivepath, sequence):
+    """
+    Create the manifest entry of an archive by reading its metadata.
+
+    :param archivepath: The path to the archive
+    :type archivepath: str
+    :param sequence: The number of the archive
+    :type sequence: int
+    :return: The entry
+    :rtype: ManifestEntry
+    """
+    archive = zipfile.ZipFile(archivepath, mode='r')
+    members = 0
+    for name in archive.namelist():
+        if name.startswith("data/") and not name.endswith("/"):
+            members += 1
+    try:
+        metadata = json.loads(archive.read("metadata.json"))
+    except KeyError:
+        metadata = dict()
+    archive.close()
+    return ManifestEntry(sequence, os.path.basename(archivepath),
+                         metadata.get("timestamp"),
+                         os.path.getsize(archivepath), members,
+                         metadata.get("kind", pybacked.ARCHIVE_INCREMENTAL))
+
+
+def deserialize_manifest(data):
+    """
+    Create the entries of a manifest from its content.
+
+    :param data: The content of the manifest.csv
+    :type data: str
+    :return: The entries ordered by sequence
+    :rtype: list
+    """
+    entries = []
+    reader = csv.DictReader(io.StringIO(data))
+    for row in reader:
+        entries.append(deserialize_row(row))
+    entries.sort(key=lambda entry: entry.sequence)
+    return entries
+
+
+def deserialize_row(row):
+    """
+    Create an entry from a row of the manifest.
+
+    :param row: The row as a dictionary of field, value pairs
+    :type row: dict
+    :return: The entry
+    :rtype: ManifestEntry
+    """
+    if row["timestamp"] == "":
+        timestamp = None
+    else:
+        timestamp = float(row["timestamp"])
+    kind = row.get("kind")
+    if not kind:
+        kind = pybacked.ARCHIVE_INCREMENTAL
+    return ManifestEntry(int(row["sequence"]), row["filename"], timestamp,
+                         int(row["size"]), int(row["members"]), kind)
+
+
+def find_entry_at(archive_dir, timestamp):
+    """
+    Find the newest archive created at or before a point in time. The
+    timestamp is looked up with a binary search in the sorted timestamps of
+    the manifest, which are cached until the manifest changes, so the
+    metadata of the archives is never read. If the directory has no
+    manifest, it is rebuilt first.
+
+    :param archive_dir: The directory in which the archives are stored
+    :type archive_dir: str
+    :param timestamp: The point in time
+    :type timestamp: float
+    :return: The entry of the archive, or None if all archives are newer
+    :rtype: ManifestEntry
+    """
+    entries = read_manifest(archive_dir)
+    if entries is None:
+        rebuild_manifest(archive_dir)
+        entries = read_manifest(archive_dir)
+    timestamps, dated = get_timestamp_index(archive_dir, entries)
+    position = bisect.bisect_right(timestamps, timestamp)
+    if position == 0:
+        return None
+    return dated[position - 1]
+
+
+def find_unlisted(archive_dir, entries):
+    """
+    Find the numbered archives of an archive directory which the manifest
+    doesn't list.
+
+    :param archive_dir: The directory in which the archives are stored
+    :type archive_dir: str
+    :param entries: The entries of the manifest
+    :type entries: list
+    :return: The filenames of the unlisted archives ordered by number
+    :rtype: list
+    """
+    listed = set(entry.filename for entry in entries)
+    unlisted = [member for member in os.listdir(archive_dir)
+                if get_archive_number(member) is not None and
+                member not in listed]
+    unlisted.sort(key=get_archive_number)
+    return unlisted
+
+
+def get_archive_number(filename):
+    """
+    Get the number of an archive from its filename.
+
+    :param filename: The filename of the archive, as archN.zip
+    :type filename: str
+    :return: The number N, or None if the filename isn't an archive name
+    :rtype: int
+    """
+    match = _ARCHIVE_NAME.match(filename)
+    if match is None:
+        return None
+    return int(match.group(1))
+
+
+def get_journal_path(archive_dir):
+    """
+    Get the path of the journal of an archive directory.
+
+    :param archive_dir: The directory in which the archives are stored
+    :type archive_dir: str
+    :return: The path to the manifest-journal.json
+    :rtype: str
+    """
+    return os.path.abspath(archive_dir + "/" + JOURNAL_NAME)
+
+
+def get_manifest_path(archive_dir):
+    """
+    Get the path of the manifest of an archive directory.
+
+    :param archive_dir: The directory in which the archives are stored
+    :type archive_dir: str
+    :return: The path to the manifest.csv
+    :rtype: str
+    """
+    return os.path.abspath(archive_dir + "/" + MANIFEST_NAME)
+
+
+def get_timestamp_index(archive_dir, entries):
+    """
+    Get the entries of a manifest which have a timestamp, sorted by their
+    timestamps. Entries with the same timestamp keep their order. The
+    result is cached as long as the manifest is read from the cache of
+    read_manifest().
+
+    :param archive_dir: The directory in which the archives are stored
+    :type archive_dir: str
+    :param entries: The entries as returned by read_manifest()
+    :type entries: list
+    :return: The sorted timestamps and the entries in the same order
+    :rtype: tuple
+    """
+    path = get_manifest_path(archive_dir)
+    cached = _timestamp_cache.get(path)
+    if cached is not None and cached[0] is entries:
+        return cached[1], cached[2]
+    dated = sorted((entry for entry in entries
+                    if entry.timestamp is not None),
+                   key=lambda entry: entry.timestamp)
+    timestamps = [entry.timestamp for entry in dated]
+    _timestamp_cache[path] = (entries, timestamps, dated)
+    return timestamps, dated
+
+
+def is_complete(archivepath):
+    """
+    Check whether an archive was written completely. The metadata.json is
+    the last member written by a backup, so an archive without it was left
+    behind by a backup that didn't finish.
+
+    :param archivepath: The path to the archive
+    :type archivepath: str
+    :return: True if the archive can be read and holds its metadata
+    :rtype: bool
+    """
+    try:
+        archive = zipfile.ZipFile(archivepath, mode='r')
+    except (zipfile.BadZipFile, OSError):
+        return False
+    complete = "metadata.json" in archive.NameToInfo
+    archive.close()
+    return complete
+
+
+def read_header(path):
+    """
+    Read the header row of a manifest.
+
+    :param path: The path to the manifest.csv
+    :type path: str
+    :return: The column names
+    :rtype: list
+    """
+    file = open(path, 'r', newline='')
+    header = next(csv.reader([file.readline()]), [])
+    file.close()
+    return header
+
+
+def read_last_entry(archive_dir):
+    """
+    Read the last entry of the manifest without reading the whole file.
+
+    :param archive_dir: The directory in which the archives are stored
+    :type archive_dir: str
+    :return: The last entry, or None if the manifest doesn't exist or is
+        empty
+    :rtype: ManifestEntry
+    """
+    path = get_manifest_path(archive_dir)
+    try:
+        file = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    size = os.fstat(file.fileno()).st_size
+    file.seek(max(size - TAIL_BLOCK_SIZE, 0))
+    lines = file.read().decode("UTF-8").splitlines()
+    file.close()
+    if not lines or lines[-1].startswith(MANIFEST_FIELDS[0]):
+        return None
+    row = next(csv.reader([lines[-1]]))
+    return deserialize_row(dict(zip(MANIFEST_FIELDS, row)))
+
+
+def read_manifest(archive_dir):
+    """
+    Read the manifest of an archive directory. The parsed entries are cached
+    until the manifest changes.
+
+    :param archive_dir: The directory in which the archives are stored
+    :type archive_dir: str
+    :return: The entries ordered by sequence, or None if the directory has
+        no manifest
+    :rtype: list
+    """
+    path = get_manifest_path(archive_dir)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    cached = _cache.get(path)
+    if cached is not None and cached[0] == stat.st_mtime_ns and \
+            cached[1] == stat.st_size:
+        return cached[2]
+    file = open(path, 'r', newline='')
+    entries = deserialize_manifest(file.read())
+    file.close()
+    _cache[path] = (stat.st_mtime_ns, stat.st_size, entries)
+    return entries
+
+
+def rebuild_manifest(archive_dir, exclude=None):
+    """
+    Create the manifest of an archive directory from the archives in it. This
+    reads the metadata of every archive.
+
+    :param archive_dir: The directory in which the archives are stored
+    :type archive_dir: str
+    :param exclude: The filename of an archive to leave out
+    :type exclude: str, optional
+    :return: The entries ordered by sequence
+    :rtype: list
+    """
+    entries = []
+    for member in os.listdir(archive_dir):
+        number = get_archive_number(member)
+        if number is None or member == exclude:
+            continue
+        archivepath = os.path.abspath(archive_dir + "/" + member)
+        entries.append(create_entry(archivepath, number))
+    entries.sort(key=lambda entry: entry.sequence)
+    write_manifest(archive_dir, entries)
+    return entries
+
+
+def reconcile_manifest(archive_dir):
+    """
+    Bring the manifest in line with the numbered archives of the archive
+    directory. A backup killed before it recorded its archive, or an archive
+    copied into the directory, leaves an archive the manifest doesn't list.
+    Complete unlisted archives are added to the manifest, incomplete ones
+    are removed. This must only be called by the writer of the archive
+    directory, as it would remove the archive of a running backup.
+
+    :param archive_dir: The directory in which the archives are stored
+    :type archive_dir: str
+    :return: The filenames of the archives added to the manifest
+    :rtype: list
+    """
+    entries = read_manifest(archive_dir)
+    if entries is None:
+        # without a manifest the archives are listed from the directory
+        return []
+    adopted = []
+    for member in find_unlisted(archive_dir, entries):
+        archivepath = os.path.abspath(archive_dir + "/" + member)
+        if is_complete(archivepath):
+            entries = entries + [create_entry(archivepath,
+                                              get_archive_number(member))]
+            adopted.append(member)
+        else:
+            os.remove(archivepath)
+    if adopted:
+        entries.sort(key=lambda entry: entry.sequence)
+        write_manifest(archive_dir, entries)
+    return adopted
+
+
+def recover(archive_dir):
+    """
+    Complete a change of commit_changes() which was interrupted and remove
+    the temporary files left behind by killed writers. This must only be
+    called by the writer of the archive directory.
+
+    :param archive_dir: The directory in which the archives are stored
+    :type archive_dir: str
+    :return: True if an interrupted change was completed
+    :rtype: bool
+    """
+    recovered = False
+    path = get_journal_path(archive_dir)
+    if os.path.isfile(path):
+        file = open(path, 'r')
+        journal = json.loads(file.read())
+        file.close()
+        complete_changes(archive_dir, journal)
+        recovered = True
+    for member in os.listdir(archive_dir):
+        if member.startswith(TEMP_PREFIXES):
+            os.remove(os.path.abspath(archive_dir + "/" + member))
+    return recovered
+
+
+def serialize_manifest(entries):
+    """
+    Create the content of a manifest.
+
+    :param entries: The entries
+    :type entries: list
+    :return: The content of the manifest.csv
+    :rtype: str
+    """
+    output = io.StringIO(newline='')
+    writer = csv.writer(output)
+    writer.writerow(MANIFEST_FIELDS)
+    for entry in entries:
+        writer.writerow(entry.get_row())
+    return output.getvalue()
+
+
+def write_manifest(archive_dir, entries):
+    """
+    Replace the manifest of an archive directory atomically.
+
+    :param archive_dir: The directory in which the archives are stored
+    :type archive_dir: str
+    :param entries: The entries
+    :type entries: list
+    :return: void
+    :rtype: None
+    """
+    path = get_manifest_path(archive_dir)
+    descriptor, temp_path = tempfile.mkstemp(dir=archive_dir,
+                                             prefix=".manifest-")
+    file = os.fdopen(descriptor, 'w', newline='')
+    file.write(serialize_manifest(entries))
+    file.flush()
+    os.fsync(file.fileno())
+    file.close()
+    os.replace(temp_path, path)
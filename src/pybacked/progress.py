@@ -0,0 +1,265 @@
+import contextlib
+import os
+import threading
+import time
+
+_local = threading.local()
+
+
+class ProgressEvent:
+    """
+    Describes the progress of a phase of a backup or restore run.
+
+    :param phase: The name of the phase ("scan", "archive" or "restore")
+    :type phase: str
+    :param files_done: The number of files processed in the phase
+    :type files_done: int
+    :param files_total: The number of files to process in the phase, or None
+        if unknown
+    :type files_total: int
+    :param bytes_done: The number of bytes processed in the phase
+    :type bytes_done: int
+    :param bytes_total: The number of bytes to process in the phase, or None
+        if unknown
+    :type bytes_total: int
+    :param path: The path of the last processed file
+    :type path: str
+    :param rate: The instantaneous throughput in (files/s, bytes/s) since the
+        last event
+    :type rate: tuple
+    :param smoothed_rate: The exponentially smoothed throughput in
+        (files/s, bytes/s)
+    :type smoothed_rate: tuple
+    :param eta: The estimated remaining seconds of the phase, or None if
+        unknown
+    :type eta: float
+    :param finished: True for the last event of a phase
+    :type finished: bool
+    """
+    def __init__(self, phase, files_done, files_total, bytes_done,
+                 bytes_total, path, rate, smoothed_rate, eta, finished):
+        self.phase = phase
+        self.files_done = files_done
+        self.files_total = files_total
+        self.bytes_done = bytes_done
+        self.bytes_total = bytes_total
+        self.path = path
+        self.rate = rate
+        self.smoothed_rate = smoothed_rate
+        self.eta = eta
+        self.finished = finished
+
+
+class ProgressReporter:
+    """
+    Tracks the progress of a run and passes ProgressEvents to a callback.
+    Events are rate-limited to one per interval, so the callback overhead
+    stays negligible even for millions of files.
+
+    :param callback: The function called with each ProgressEvent
+    :type callback: callable
+    :param interval: The minimum time in seconds between two events
+        (default is 0.5)
+    :type interval: float, optional
+    :param smoothing: The weight of the newest rate in the exponentially
+        smoothed rate (default is 0.3)
+    :type smoothing: float, optional
+    """
+    def __init__(self, callback, interval=0.5, smoothing=0.3):
+        self.callback = callback
+        self.interval = interval
+        self.smoothing = smoothing
+        self.phase = None
+
+    def start_phase(self, phase, files_total=None, bytes_total=None):
+        """
+        Start a new phase and reset all counters.
+
+        :param phase: The name of the phase
+        :type phase: str
+        :param files_total: The number of files to process
+        :type files_total: int, optional
+        :param bytes_total: The number of bytes to process
+        :type bytes_total: int, optional
+        :return: void
+        :rtype: None
+        """
+        self.phase = phase
+        self.files_total = files_total
+        self.bytes_total = bytes_total
+        self.files_done = 0
+        self.bytes_done = 0
+        self.path = None
+        self.smoothed_rate = None
+        self.last_time = time.monotonic()
+        self.last_files = 0
+        self.last_bytes = 0
+        self.next_emit = self.last_time + self.interval
+
+    def update(self, path, nbytes=0, files=1):
+        """
+        Report processed files. An event is only emitted if the last event is
+        at least interval seconds old.
+
+        :param path: The path of the processed file
+        :type path: str
+        :param nbytes: The number of processed bytes
+        :type nbytes: int, optional
+        :param files: The number of processed files (default is 1)
+        :type files: int, optional
+        :return: void
+        :rtype: None
+        """
+        self.files_done += files
+        self.bytes_done += nbytes
+        self.path = path
+        now = time.monotonic()
+        if now >= self.next_emit:
+            self.emit(now, False)
+
+    def finish_phase(self):
+        """
+        Emit the final event of the current phase.
+
+        :return: void
+        :rtype: None
+        """
+        if self.phase is not None:
+            self.emit(time.monotonic(), True)
+            self.phase = None
+
+    def emit(self, now, finished):
+        """
+        Compute the rates and the ETA and pass an event to the callback.
+
+        :param now: The current monotonic time
+        :type now: float
+        :param finished: Whether this is the last event of the phase
+        :type finished: bool
+        :return: void
+        :rtype: None
+        """
+        elapsed = max(now - self.last_time, 1e-9)
+        rate = ((self.files_done - self.last_files) / elapsed,
+                (self.bytes_done - self.last_bytes) / elapsed)
+        if self.smoothed_rate is None:
+            self.smoothed_rate = rate
+        else:
+            self.smoothed_rate = tuple(
+                self.smoothing * new + (1 - self.smoothing) * old
+                for new, old in zip(rate, self.smoothed_rate))
+
+        eta = None
+        if finished:
+            eta = 0.0
+        elif self.bytes_total and self.smoothed_rate[1] > 0:
+            eta = (self.bytes_total - self.bytes_done) / self.smoothed_rate[1]
+        elif self.files_total and self.smoothed_rate[0] > 0:
+            eta = (self.files_total - self.files_done) / self.smoothed_rate[0]
+        if eta is not None:
+            eta = max(eta, 0.0)
+
+        self.last_time = now
+        self.last_files = self.files_done
+        self.last_bytes = self.bytes_done
+        self.next_emit = now + self.interval
+        self.callback(ProgressEvent(self.phase, self.files_done,
+                                    self.files_total, self.bytes_done,
+                                    self.bytes_total, self.path, rate,
+                                    self.smoothed_rate, eta, finished))
+
+
+@contextlib.contextmanager
+def activate(reporter):
+    """
+    Activate a ProgressReporter for the current thread. Everything reported
+    with update() inside of the context is passed to it. If reporter is None,
+    progress reporting is disabled inside of the context.
+
+    :param reporter: The ProgressReporter to report to
+    :type reporter: ProgressReporter
+    """
+    previous = getattr(_local, "reporter", None)
+    _local.reporter = reporter
+    try:
+        yield reporter
+    finally:
+        _local.reporter = previous
+
+
+def count_files(directory):
+    """
+    Count the files in a directory tree. Only the directory entries are read,
+    the files themselves aren't stat'd.
+
+    :param directory: The root of the tree
+    :type directory: str
+    :return: The number of files
+    :rtype: int
+    """
+    count = 0
+    for entry in os.scandir(directory):
+        if entry.is_dir(follow_symlinks=False):
+            count += count_files(entry.path)
+        else:
+            count += 1
+    return count
+
+
+def current():
+    """
+    Return the ProgressReporter active in the current thread.
+
+    :return: The active ProgressReporter or None
+    :rtype: ProgressReporter
+    """
+    return getattr(_local, "reporter", None)
+
+
+def start_phase(phase, files_total=None, bytes_total=None):
+    """
+    Start a phase on the active ProgressReporter. Does nothing if no reporter
+    is active.
+
+    :param phase: The name of the phase
+    :type phase: str
+    :param files_total: The number of files to process
+    :type files_total: int, optional
+    :param bytes_total: The number of bytes to process
+    :type bytes_total: int, optional
+    :return: void
+    :rtype: None
+    """
+    reporter = getattr(_local, "reporter", None)
+    if reporter is not None:
+        reporter.start_phase(phase, files_total, bytes_total)
+
+
+def finish_phase():
+    """
+    Finish the phase of the active ProgressReporter. Does nothing if no
+    reporter is active.
+
+    :return: void
+    :rtype: None
+    """
+    reporter = getattr(_local, "reporter", None)
+    if reporter is not None:
+        reporter.finish_phase()
+
+
+def update(path, nbytes=0):
+    """
+    Report a processed file to the active ProgressReporter. Does nothing if
+    no reporter is active.
+
+    :param path: The path of the processed file
+    :type path: str
+    :param nbytes: The number of processed bytes
+    :type nbytes: int, optional
+    :return: void
+    :rtype: None
+    """
+    reporter = getattr(_local, "reporter", None)
+    if reporter is not None:
+        reporter.update(path, nbytes)
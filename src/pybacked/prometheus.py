@@ -0,0 +1,191 @@
+import os
+import re
+import tempfile
+import time
+
+from pybacked.instrumentation import DURATION_BUCKETS
+
+
+def escape_label(value):
+    """
+    Escape a label value for the text exposition format.
+
+    :param value: The label value
+    :type value: str
+    :return: The escaped value
+    :rtype: str
+    """
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n") \
+        .replace('"', '\\"')
+
+
+def format_labels(labels):
+    """
+    Format a dictionary of labels as {name="value",...}.
+
+    :param labels: The label name, value pairs
+    :type labels: dict
+    :return: The formatted labels
+    :rtype: str
+    """
+    pairs = ['{}="{}"'.format(name, escape_label(value))
+             for name, value in labels.items()]
+    return "{" + ",".join(pairs) + "}"
+
+
+def format_metrics(name, operation, stats, archive_size=None,
+                   timestamp=None):
+    """
+    Format the Stats of a backup or restore run in the OpenMetrics text
+    format.
+
+    :param name: The name of the configuration, used as the config label
+    :type name: str
+    :param operation: The operation that was run ("backup" or "restore")
+    :type operation: str
+    :param stats: The Stats object of the run
+    :type stats: pybacked.instrumentation.Stats
+    :param archive_size: The size of the written archive in bytes
+    :type archive_size: int, optional
+    :param timestamp: The unix timestamp of the successful run (default is
+        time.time())
+    :type timestamp: float, optional
+    :return: The metrics
+    :rtype: str
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    base = {"config": name, "operation": operation}
+    lines = []
+
+    lines.append("# TYPE pybacked_phase_duration_seconds histogram")
+    lines.append("# HELP pybacked_phase_duration_seconds Duration of the "
+                 "single calls of each phase of the last run.")
+    for phase, (seconds, calls) in sorted(stats.phases.items()):
+        labels = dict(base, phase=phase)
+        cumulative = 0
+        for bound, count in zip(DURATION_BUCKETS, stats.histograms[phase]):
+            cumulative += count
+            lines.append("pybacked_phase_duration_seconds_bucket{} {}".format(
+                format_labels(dict(labels, le=repr(float(bound)))),
+                cumulative))
+        lines.append("pybacked_phase_duration_seconds_bucket{} {}".format(
+            format_labels(dict(labels, le="+Inf")), calls))
+        lines.append("pybacked_phase_duration_seconds_sum{} {}".format(
+            format_labels(labels), seconds))
+        lines.append("pybacked_phase_duration_seconds_count{} {}".format(
+            format_labels(labels), calls))
+
+    lines.append("# TYPE pybacked_run_duration_seconds gauge")
+    lines.append("# HELP pybacked_run_duration_seconds Duration of the last "
+                 "run.")
+    lines.append("pybacked_run_duration_seconds{} {}".format(
+        format_labels(base), stats.total))
+
+    lines.append("# TYPE pybacked_changed_files gauge")
+    lines.append("# HELP pybacked_changed_files Number of changed files in "
+                 "the last run by difftype.")
+    for difftype, (files, size) in sorted(stats.changes.items()):
+        lines.append("pybacked_changed_files{} {}".format(
+            format_labels(dict(base, difftype=difftype)), files))
+
+    lines.append("# TYPE pybacked_changed_bytes gauge")
+    lines.append("# HELP pybacked_changed_bytes Number of changed bytes in "
+                 "the last run by difftype.")
+    for difftype, (files, size) in sorted(stats.changes.items()):
+        lines.append("pybacked_changed_bytes{} {}".format(
+            format_labels(dict(base, difftype=difftype)), size))
+
+    if archive_size is not None:
+        lines.append("# TYPE pybacked_archive_size_bytes gauge")
+        lines.append("# HELP pybacked_archive_size_bytes Size of the archive "
+                     "written by the last run.")
+        lines.append("pybacked_archive_size_bytes{} {}".format(
+            format_labels(base), archive_size))
+
+    bytes_in = stats.counters.get("bytes_in", 0)
+    bytes_out = stats.counters.get("bytes_out", 0)
+    if bytes_in > 0 and bytes_out > 0:
+        lines.append("# TYPE pybacked_compression_ratio gauge")
+        lines.append("# HELP pybacked_compression_ratio Uncompressed divided "
+                     "by compressed bytes of the last run.")
+        lines.append("pybacked_compression_ratio{} {}".format(
+            format_labels(base), bytes_in / bytes_out))
+
+    lines.append("# TYPE pybacked_last_success_timestamp_seconds gauge")
+    lines.append("# HELP pybacked_last_success_timestamp_seconds Unix time "
+                 "of the last successful run.")
+    lines.append("pybacked_last_success_timestamp_seconds{} {}".format(
+        format_labels(base), timestamp))
+
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def get_textfile_path(metrics_dir, name, operation):
+    """
+    Get the path of the .prom file of a configuration and operation. Every
+    configuration and operation has its own file, so runs don't overwrite
+    each other's metrics.
+
+    :param metrics_dir: The directory read by the textfile collector
+    :type metrics_dir: str
+    :param name: The name of the configuration
+    :type name: str
+    :param operation: The operation ("backup" or "restore")
+    :type operation: str
+    :return: The path of the .prom file
+    :rtype: str
+    """
+    safe_name = re.sub(r"[^A-Za-z0-9_.-]", "_", name)
+    filename = "pybacked_{}_{}.prom".format(safe_name, operation)
+    return os.path.abspath(metrics_dir + "/" + filename)
+
+
+def write_textfile(path, content):
+    """
+    Write a .prom file atomically. The content is written to a temporary file
+    in the same directory first, which is then renamed, so the collector
+    never reads a partially written file.
+
+    :param path: The path of the .prom file
+    :type path: str
+    :param content: The metrics
+    :type content: str
+    :return: void
+    :rtype: None
+    """
+    directory = os.path.dirname(path)
+    descriptor, tmppath = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        file = os.fdopen(descriptor, 'w')
+        file.write(content)
+        file.flush()
+        os.fsync(file.fileno())
+        file.close()
+        os.chmod(tmppath, 0o644)
+        os.replace(tmppath, path)
+    except BaseException:
+        os.remove(tmppath)
+        raise
+
+
+def export(config, operation, stats, archive_size=None):
+    """
+    Write the metrics of a run to the metrics directory of the
+    configuration.
+
+    :param config: The configuration of the run
+    :type config: Configuration
+    :param operation: The operation ("backup" or "restore")
+    :type operation: str
+    :param stats: The Stats object of the run
+    :type stats: pybacked.instrumentation.Stats
+    :param archive_size: The size of the written archive in bytes
+    :type archive_size: int, optional
+    :return: void
+    :rtype: None
+    """
+    content = format_metrics(config.name, operation, stats, archive_size)
+    path = get_textfile_path(config.metrics_dir, config.name, operation)
+    write_textfile(path, content)
@@ -1,12 +1,171 @@
 import csv
 import hashlib
 import io
+import mmap
 import os
 import pybacked
+import pybacked.cancellation
 import pybacked.diff
+import pybacked.fileio
+import pybacked.hooks
+import pybacked.instrumentation
+import pybacked.manifest
+import pybacked.progress
+import pybacked.prometheus
+import pybacked.throttle
 import pybacked.zip_handler
+import stat
+import tempfile
+import time
 import zipfile
 
+FETCH_RESTORED = "restored"
+FETCH_DELETED = "deleted"
+FETCH_MISSING = "missing"
+
+
+class FetchResult:
+    """
+    The outcome of fetching a single file from an archive state.
+
+    :param filename: The archive relative filename of the file
+    :type filename: str
+    :param status: One of FETCH_RESTORED (the file was written to the
+        destination), FETCH_DELETED (the file was removed at that state) or
+        FETCH_MISSING (the file was never archived up to that state)
+    :type status: str
+    :param archives: The archives the data was read from, oldest first. For
+        a deleted file the archive which recorded the removal.
+    :type archives: list
+    :param destination: The path the file was written to
+    :type destination: str, optional
+    :param size: The size of the written file in bytes
+    :type size: int, optional
+    """
+    def __init__(self, filename, status, archives, destination=None,
+                 size=None):
+        self.filename = filename
+        self.status = status
+        self.archives = archives
+        self.destination = destination
+        self.size = size
+
+
+def fetch(config, path, archive=None, dest=None, index=None):
+    """
+    Restore a single file of an archive state without restoring the rest of
+    the state. Only the diff-logs of the archives replayed for the state are
+    searched for the newest entry of the file, starting at the restored
+    archive, and only the members holding the file are extracted. With an
+    index no diff-log is read.
+
+    :param config: The configuration of the archive directory
+    :type config: Configuration
+    :param path: The archive relative filename of the file or its path in
+        the storage directory
+    :type path: str
+    :param archive: The name of the archive which holds the state (default
+        is the newest archive)
+    :type archive: str, optional
+    :param dest: The path the file is written to, an existing file is
+        replaced once the fetched file is complete (default is the path of
+        the file in the storage directory)
+    :type dest: str, optional
+    :param index: An index of the archive directory, which is used instead
+        of reading the diff-logs of the archives
+    :type index: pybacked.index.ArchiveIndex, optional
+    :return: The result, which tells whether the file was restored. If the
+        archive directory is empty, the file is FETCH_MISSING.
+    :rtype: FetchResult
+    """
+    if os.path.isabs(path):
+        filename = os.path.relpath(path, config.storage)
+    else:
+        filename = path
+    filename = filename.replace("\\", "/")
+    if dest is None:
+        dest = os.path.abspath(config.storage + "/" + filename)
+    if archive is None:
+        if index is not None:
+            newest = index.archives[-1:]
+        else:
+            newest = get_archive_list(config.archive)[:1]
+        if not newest:
+            # nothing was archived yet
+            return FetchResult(filename, FETCH_MISSING, [])
+        archivepath = newest[0]
+    else:
+        archivepath = os.path.abspath(config.archive + "/" + archive)
+
+    if index is not None:
+        entries = dict()
+        for entry in index.history.get(filename, []):
+            entries[entry.archive] = entry.modtype
+    parts = []
+    for replayed in reversed(get_replay_list(archivepath, index)):
+        if index is not None:
+            modtype = entries.get(replayed)
+        else:
+            diff_entry = find_diff_archive(replayed, filename)
+            modtype = None if diff_entry is None else diff_entry["modtype"]
+        if modtype is None:
+            continue
+        elif modtype == '-':
+            if not parts:
+                return FetchResult(filename, FETCH_DELETED, [replayed])
+            break
+        parts.insert(0, replayed)
+        if modtype != 'a':
+            break
+    if not parts:
+        return FetchResult(filename, FETCH_MISSING, [])
+
+    # the file is written next to the destination and only replaces it once
+    # it is complete, so a failed fetch keeps the current file
+    directory = os.path.dirname(dest)
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix=".fetch-")
+    os.close(descriptor)
+    os.remove(temp_path)
+    try:
+        with pybacked.throttle.activate(
+                pybacked.throttle.from_config(config)):
+            pybacked.zip_handler.extract_archdata(
+                parts[0], "data/" + filename, temp_path, config.fadvise)
+            for part in parts[1:]:
+                pybacked.zip_handler.append_archdata(
+                    part, "data/" + filename, temp_path, config.fadvise)
+        os.replace(temp_path, dest)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return FetchResult(filename, FETCH_RESTORED, parts, dest,
+                       os.path.getsize(dest))
+
+
+def fetch_at(config, path, timestamp, dest=None, index=None):
+    """
+    Restore a single file as it was archived at a point in time, see fetch()
+    and get_archive_at().
+
+    :param config: The configuration of the archive directory
+    :type config: Configuration
+    :param path: The archive relative filename of the file or its path in
+        the storage directory
+    :type path: str
+    :param timestamp: The point in time
+    :type timestamp: float
+    :param dest: The path the file is written to
+    :type dest: str, optional
+    :param index: An index of the archive directory
+    :type index: pybacked.index.ArchiveIndex, optional
+    :return: The result, which tells whether the file was restored
+    :rtype: FetchResult
+    :raises ValueError: If there is no archive of that time
+    """
+    return fetch(config, path, get_archive_at(config, timestamp), dest, index)
+
 
 def find_diff(logfile, filename):
     """
@@ -39,6 +198,7 @@ def find_diff_archive(archivepath, filename):
     # This function eccentialy just opens the log-file inside the archive
     # and wrapps it in a way that find_diff can understand
     archive = zipfile.ZipFile(archivepath, mode='r')
+    pybacked.instrumentation.count("archives_opened")
     diff_log_bytes = archive.open("diff-log.csv", mode='r')
     diff_log = io.TextIOWrapper(diff_log_bytes, encoding="UTF-8", newline=None)
 
@@ -50,14 +210,45 @@ def find_diff_archive(archivepath, filename):
     return diff_entry
 
 
+def get_archive_at(config, timestamp):
+    """
+    Get the name of the archive holding the state of the storage directory
+    at a point in time, which is the newest archive created at or before it.
+    The archive is found in the timestamp index of the manifest without
+    reading the metadata of the archives.
+
+    :param config: The configuration of the archive directory
+    :type config: Configuration
+    :param timestamp: The point in time
+    :type timestamp: float
+    :return: The name of the archive
+    :rtype: str
+    :raises ValueError: If all archives were created after that time
+    """
+    entry = pybacked.manifest.find_entry_at(config.archive, timestamp)
+    if entry is None:
+        raise ValueError("No archive was created at or before " +
+                         repr(timestamp))
+    return entry.filename
+
+
 def get_archive_list(archivedir):
     """
-    Return a list of paths to all the backup archives.
+    Return a list of paths to all the backup archives, newest first. The
+    archives are taken from the manifest of the directory, without listing
+    the directory, as archives the manifest doesn't list are recorded or
+    removed when the next backup starts. Directories without a manifest are
+    listed and the archives ordered by their number.
 
     :param archivedir: The directory in which archives are stored
     :return: a list of paths to all the backup archives
     :rtype: list
     """
+    entries = pybacked.manifest.read_manifest(archivedir)
+    if entries is not None:
+        return [os.path.abspath(archivedir + '/' + entry.filename)
+                for entry in reversed(entries)]
+
     raw_list = os.listdir(archivedir)
     final_list = []
     for member in raw_list:
@@ -65,11 +256,129 @@ def get_archive_list(archivedir):
             if member.find(".zip") > -1:
                 final_list.append(os.path.abspath(archivedir + '/' + member))
     # invert order to have newest archive on [0]
-    final_list.sort(reverse=True)
+    final_list.sort(key=get_archive_sort_key, reverse=True)
     return final_list
 
 
-def get_current_state(filepath, diff_algorithm, hash_algorithm=None):
+def get_archive_sort_key(archivepath):
+    """
+    Return the key by which archives are ordered. Archives are ordered by
+    their number, so arch10.zip follows arch9.zip. Other zip files are
+    ordered by name before the numbered archives.
+
+    :param archivepath: The path to the archive
+    :type archivepath: str
+    :return: The sort key
+    :rtype: tuple
+    """
+    filename = os.path.basename(archivepath)
+    number = pybacked.manifest.get_archive_number(filename)
+    if number is None:
+        return (0, 0, filename)
+    return (1, number, filename)
+
+
+def get_archive_kinds(archivedir):
+    """
+    Return the kinds of the archives recorded in the manifest.
+
+    :param archivedir: The directory in which archives are stored
+    :type archivedir: str
+    :return: A dictionary of archive path, kind key-value pairs. Archives
+        missing in it are incremental archives.
+    :rtype: dict
+    """
+    entries = pybacked.manifest.read_manifest(archivedir)
+    kinds = dict()
+    if entries is not None:
+        for entry in entries:
+            if entry.kind != pybacked.ARCHIVE_INCREMENTAL:
+                kinds[os.path.abspath(archivedir + '/' + entry.filename)] = \
+                    entry.kind
+    return kinds
+
+
+def get_lookup_list(archivedir):
+    """
+    Return the archives that have to be searched for the last archived state
+    of a file, newest first. A full archive holds the complete state, so the
+    search stops at the newest full archive.
+
+    :param archivedir: The directory in which archives are stored
+    :type archivedir: str
+    :return: A list of paths to the archives
+    :rtype: list
+    """
+    archive_list = get_archive_list(archivedir)
+    kinds = get_archive_kinds(archivedir)
+    for i, archivepath in enumerate(archive_list):
+        if kinds.get(archivepath) == pybacked.ARCHIVE_FULL:
+            return archive_list[:i + 1]
+    return archive_list
+
+
+def get_replay_list(archive, index=None):
+    """
+    Return the archives, which are replayed to restore the state of an
+    archive, in the order of the replay.
+
+    :param archive: The path to the restored archive
+    :type archive: str
+    :param index: An index of the archive directory, from which the
+        archives and their kinds are taken
+    :type index: pybacked.index.ArchiveIndex, optional
+    :return: The paths to the archives
+    :rtype: list
+    """
+    if index is not None:
+        archive_list = list(index.archives)
+        kinds = index.kinds
+    else:
+        archive_dir = os.path.split(archive)[0]
+        archive_list = get_archive_list(archive_dir)
+        # put archives into ascending order
+        archive_list.reverse()
+        kinds = get_archive_kinds(archive_dir)
+    position = archive_list.index(archive)
+    return [archive_list[i]
+            for i in get_restore_chain(archive_list, kinds, position)]
+
+
+def get_restore_chain(archive_list, kinds, position):
+    """
+    Return the positions of the archives that have to be replayed to restore
+    the state of an archive. The replay starts at the newest full archive up
+    to the restored archive, or at the first archive if there is none. A
+    reverse delta is restored from the next full archive after it, stepping
+    back through the reverse deltas in between.
+
+    :param archive_list: The paths to all archives in ascending order
+    :type archive_list: list
+    :param kinds: A dictionary of archive path, kind key-value pairs as
+        returned by get_archive_kinds()
+    :type kinds: dict
+    :param position: The position of the restored archive in archive_list
+    :type position: int
+    :return: The positions in archive_list in the order of the replay
+    :rtype: list
+    """
+    if kinds.get(archive_list[position]) == pybacked.ARCHIVE_REVERSE:
+        for i in range(position + 1, len(archive_list)):
+            if kinds.get(archive_list[i]) == pybacked.ARCHIVE_FULL:
+                return list(range(i, position - 1, -1))
+        raise ValueError("No full archive after the reverse delta " +
+                         archive_list[position])
+    start = 0
+    for i in range(position, -1, -1):
+        if kinds.get(archive_list[i]) == pybacked.ARCHIVE_FULL:
+            start = i
+            break
+    return list(range(start, position + 1))
+
+
+@pybacked.hooks.hooked("get_current_state", path="filepath")
+def get_current_state(filepath, diff_algorithm, hash_algorithm=None,
+                      hash_cache=None, fadvise=False):
     """
     Get the current state of the file.
 
@@ -79,8 +388,16 @@ def get_current_state(filepath, diff_algorithm, hash_algorithm=None):
     :type diff_algorithm: int
     :param hash_algorithm: the desired hash algorithm
     :type hash_algorithm: str, optional
+    :param hash_cache: If given, DIFF_HASH uses tiered hashing, where the full
+        hash is only computed if the sample hash doesn't match the cache.
+    :type hash_cache: HashCache, optional
+    :param fadvise: Drop the hashed file from the page cache afterwards
+    :type fadvise: bool, optional
     :return: return the current state, or None if file doesn't exist
     """
+    if diff_algorithm == pybacked.DIFF_STAT:
+        return get_stat_state(filepath)
+
     if os.path.isfile(filepath) is False:
         return None
 
@@ -89,29 +406,181 @@ def get_current_state(filepath, diff_algorithm, hash_algorithm=None):
     if diff_algorithm == pybacked.DIFF_DATE:
         return get_edit_date(filepath)
     elif diff_algorithm == pybacked.DIFF_HASH:
-        return get_file_hash(filepath, hash_algorithm)
+        if hash_cache is not None:
+            return get_tiered_hash(filepath, hash_algorithm, hash_cache,
+                                   fadvise)
+        return get_file_hash(filepath, hash_algorithm, fadvise=fadvise)
     elif diff_algorithm == pybacked.DIFF_CONT:
         return get_file_content(filepath)
 
 
-def get_file_hash(filepath, algorithm):
+def get_file_hash(filepath, algorithm, length=None, fadvise=False):
     """
-    Get hash of a file.
+    Get hash of a file. Files of at least MMAP_THRESHOLD bytes are memory
+    mapped and hashed in slices of HASH_CHUNK_SIZE to avoid copying the data
+    into userspace buffers.
 
     :param filepath: the path to the file
     :type filepath: str
     :param algorithm: the desired hashing algorithm
     :type algorithm: str
+    :param length: If given, only the first length bytes of the file are
+        hashed. This is used to fingerprint the prefix of a file.
+    :type length: int, optional
+    :param fadvise: Advise sequential access before reading and drop the file
+        from the page cache after it was hashed
+    :type fadvise: bool, optional
     :return: Hash of the file in hex form.
     :rtype: str
     """
     file = io.open(filepath, "rb")
+    if fadvise:
+        pybacked.fileio.advise_sequential(file)
+    hash_handler = hashlib.new(algorithm)
+    size = os.fstat(file.fileno()).st_size
+    if length is not None:
+        size = min(size, length)
+    pybacked.instrumentation.count("bytes_hashed", size)
+    if pybacked.hooks.enabled:
+        pybacked.hooks.annotate(bytes=size)
+
+    if size >= pybacked.MMAP_THRESHOLD:
+        mapped = open_mmap(file)
+        view = memoryview(mapped)
+        for position in range(0, size, pybacked.HASH_CHUNK_SIZE):
+            end = min(position + pybacked.HASH_CHUNK_SIZE, size)
+            pybacked.throttle.read(end - position)
+            hash_handler.update(view[position:end])
+            pybacked.throttle.cpu()
+        view.release()
+        mapped.close()
+    else:
+        pybacked.throttle.read(size)
+        if length is None:
+            hash_handler.update(file.read())
+        else:
+            hash_handler.update(file.read(length))
+        pybacked.throttle.cpu()
+    if fadvise:
+        pybacked.fileio.advise_dontneed(file)
+    file.close()
+    return hash_handler.hexdigest()
+
+
+def compare_file_content(filepath, content):
+    """
+    Check whether the content of a file is identical to the given content.
+    Files of at least MMAP_THRESHOLD bytes are memory mapped and compared in
+    slices, so the file never has to be read into memory as a whole.
+
+    :param filepath: The path to the file
+    :type filepath: str
+    :param content: The content to compare the file against
+    :type content: bytes
+    :return: True if the file content matches - False if it doesn't, or if
+        the file doesn't exist
+    :rtype: bool
+    """
+    if content is None or os.path.isfile(filepath) is False:
+        return False
+    file = open(filepath, "rb")
+    size = os.fstat(file.fileno()).st_size
+    if size != len(content):
+        file.close()
+        return False
+
+    if size >= pybacked.MMAP_THRESHOLD:
+        mapped = open_mmap(file)
+        view = memoryview(mapped)
+        expected = memoryview(content)
+        identical = True
+        for position in range(0, size, pybacked.HASH_CHUNK_SIZE):
+            end = min(position + pybacked.HASH_CHUNK_SIZE, size)
+            if view[position:end] != expected[position:end]:
+                identical = False
+                break
+        view.release()
+        expected.release()
+        mapped.close()
+    else:
+        identical = file.read() == content
+    file.close()
+    return identical
+
+
+def open_mmap(file):
+    """
+    Memory map an opened file read-only and advise the kernel that the
+    mapping will be read sequentially, where madvise is available.
+
+    :param file: The file opened in binary mode
+    :type file: io.BufferedReader
+    :return: The memory mapped file
+    :rtype: mmap.mmap
+    """
+    mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mapped, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+        mapped.madvise(mmap.MADV_SEQUENTIAL)
+    return mapped
+
+
+def get_sample_hash(filepath, algorithm,
+                    block_size=pybacked.SAMPLE_BLOCK_SIZE):
+    """
+    Get the hash of sampled blocks at the head, the middle and the tail of a
+    file. Files smaller than three blocks are hashed completely.
+
+    :param filepath: the path to the file
+    :type filepath: str
+    :param algorithm: the desired hashing algorithm
+    :type algorithm: str
+    :param block_size: the size of each sampled block
+    :type block_size: int, optional
+    :return: Sample hash of the file in hex form.
+    :rtype: str
+    """
+    size = os.path.getsize(filepath)
+    file = io.open(filepath, "rb")
     hash_handler = hashlib.new(algorithm)
-    hash_handler.update(file.read())
+    pybacked.instrumentation.count("bytes_hashed", min(size, 3 * block_size))
+    if size <= 3 * block_size:
+        hash_handler.update(file.read())
+    else:
+        for position in (0, (size - block_size) // 2, size - block_size):
+            file.seek(position)
+            hash_handler.update(file.read(block_size))
     file.close()
     return hash_handler.hexdigest()
 
 
+def get_tiered_hash(filepath, algorithm, hash_cache, fadvise=False):
+    """
+    Get the hash of a file using tiered hashing. The size and the sample hash
+    of the file are compared against the values in the hash cache first. Only
+    if they differ, or if the last full verification of the file is older than
+    the verify interval of the cache, the full hash is computed and the cache
+    updated.
+
+    :param filepath: the path to the file
+    :type filepath: str
+    :param algorithm: the desired hashing algorithm
+    :type algorithm: str
+    :param hash_cache: The cache holding the results of previous runs
+    :type hash_cache: HashCache
+    :param fadvise: Drop the file from the page cache after it was hashed
+    :type fadvise: bool, optional
+    :return: Hash of the file in hex form.
+    :rtype: str
+    """
+    size = os.path.getsize(filepath)
+    sample = get_sample_hash(filepath, algorithm)
+    file_hash = hash_cache.lookup(filepath, size, sample, algorithm)
+    if file_hash is None:
+        file_hash = get_file_hash(filepath, algorithm, fadvise=fadvise)
+        hash_cache.update(filepath, size, sample, file_hash, algorithm)
+    return file_hash
+
+
 def get_edit_date(filepath):
     """
     Return the unix timestamp for the last edit. This function is primarily
@@ -125,6 +594,28 @@ def get_edit_date(filepath):
     return timestamp
 
 
+def get_stat_state(filepath):
+    """
+    Return the packed stat state of a file. The state consists of the size,
+    the modification time and the change time in nanoseconds and the inode
+    number and is obtained with a single stat call.
+
+    :param filepath: the path to the file
+    :type filepath: str
+    :return: The state in the form "size:mtime_ns:ctime_ns:ino", or None if
+        the file doesn't exist
+    :rtype: str
+    """
+    try:
+        stat_result = os.stat(filepath)
+    except FileNotFoundError:
+        return None
+    if not stat.S_ISREG(stat_result.st_mode):
+        return None
+    return "{}:{}:{}:{}".format(stat_result.st_size, stat_result.st_mtime_ns,
+                                stat_result.st_ctime_ns, stat_result.st_ino)
+
+
 def get_file_content(filepath):
     """
     Get the file content in binary mode
@@ -140,7 +631,9 @@ def get_file_content(filepath):
     return content
 
 
-def get_arch_state(filename, archivedir, diff_algorithm):
+@pybacked.hooks.hooked("get_arch_state", path="filename",
+                       archive="archivedir")
+def get_arch_state(filename, archivedir, diff_algorithm, index=None):
     """
     Get the last (diff) state of the archived file version.
 
@@ -150,17 +643,23 @@ def get_arch_state(filename, archivedir, diff_algorithm):
     :type archivedir: str
     :param diff_algorithm: The diff-detection algorithm used
     :type diff_algorithm: int
+    :param index: An index of the archive directory, which is used instead
+        of reading the diff-logs of the archives
+    :type index: pybacked.index.ArchiveIndex, optional
     :return: the last state (diff) of the archived file
     """
-    archive_list = get_archive_list(archivedir)
-    i = 0
-    i_max = len(archive_list)
-    diff_entry = None
-    while diff_entry is None:
-        if i == i_max:
-            break
-        diff_entry = find_diff_archive(archive_list[i], filename)
-        i += 1
+    if index is not None:
+        diff_entry = index.find(filename)
+    else:
+        archive_list = get_lookup_list(archivedir)
+        i = 0
+        i_max = len(archive_list)
+        diff_entry = None
+        while diff_entry is None:
+            if i == i_max:
+                break
+            diff_entry = find_diff_archive(archive_list[i], filename)
+            i += 1
     if diff_entry is None:
         return None
     else:
@@ -168,11 +667,56 @@ def get_arch_state(filename, archivedir, diff_algorithm):
             return float(diff_entry['diff'])
         elif diff_algorithm == pybacked.DIFF_HASH:
             return diff_entry['diff']
+        elif diff_algorithm == pybacked.DIFF_STAT:
+            return diff_entry['diff']
         elif diff_algorithm == pybacked.DIFF_CONT:
             return bytes.fromhex(diff_entry['diff'])
 
 
-def restore(config, archname, alt_dir=None):
+def get_arch_size(filename, archivedir, index=None):
+    """
+    Get the size of the last archived version of a file. If the file was
+    archived as a chain of appends, the sizes of all the appended tails are
+    added to the size of the archived base version.
+
+    :param filename: The filename searched for
+    :type filename: str
+    :param archivedir: The directory where the archive files are stored
+    :type archivedir: str
+    :param index: An index of the archive directory, which is used instead
+        of opening the archives
+    :type index: pybacked.index.ArchiveIndex, optional
+    :return: The size of the archived file version in bytes, or None if the
+        file isn't archived (or was archived as removed)
+    :rtype: int
+    """
+    if index is not None:
+        return index.get_arch_size(filename)
+    size = 0
+    for archivepath in get_lookup_list(archivedir):
+        archive = zipfile.ZipFile(archivepath, mode='r')
+        pybacked.instrumentation.count("archives_opened")
+        diff_log_bytes = archive.open("diff-log.csv", mode='r')
+        diff_log = io.TextIOWrapper(diff_log_bytes, encoding="UTF-8",
+                                    newline=None)
+        diff_entry = find_diff(diff_log, filename)
+        diff_log_bytes.close()
+
+        if diff_entry is None:
+            archive.close()
+            continue
+        elif diff_entry['modtype'] == '-':
+            archive.close()
+            return None
+
+        size += archive.getinfo("data/" + filename).file_size
+        archive.close()
+        if diff_entry['modtype'] != 'a':
+            return size
+    return None
+
+
+def restore(config, archname, alt_dir=None, progress=None, index=None):
     """
     Restore a given backup to the original source directory or an alternative
     directory.
@@ -187,18 +731,64 @@ def restore(config, archname, alt_dir=None):
         to the original source directory specified in the provieded
         Configuration class instance.
     :type alt_dir: str, optional
-    :return: void
-    :rtype: None
+    :param progress: Function called with pybacked.progress.ProgressEvent
+        objects during the "restore" phase
+    :type progress: callable, optional
+    :param index: An index of the archive directory, from which the
+        diff-logs are taken instead of reading them from the archives
+    :type index: pybacked.index.ArchiveIndex, optional
+    :return: The timing and counters of the restore run
+    :rtype: pybacked.instrumentation.Stats
     """
     if alt_dir is None:
         restore_dir = config.storage
     else:
         restore_dir = alt_dir
     archive = os.path.abspath(config.archive + "/" + archname)
-    restore_archive_state(archive, restore_dir)
 
+    if progress is None:
+        reporter = None
+    else:
+        reporter = pybacked.progress.ProgressReporter(progress)
+
+    stats = pybacked.instrumentation.Stats()
+    start = time.perf_counter()
+    with pybacked.instrumentation.activate(stats), \
+            pybacked.progress.activate(reporter), \
+            pybacked.throttle.activate(pybacked.throttle.from_config(config)):
+        restore_archive_state(archive, restore_dir, config.fadvise, index)
+    stats.total = time.perf_counter() - start
+
+    if config.metrics_dir is not None:
+        pybacked.prometheus.export(config, "restore", stats)
+    return stats
 
-def restore_archive_state(archive, restore_dir):
+
+def restore_at(config, timestamp, alt_dir=None, progress=None, index=None):
+    """
+    Restore the state of the storage directory at a point in time, see
+    restore() and get_archive_at().
+
+    :param config: The configuration for the backup
+    :type config: Configuration
+    :param timestamp: The point in time
+    :type timestamp: float
+    :param alt_dir: An alternative directory to restore to
+    :type alt_dir: str, optional
+    :param progress: Function called with pybacked.progress.ProgressEvent
+        objects during the "restore" phase
+    :type progress: callable, optional
+    :param index: An index of the archive directory
+    :type index: pybacked.index.ArchiveIndex, optional
+    :return: The timing and counters of the restore run
+    :rtype: pybacked.instrumentation.Stats
+    :raises ValueError: If there is no archive of that time
+    """
+    return restore(config, get_archive_at(config, timestamp), alt_dir,
+                   progress, index)
+
+
+def restore_archive_state(archive, restore_dir, fadvise=False, index=None):
     """
     Restore a given archive state. This will restore the state of the source
     at the creation of the specified archive.
@@ -208,28 +798,79 @@ def restore_archive_state(archive, restore_dir):
     :type archive: str
     :param restore_dir: The directory in which the archive should be restored
     :type restore_dir: str
+    :param fadvise: Drop the restored files from the page cache after they
+        were written
+    :type fadvise: bool, optional
+    :param index: An index of the archive directory, from which the
+        diff-logs are taken instead of reading them from the archives
+    :type index: pybacked.index.ArchiveIndex, optional
     :return: void
     :rtype: None
     """
-    archive_dir = os.path.split(archive)[0]
-    archive_list = get_archive_list(archive_dir)
-    # put archives into ascending order
-    archive_list.sort()
-    index = archive_list.index(archive)
-    for i in range(index + 1):
-        diffcache = pybacked.diff.diff_log_deserialize(archive_list[i],
-                                                       basepath=None)
+    chain = get_replay_list(archive, index)
+    diffcaches = []
+    for archivepath in chain:
+        with pybacked.instrumentation.phase("read_log"):
+            if index is not None:
+                diffcaches.append(index.get_diffcache(archivepath))
+            else:
+                diffcaches.append(pybacked.diff.diff_log_deserialize(
+                    archivepath, basepath=None))
+
+    # the logs are read up front, so the progress has a known total
+    pybacked.progress.start_phase(
+        "restore", sum(len(diffcache.diffdict) for diffcache in diffcaches))
+    for archivepath, diffcache in zip(chain, diffcaches):
         for entry in diffcache:
+            pybacked.cancellation.check()
             archname = "data/" + entry[0]
             destination = os.path.abspath(restore_dir + "/" + entry[0])
-            if entry[1].difftype == '+':
-                pybacked.zip_handler.extract_archdata(archive_list[i],
-                                                      archname, destination)
-            elif entry[1].difftype == '*':
-                if os.path.exists(destination):
-                    os.remove(destination)
-                pybacked.zip_handler.extract_archdata(archive_list[i],
-                                                      archname, destination)
-            elif entry[1].difftype == '-':
-                if os.path.exists(destination):
-                    os.remove(destination)
+            with pybacked.instrumentation.phase("extract"):
+                restore_entry(archivepath, archname, destination,
+                              entry[1].difftype, fadvise)
+    pybacked.progress.finish_phase()
+
+
+def restore_entry(archive, archname, destination, difftype, fadvise=False):
+    """
+    Apply a single diff-log entry of an archive to the restore directory.
+
+    :param archive: The path to the zip-archive holding the entry
+    :type archive: str
+    :param archname: The name of the member in the archive
+    :type archname: str
+    :param destination: The path of the restored file
+    :type destination: str
+    :param difftype: The modtype of the diff-log entry
+    :type difftype: str
+    :param fadvise: Drop the restored file from the page cache after it was
+        written
+    :type fadvise: bool, optional
+    :return: void
+    :rtype: None
+    """
+    if difftype == '+':
+        pybacked.zip_handler.extract_archdata(archive, archname, destination,
+                                              fadvise)
+        size = os.path.getsize(destination)
+    elif difftype == '*':
+        if os.path.exists(destination):
+            os.remove(destination)
+        pybacked.zip_handler.extract_archdata(archive, archname, destination,
+                                              fadvise)
+        size = os.path.getsize(destination)
+    elif difftype == 'a':
+        size = os.path.getsize(destination)
+        pybacked.zip_handler.append_archdata(archive, archname, destination,
+                                             fadvise)
+        size = os.path.getsize(destination) - size
+    elif difftype == '-':
+        size = 0
+        if os.path.exists(destination):
+            os.remove(destination)
+    else:
+        # rows of an unknown modtype are skipped, but still make progress
+        pybacked.progress.update(destination, 0)
+        return
+    pybacked.instrumentation.count_change(difftype, size)
+    pybacked.progress.update(destination, size)
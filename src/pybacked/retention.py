@@ -0,0 +1,291 @@
+import datetime
+import os
+import pybacked
+import pybacked.consolidate
+import pybacked.manifest
+import tempfile
+import time
+import zipfile
+
+PERIODS = ("hour", "day", "week", "month", "year")
+
+# keep hourly archives for a day, daily archives for 30 days and monthly
+# archives forever
+DEFAULT_RULES = {"hour": 86400, "day": 2592000, "month": None}
+
+
+class RetentionResult:
+    """
+    The outcome of applying the retention rules to an archive directory.
+
+    :param kept: The filenames of the kept archives, oldest first
+    :type kept: list
+    :param pruned: The filenames of the pruned archives, oldest first
+    :type pruned: list
+    :param reclaimed: The number of bytes freed. For a dry run this is an
+        estimate, as the folded archives aren't written.
+    :type reclaimed: int
+    :param dry_run: True if no archive was changed
+    :type dry_run: bool
+    """
+    def __init__(self, kept, pruned, reclaimed, dry_run):
+        self.kept = kept
+        self.pruned = pruned
+        self.reclaimed = reclaimed
+        self.dry_run = dry_run
+
+
+def apply_retention(config, rules=None, now=None, dry_run=False):
+    """
+    Prune the archives of a configuration which aren't kept by the retention
+    rules. The newest archive is always kept. The changes of pruned archives
+    are folded into the next kept archive (or for reverse deltas into the
+    previous kept reverse delta), so every kept archive can still be
+    restored. Member data is copied without recompressing it, only files
+    archived as a chain of appended tails are recompressed. Kept archives
+    keep their names and numbers.
+
+    The folded archives are written to temporary files first and then
+    committed together with the manifest through a journal, which the next
+    run completes if this one is killed (see manifest.recover()).
+
+    This must not run concurrently with a backup of the same archive
+    directory.
+
+    :param config: The configuration of the archive directory
+    :type config: Configuration
+    :param rules: The retention rules as described for
+        Configuration.retention (default is config.retention, or
+        DEFAULT_RULES if it isn't set)
+    :type rules: dict, optional
+    :param now: The timestamp the rule windows end at (default is the
+        current time)
+    :type now: float, optional
+    :param dry_run: Only report which archives would be pruned and the space
+        that would be reclaimed
+    :type dry_run: bool, optional
+    :return: The kept and pruned archives and the reclaimed space
+    :rtype: RetentionResult
+    """
+    if rules is None:
+        rules = config.retention
+    if rules is None:
+        rules = DEFAULT_RULES
+    if now is None:
+        now = time.time()
+    if not dry_run:
+        pybacked.manifest.recover(config.archive)
+    entries = pybacked.manifest.read_manifest(config.archive)
+    if entries is None:
+        entries = pybacked.manifest.rebuild_manifest(config.archive)
+    kept = select_archives(entries, rules, now)
+    result = RetentionResult([entry.filename for entry in entries
+                              if entry.filename in kept],
+                             [entry.filename for entry in entries
+                              if entry.filename not in kept],
+                             0, dry_run)
+    if not result.pruned:
+        return result
+
+    result.reclaimed = sum(entry.size for entry in entries
+                           if entry.filename not in kept)
+    replaced = dict()
+    temp_names = dict()
+    try:
+        for group in get_groups(entries, kept):
+            target = group[-1]
+            paths = [pybacked.consolidate.get_archive_path(config.archive,
+                                                           entry)
+                     for entry in group]
+            changes = pybacked.consolidate.fold_archives(paths)
+            if dry_run:
+                result.reclaimed -= get_carried_size(changes, paths[:-1])
+                continue
+            kind = group[0].kind
+            if kind == pybacked.ARCHIVE_INCREMENTAL:
+                kind = None
+            temp_path, replaced[target.filename] = fold_into(
+                config, changes, target, kind)
+            temp_names[os.path.basename(temp_path)] = target.filename
+            result.reclaimed -= replaced[target.filename].size - target.size
+    except BaseException:
+        # no archive was changed yet
+        for temp_name in temp_names:
+            os.remove(os.path.abspath(config.archive + "/" + temp_name))
+        raise
+
+    if dry_run:
+        return result
+    remaining = [replaced.get(entry.filename, entry) for entry in entries
+                 if entry.filename in kept]
+    pybacked.manifest.commit_changes(config.archive, remaining, temp_names,
+                                     result.pruned)
+    return result
+
+
+def fold_into(config, changes, entry, kind):
+    """
+    Write the archive holding the folded changes, which replaces an
+    archive, to a temporary file in the archive directory.
+
+    :param config: The configuration of the archive directory
+    :type config: Configuration
+    :param changes: A dictionary of filename, FileChange key-value pairs
+    :type changes: dict
+    :param entry: The manifest entry of the archive to replace
+    :type entry: pybacked.manifest.ManifestEntry
+    :param kind: The kind of the new archive, None for incremental archives
+    :type kind: str
+    :return: The path to the temporary file and the manifest entry of the
+        new archive
+    :rtype: tuple
+    """
+    temp_descriptor, temp_path = tempfile.mkstemp(
+        dir=config.archive, prefix=".retention-", suffix=".tmp")
+    os.close(temp_descriptor)
+    try:
+        pybacked.consolidate.write_archive(
+            temp_path, changes, entry.timestamp, config.compression_algorithm,
+            config.compresslevel, kind)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    new_entry = pybacked.manifest.create_entry(temp_path, entry.sequence)
+    new_entry.filename = entry.filename
+    return temp_path, new_entry
+
+
+def get_bucket(timestamp, period):
+    """
+    Get the calendar period (in UTC) a timestamp falls into.
+
+    :param timestamp: The timestamp
+    :type timestamp: float
+    :param period: One of PERIODS
+    :type period: str
+    :return: A key which is equal for all timestamps of the same period
+    :rtype: tuple
+    """
+    date = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+    if period == "hour":
+        return (date.year, date.month, date.day, date.hour)
+    elif period == "day":
+        return (date.year, date.month, date.day)
+    elif period == "week":
+        return tuple(date.isocalendar()[:2])
+    elif period == "month":
+        return (date.year, date.month)
+    elif period == "year":
+        return (date.year,)
+    raise ValueError("Unknown retention period: " + repr(period))
+
+
+def get_carried_size(changes, pruned):
+    """
+    Get the compressed size of the data of pruned archives which is still
+    needed after folding them into their successor.
+
+    :param changes: The folded changes
+    :type changes: dict
+    :param pruned: The paths to the pruned archives
+    :type pruned: list
+    :return: The size in bytes
+    :rtype: int
+    """
+    sizes = dict()
+    for archivepath in pruned:
+        archive = zipfile.ZipFile(archivepath, mode='r')
+        for info in archive.infolist():
+            sizes[(archivepath, info.filename)] = info.compress_size
+        archive.close()
+    carried = 0
+    for filename, change in changes.items():
+        for part in change.parts:
+            carried += sizes.get((part, "data/" + filename), 0)
+    return carried
+
+
+def get_groups(entries, kept):
+    """
+    Group the pruned archives with the kept archive they are folded into.
+    Incremental archives are folded into the next kept incremental archive,
+    starting at the newest full archive of the run. Reverse deltas are folded
+    into the previous kept reverse delta. Pruned archives, which no kept
+    archive depends on, aren't part of any group.
+
+    :param entries: The manifest entries ordered by sequence
+    :type entries: list
+    :param kept: The filenames of the kept archives
+    :type kept: set
+    :return: The groups of entries in the order they are folded, each ending
+        with the kept archive
+    :rtype: list
+    """
+    groups = []
+    run = []
+    for entry in entries:
+        if entry.kind == pybacked.ARCHIVE_REVERSE:
+            # reverse deltas aren't replayed onto older archives
+            run = []
+        elif entry.filename not in kept:
+            run.append(entry)
+        else:
+            if run and entry.kind == pybacked.ARCHIVE_INCREMENTAL:
+                start = 0
+                for position, pruned in enumerate(run):
+                    if pruned.kind == pybacked.ARCHIVE_FULL:
+                        start = position
+                groups.append(run[start:] + [entry])
+            run = []
+    run = []
+    for entry in reversed(entries):
+        if entry.kind != pybacked.ARCHIVE_REVERSE:
+            run = []
+        elif entry.filename not in kept:
+            run.append(entry)
+        else:
+            if run:
+                groups.append(run + [entry])
+            run = []
+    return groups
+
+
+def select_archives(entries, rules, now):
+    """
+    Select the archives kept by the retention rules. For every rule the
+    newest archive of each period within the window of the rule is kept. The
+    newest archive, archives without a timestamp and full archives, from
+    which reverse deltas step back, are always kept.
+
+    :param entries: The manifest entries ordered by sequence
+    :type entries: list
+    :param rules: A dictionary mapping a period to the number of seconds for
+        which archives of that period are kept, or None to keep them forever
+    :type rules: dict
+    :param now: The timestamp the windows end at
+    :type now: float
+    :return: The filenames of the kept archives
+    :rtype: set
+    """
+    kept = set()
+    if entries:
+        kept.add(entries[-1].filename)
+    for entry in entries:
+        if entry.timestamp is None:
+            kept.add(entry.filename)
+    for previous, entry in zip(entries, entries[1:]):
+        if previous.kind == pybacked.ARCHIVE_REVERSE and \
+                entry.kind == pybacked.ARCHIVE_FULL:
+            kept.add(entry.filename)
+    for period, window in rules.items():
+        seen = set()
+        for entry in reversed(entries):
+            if entry.timestamp is None:
+                continue
+            if window is not None and entry.timestamp < now - window:
+                continue
+            bucket = get_bucket(entry.timestamp, period)
+            if bucket not in seen:
+                seen.add(bucket)
+                kept.add(entry.filename)
+    return kept
@@ -0,0 +1,216 @@
+import os
+import pybacked
+import pybacked.diff
+import pybacked.logging
+import pybacked.manifest
+import pybacked.zip_handler
+import tempfile
+import zipfile
+
+
+def complete_full(archivepath, basepath, base_log, changes, storage,
+                  compression, compresslevel):
+    """
+    Complete a new full archive, which already holds the changed files, with
+    the unchanged files of the previous full archive and write its diff-log.
+    The unchanged members are copied without recompressing them. Files of
+    the previous full archive, which no longer exist in the storage
+    directory, are left out.
+
+    :param archivepath: The path to the new full archive
+    :type archivepath: str
+    :param basepath: The path to the previous full archive
+    :type basepath: str
+    :param base_log: The diff-log of the previous full archive as returned by
+        get_log()
+    :type base_log: dict
+    :param changes: A dictionary of filename, Diff key-value pairs of the
+        files changed since the previous full archive
+    :type changes: dict
+    :param storage: The storage directory
+    :type storage: str
+    :param compression: The compression of the diff-log
+    :type compression: int
+    :param compresslevel: The compression level of the diff-log
+    :type compresslevel: int
+    :return: The filenames of the files of the previous full archive, which
+        were removed, and the number of members of the new full archive
+    :rtype: tuple
+    """
+    removed = []
+    rows = []
+    base = zipfile.ZipFile(basepath, mode='r')
+    archive = zipfile.ZipFile(archivepath, mode='a', compression=compression,
+                              compresslevel=compresslevel)
+    try:
+        for filename, diff in base_log.items():
+            if filename in changes:
+                continue
+            if not os.path.isfile(os.path.abspath(storage + "/" + filename)):
+                removed.append(filename)
+                continue
+            info = base.getinfo("data/" + filename)
+            pybacked.zip_handler.copy_member_raw(basepath, info, archive)
+            rows.append([filename, '+', diff.state])
+        for filename, diff in changes.items():
+            rows.append([filename, '+', diff.state])
+        archive.writestr("diff-log.csv",
+                         pybacked.logging.create_log_rows(rows))
+    finally:
+        archive.close()
+        base.close()
+    return removed, len(rows)
+
+
+def commit(archive_dir, reverse_entry, reverse_path, full_entry):
+    """
+    Record a reverse-incremental backup in the manifest and replace the
+    previous full archive with its reverse delta. Both are committed through
+    the journal of the manifest, so a backup killed in between is completed
+    by the next run (see manifest.recover()).
+
+    :param archive_dir: The directory in which the archives are stored
+    :type archive_dir: str
+    :param reverse_entry: The manifest entry of the reverse delta, which
+        keeps the filename and sequence of the previous full archive
+    :type reverse_entry: pybacked.manifest.ManifestEntry
+    :param reverse_path: The path to the temporary file holding the reverse
+        delta
+    :type reverse_path: str
+    :param full_entry: The manifest entry of the new full archive
+    :type full_entry: pybacked.manifest.ManifestEntry
+    :return: void
+    :rtype: None
+    """
+    entries = pybacked.manifest.read_manifest(archive_dir)
+    entries = [entry for entry in entries
+               if entry.sequence != reverse_entry.sequence]
+    entries.append(reverse_entry)
+    entries.append(full_entry)
+    pybacked.manifest.commit_changes(
+        archive_dir, entries,
+        {os.path.basename(reverse_path): reverse_entry.filename})
+
+
+def get_base(archive_dir):
+    """
+    Return the manifest entry of the newest archive if it is a full archive,
+    from which a reverse-incremental backup continues.
+
+    :param archive_dir: The directory in which the archives are stored
+    :type archive_dir: str
+    :return: The entry, or None if the newest archive isn't a full archive
+    :rtype: pybacked.manifest.ManifestEntry
+    """
+    entry = pybacked.manifest.read_last_entry(archive_dir)
+    if entry is None or entry.kind != pybacked.ARCHIVE_FULL:
+        return None
+    return entry
+
+
+def get_changes(diffcache, subdir=""):
+    """
+    Flatten a DiffCache into the changes of the archive relative filenames.
+
+    :param diffcache: The DiffCache returned by diff.collect()
+    :type diffcache: DiffCache
+    :param subdir: A subdirectory prefix, mainly used for recursion
+    :type subdir: str, optional
+    :return: A dictionary of filename, Diff key-value pairs
+    :rtype: dict
+    """
+    changes = dict()
+    for element in diffcache:
+        path = subdir + os.path.basename(element[0])
+        if element[2]:
+            changes.update(get_changes(element[1], subdir=path + "/"))
+        else:
+            changes[path] = element[1]
+    return changes
+
+
+def get_log(archivepath):
+    """
+    Read the diff-log of an archive.
+
+    :param archivepath: The path to the archive
+    :type archivepath: str
+    :return: A dictionary of filename, Diff key-value pairs
+    :rtype: dict
+    """
+    log = dict()
+    for filename, diff, dirflag in pybacked.diff.diff_log_deserialize(
+            archivepath):
+        log[filename] = diff
+    return log
+
+
+def write_reverse_delta(basepath, base_log, timestamp, changes, removed,
+                        compression, compresslevel):
+    """
+    Write the reverse delta, which restores the state of the previous full
+    archive from the state of the new full archive, to a temporary file next
+    to the previous full archive. Changed and removed files are copied from
+    the previous full archive without recompressing them, files added since
+    are removed.
+
+    :param basepath: The path to the previous full archive
+    :type basepath: str
+    :param base_log: The diff-log of the previous full archive as returned by
+        get_log()
+    :type base_log: dict
+    :param timestamp: The timestamp of the previous full archive
+    :type timestamp: float
+    :param changes: A dictionary of filename, Diff key-value pairs of the
+        files changed since the previous full archive
+    :type changes: dict
+    :param removed: The filenames of the files removed since the previous
+        full archive
+    :type removed: list
+    :param compression: The compression of the diff-log and metadata
+    :type compression: int
+    :param compresslevel: The compression level
+    :type compresslevel: int
+    :return: The path to the temporary file and the number of members
+    :rtype: tuple
+    """
+    descriptor, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(basepath), prefix=".reverse-", suffix=".tmp")
+    os.close(descriptor)
+    base = zipfile.ZipFile(basepath, mode='r')
+    members = 0
+    try:
+        archive = zipfile.ZipFile(temp_path, mode='w',
+                                  compression=compression,
+                                  compresslevel=compresslevel)
+        try:
+            rows = []
+            for filename in changes:
+                if filename in base_log:
+                    info = base.getinfo("data/" + filename)
+                    pybacked.zip_handler.copy_member_raw(basepath, info,
+                                                         archive)
+                    rows.append([filename, '*', base_log[filename].state])
+                    members += 1
+                else:
+                    rows.append([filename, '-', None])
+            for filename in removed:
+                info = base.getinfo("data/" + filename)
+                pybacked.zip_handler.copy_member_raw(basepath, info, archive)
+                rows.append([filename, '+', base_log[filename].state])
+                members += 1
+            archive.writestr("diff-log.csv",
+                             pybacked.logging.create_log_rows(rows))
+            metadata = pybacked.logging.MetadataContainer(
+                timestamp=timestamp, kind=pybacked.ARCHIVE_REVERSE)
+            archive.writestr(
+                "metadata.json",
+                pybacked.logging.create_metadata_string(metadata))
+        finally:
+            archive.close()
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    finally:
+        base.close()
+    return temp_path, members
@@ -0,0 +1,199 @@
+import concurrent.futures
+import os
+import pybacked.backup
+import pybacked.config
+import time
+
+
+class JobResult:
+    """
+    The outcome of the backup of a single configuration.
+
+    :param config: The configuration that was backed up
+    :type config: Configuration
+    :param seconds: The wall time of the backup in seconds
+    :type seconds: float
+    :param stats: The Stats of the backup, None if the backup failed
+    :type stats: pybacked.instrumentation.Stats, optional
+    :param error: The exception raised by the backup, None if it succeeded
+    :type error: Exception, optional
+    """
+    def __init__(self, config, seconds, stats=None, error=None):
+        self.config = config
+        self.seconds = seconds
+        self.stats = stats
+        self.error = error
+
+
+class Scheduler:
+    """
+    Runs the backups of many configurations concurrently. Configurations
+    which share a block device with their storage or archive directory are
+    put in the same group and backed up one after another, so that two jobs
+    never compete for the same disk. The groups run in parallel, so the
+    compression of one group uses CPU time that would otherwise be left idle
+    while another group waits for its disk.
+
+    :param configs: The configurations to back up
+    :type configs: list
+    :param max_workers: The maximum number of groups running at the same
+        time. If this is None, all groups run at the same time.
+    :type max_workers: int, optional
+    """
+    def __init__(self, configs, max_workers=None):
+        self.configs = configs
+        self.max_workers = max_workers
+
+    def groups(self):
+        """
+        Group the configurations by the block devices they use.
+
+        :return: A list of lists of configurations
+        :rtype: list
+        """
+        return group_by_device(self.configs)
+
+    def run(self):
+        """
+        Back up all configurations. A failed backup doesn't stop the other
+        backups, its exception is kept in the JobResult instead.
+
+        :return: The JobResults in the order of the configurations and the
+            total wall time in seconds
+        :rtype: tuple
+        """
+        groups = self.groups()
+        start = time.perf_counter()
+        results = dict()
+        max_workers = self.max_workers
+        if max_workers is None:
+            max_workers = max(len(groups), 1)
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            futures = [executor.submit(run_group, group) for group in groups]
+            for future in futures:
+                for result in future.result():
+                    results[id(result.config)] = result
+        total = time.perf_counter() - start
+        return [results[id(config)] for config in self.configs], total
+
+
+def get_device(path):
+    """
+    Return the id of the device a path is located on. If the path doesn't
+    exist yet, the device of its closest existing parent is returned.
+
+    :param path: The path
+    :type path: str
+    :return: The device id
+    :rtype: int
+    """
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return os.stat(path).st_dev
+
+
+def group_by_device(configs):
+    """
+    Split configurations into groups, so that no two groups use the same
+    block device. Configurations are connected through both the device of
+    their storage and the device of their archive directory.
+
+    :param configs: The configurations
+    :type configs: list
+    :return: A list of lists of configurations, in the order of their first
+        configuration
+    :rtype: list
+    """
+    # union-find over the devices
+    parents = dict()
+
+    def find(device):
+        while parents[device] != device:
+            parents[device] = parents[parents[device]]
+            device = parents[device]
+        return device
+
+    config_devices = []
+    for config in configs:
+        devices = (get_device(config.storage), get_device(config.archive))
+        for device in devices:
+            parents.setdefault(device, device)
+        parents[find(devices[0])] = find(devices[1])
+        config_devices.append(devices[0])
+
+    groups = dict()
+    for config, device in zip(configs, config_devices):
+        groups.setdefault(find(device), []).append(config)
+    return list(groups.values())
+
+
+def run_group(configs):
+    """
+    Back up a group of configurations one after another.
+
+    :param configs: The configurations
+    :type configs: list
+    :return: A JobResult for each configuration
+    :rtype: list
+    """
+    results = []
+    for config in configs:
+        start = time.perf_counter()
+        try:
+            stats = pybacked.backup.backup(config)
+        except Exception as error:
+            results.append(JobResult(config, time.perf_counter() - start,
+                                     error=error))
+        else:
+            results.append(JobResult(config, time.perf_counter() - start,
+                                     stats))
+    return results
+
+
+def run_config_file(filepath, max_workers=None):
+    """
+    Back up all configurations of a config file.
+
+    :param filepath: The path to the config file
+    :type filepath: str
+    :param max_workers: The maximum number of device groups running at the
+        same time
+    :type max_workers: int, optional
+    :return: The JobResults and the total wall time in seconds
+    :rtype: tuple
+    """
+    file = open(filepath, 'r')
+    configs = pybacked.config.deserialize_config(file.read())
+    file.close()
+    return Scheduler(configs, max_workers).run()
+
+
+def format_summary(results, total):
+    """
+    Format a runtime summary of a scheduler run.
+
+    :param results: The JobResults of the run
+    :type results: list
+    :param total: The total wall time of the run in seconds
+    :type total: float
+    :return: A table with one line per configuration and the total
+    :rtype: str
+    """
+    width = max([len(result.config.name) for result in results] + [5])
+    lines = []
+    busy = 0.0
+    for result in results:
+        if result.error is None:
+            status = "ok"
+        else:
+            status = "failed: " + repr(result.error)
+        busy += result.seconds
+        lines.append("{0:<{1}}  {2:10.3f}s  {3}".format(
+            result.config.name, width, result.seconds, status))
+    lines.append("{0:<{1}}  {2:10.3f}s  ({3:.3f}s of backups)".format(
+        "total", width, total, busy))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,455 @@
+import datetime
+import io
+import os
+import pybacked.consolidate
+import pybacked.diff
+import pybacked.instrumentation
+import pybacked.restore
+import posixpath
+import zipfile
+
+CHANGE_ADDED = "added"
+CHANGE_REMOVED = "removed"
+CHANGE_MODIFIED = "modified"
+
+
+class SnapshotChange:
+    """
+    A difference of a file between two snapshots.
+
+    :param path: The archive relative path of the file
+    :type path: str
+    :param change: One of CHANGE_ADDED, CHANGE_REMOVED or CHANGE_MODIFIED
+    :type change: str
+    """
+    def __init__(self, path, change):
+        self.path = path
+        self.change = change
+
+    def __eq__(self, other):
+        return self.path == other.path and self.change == other.change
+
+    def __repr__(self):
+        return "SnapshotChange(" + repr(self.path) + ", " + \
+            repr(self.change) + ")"
+
+
+class SnapshotStat:
+    """
+    The status of a file or directory of a snapshot.
+
+    :param path: The archive relative path
+    :type path: str
+    :param is_dir: True for directories
+    :type is_dir: bool
+    :param size: The size of the file in bytes, 0 for directories
+    :type size: int
+    :param mtime: The modification time stored in the archive member, None
+        for directories
+    :type mtime: float
+    :param archives: The archives holding the data of the file, oldest first
+    :type archives: list
+    """
+    def __init__(self, path, is_dir, size=0, mtime=None, archives=None):
+        self.path = path
+        self.is_dir = is_dir
+        self.size = size
+        self.mtime = mtime
+        if archives is None:
+            archives = []
+        self.archives = archives
+
+
+class ConcatenatedReader(io.RawIOBase):
+    """
+    A read-only stream over the members of an append chain, which reads the
+    members one after another.
+
+    :param members: The opened members, in the order of their data
+    :type members: list
+    """
+    def __init__(self, members):
+        super().__init__()
+        self.members = members
+        self.current = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self.current < len(self.members):
+            data = self.members[self.current].read(len(buffer))
+            if data:
+                buffer[:len(data)] = data
+                return len(data)
+            self.current += 1
+        return 0
+
+    def close(self):
+        for member in self.members:
+            member.close()
+        super().close()
+
+
+class Snapshot:
+    """
+    A read-only view of the state of the storage directory at the creation
+    of an archive. Nothing is extracted to disk: the paths are resolved
+    lazily through the diff-logs of the archives, which are replayed to
+    restore the state, and files are streamed from the archive members.
+    The read diff-logs, resolved paths and opened archives are cached by the
+    snapshot until it is closed.
+
+    Paths are archive relative, using "/" as separator. The root directory is
+    "" (or "/" or ".").
+
+    :param config: The configuration of the archive directory
+    :type config: Configuration
+    :param archname: The name of the archive (default is the newest archive)
+    :type archname: str, optional
+    :param index: An index of the archive directory, from which the
+        diff-logs are taken instead of reading them from the archives
+    :type index: pybacked.index.ArchiveIndex, optional
+    :raises FileNotFoundError: If no archive name is given and the archive
+        directory has no archives
+    """
+    def __init__(self, config, archname=None, index=None):
+        if archname is None:
+            if index is not None:
+                newest = index.archives[-1:]
+            else:
+                newest = pybacked.restore.get_archive_list(
+                    config.archive)[:1]
+            if not newest:
+                raise FileNotFoundError("No archive in " + config.archive)
+            self.archive = newest[0]
+        else:
+            self.archive = os.path.abspath(config.archive + "/" + archname)
+        self.index = index
+        self.chain = pybacked.restore.get_replay_list(self.archive, index)
+        self.logs = dict()
+        self.resolved = dict()
+        self.zipfiles = dict()
+        self.files = None
+        self.directories = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Close the archives opened by the snapshot.
+
+        :return: void
+        :rtype: None
+        """
+        for archive in self.zipfiles.values():
+            archive.close()
+        self.zipfiles = dict()
+
+    def exists(self, path):
+        """
+        Check whether a file or directory exists in the snapshot.
+
+        :param path: The archive relative path
+        :type path: str
+        :return: True if the path exists
+        :rtype: bool
+        """
+        path = normalize_path(path)
+        return self.resolve(path) is not None or self.is_dir(path)
+
+    def is_dir(self, path):
+        """
+        Check whether a path is a directory of the snapshot.
+
+        :param path: The archive relative path
+        :type path: str
+        :return: True if the path is a directory
+        :rtype: bool
+        """
+        self.load_tree()
+        return normalize_path(path) in self.directories
+
+    def listdir(self, path=""):
+        """
+        List the entries of a directory of the snapshot.
+
+        :param path: The archive relative path of the directory
+        :type path: str, optional
+        :return: The sorted names of the files and subdirectories
+        :rtype: list
+        """
+        path = normalize_path(path)
+        self.load_tree()
+        if path not in self.directories:
+            if path in self.files:
+                raise NotADirectoryError(path)
+            raise FileNotFoundError(path)
+        return sorted(self.directories[path])
+
+    def load_tree(self):
+        """
+        Build the directory tree of the snapshot by replaying the diff-logs.
+        This reads the diff-logs of all replayed archives once.
+
+        :return: void
+        :rtype: None
+        """
+        if self.files is not None:
+            return
+        files = set()
+        for archivepath in self.chain:
+            for filename, modtype in self.get_log(archivepath).items():
+                if modtype == '-':
+                    files.discard(filename)
+                else:
+                    files.add(filename)
+        directories = {"": set()}
+        for filename in files:
+            parent, name = posixpath.split(filename)
+            directories.setdefault(parent, set()).add(name)
+            while parent:
+                parent, name = posixpath.split(parent)
+                directories.setdefault(parent, set()).add(name)
+        self.files = files
+        self.directories = directories
+
+    def get_log(self, archivepath):
+        """
+        Return the diff-log of a replayed archive.
+
+        :param archivepath: The path to the archive
+        :type archivepath: str
+        :return: A dictionary of filename, modtype key-value pairs
+        :rtype: dict
+        """
+        log = self.logs.get(archivepath)
+        if log is None:
+            if self.index is not None:
+                diffcache = self.index.get_diffcache(archivepath)
+            else:
+                diffcache = pybacked.diff.diff_log_deserialize(archivepath)
+            log = dict()
+            for filename, diff, dirflag in diffcache:
+                log[filename] = diff.difftype
+            self.logs[archivepath] = log
+        return log
+
+    def get_zipfile(self, archivepath):
+        """
+        Return the opened archive, opening it on first use.
+
+        :param archivepath: The path to the archive
+        :type archivepath: str
+        :return: The archive
+        :rtype: zipfile.ZipFile
+        """
+        archive = self.zipfiles.get(archivepath)
+        if archive is None:
+            archive = zipfile.ZipFile(archivepath, mode='r')
+            pybacked.instrumentation.count("archives_opened")
+            self.zipfiles[archivepath] = archive
+        return archive
+
+    def open(self, path, mode='rb', encoding=None):
+        """
+        Open a file of the snapshot for reading. The content is streamed from
+        the archive members.
+
+        :param path: The archive relative path of the file
+        :type path: str
+        :param mode: 'rb' for a binary or 'r' for a text stream (default is
+            'rb')
+        :type mode: str, optional
+        :param encoding: The encoding of a text stream
+        :type encoding: str, optional
+        :return: The file object
+        :rtype: io.IOBase
+        """
+        if mode not in ('r', 'rb'):
+            raise ValueError("Snapshots are read-only, invalid mode: " +
+                             repr(mode))
+        path = normalize_path(path)
+        parts = self.resolve(path)
+        if parts is None:
+            if self.is_dir(path):
+                raise IsADirectoryError(path)
+            raise FileNotFoundError(path)
+        members = [self.get_zipfile(part).open("data/" + path, mode='r')
+                   for part in parts]
+        if len(members) == 1:
+            file = members[0]
+        else:
+            file = io.BufferedReader(ConcatenatedReader(members))
+        if mode == 'r':
+            return io.TextIOWrapper(file, encoding=encoding)
+        return file
+
+    def resolve(self, path):
+        """
+        Find the archives holding the data of a file. The replayed archives
+        are searched from the newest one, so only the diff-logs up to the
+        newest entry of the file are read.
+
+        :param path: The normalized archive relative path of the file
+        :type path: str
+        :return: The paths to the archives, oldest first, or None if the file
+            doesn't exist in the snapshot
+        :rtype: list
+        """
+        if path in self.resolved:
+            return self.resolved[path]
+        parts = []
+        for archivepath in reversed(self.chain):
+            modtype = self.get_log(archivepath).get(path)
+            if modtype is None:
+                continue
+            elif modtype == '-':
+                break
+            parts.insert(0, archivepath)
+            if modtype != 'a':
+                break
+        if not parts:
+            parts = None
+        self.resolved[path] = parts
+        return parts
+
+    def stat(self, path):
+        """
+        Get the status of a file or directory of the snapshot.
+
+        :param path: The archive relative path
+        :type path: str
+        :return: The status
+        :rtype: SnapshotStat
+        """
+        path = normalize_path(path)
+        parts = self.resolve(path)
+        if parts is None:
+            if self.is_dir(path):
+                return SnapshotStat(path, True)
+            raise FileNotFoundError(path)
+        size = 0
+        for part in parts:
+            info = self.get_zipfile(part).getinfo("data/" + path)
+            size += info.file_size
+        mtime = datetime.datetime(*info.date_time).timestamp()
+        return SnapshotStat(path, False, size, mtime, parts)
+
+    def walk(self, top=""):
+        """
+        Walk the directory tree of the snapshot top-down, like os.walk().
+
+        :param top: The archive relative path of the directory to start at
+        :type top: str, optional
+        :return: A generator of (dirpath, dirnames, filenames) tuples
+        :rtype: generator
+        """
+        top = normalize_path(top)
+        dirnames = []
+        filenames = []
+        for name in self.listdir(top):
+            if posixpath.join(top, name) in self.directories:
+                dirnames.append(name)
+            else:
+                filenames.append(name)
+        yield top, dirnames, filenames
+        for name in dirnames:
+            for entry in self.walk(posixpath.join(top, name)):
+                yield entry
+
+
+def normalize_path(path):
+    """
+    Normalize an archive relative path of a snapshot.
+
+    :param path: The path
+    :type path: str
+    :return: The path without leading or trailing separators, "" for the
+        root directory
+    :rtype: str
+    """
+    path = posixpath.normpath(path.replace("\\", "/")).strip("/")
+    if path == ".":
+        return ""
+    return path
+
+
+def compare(config, old, new, index=None):
+    """
+    Compute the files added, removed and modified from the state of one
+    archive to the state of another. If one of the states is replayed on the
+    way to the other, only the diff-logs of the archives in between are
+    merged, so the cost grows with the number of changes. States of
+    different restore chains (separated by a full archive) are compared
+    file by file. No data is extracted.
+
+    :param config: The configuration of the archive directory
+    :type config: Configuration
+    :param old: The name of the archive of the old state
+    :type old: str
+    :param new: The name of the archive of the new state
+    :type new: str
+    :param index: An index of the archive directory, from which the
+        diff-logs are taken instead of reading them from the archives
+    :type index: pybacked.index.ArchiveIndex, optional
+    :return: A generator of SnapshotChange objects, ordered by path
+    :rtype: generator
+    """
+    old_chain = pybacked.restore.get_replay_list(
+        os.path.abspath(config.archive + "/" + old), index)
+    new_chain = pybacked.restore.get_replay_list(
+        os.path.abspath(config.archive + "/" + new), index)
+    if new_chain[:len(old_chain)] == old_chain:
+        changes = pybacked.consolidate.fold_archives(
+            new_chain[len(old_chain):], index)
+        inverted = False
+    elif old_chain[:len(new_chain)] == new_chain:
+        # the old state is replayed from the new one (reverse deltas)
+        changes = pybacked.consolidate.fold_archives(
+            old_chain[len(new_chain):], index)
+        inverted = True
+    else:
+        for change in compare_states(
+                pybacked.consolidate.fold_archives(old_chain, index),
+                pybacked.consolidate.fold_archives(new_chain, index)):
+            yield change
+        return
+    for path in sorted(changes):
+        modtype = changes[path].modtype
+        if modtype == '+':
+            change = CHANGE_REMOVED if inverted else CHANGE_ADDED
+        elif modtype == '-':
+            change = CHANGE_ADDED if inverted else CHANGE_REMOVED
+        else:
+            change = CHANGE_MODIFIED
+        yield SnapshotChange(path, change)
+
+
+def compare_states(old_state, new_state):
+    """
+    Compare two complete states file by file.
+
+    :param old_state: The folded changes of the old state as returned by
+        consolidate.fold_archives()
+    :type old_state: dict
+    :param new_state: The folded changes of the new state
+    :type new_state: dict
+    :return: A generator of SnapshotChange objects, ordered by path
+    :rtype: generator
+    """
+    old_files = dict((path, change.diff) for path, change in
+                     old_state.items() if change.modtype != '-')
+    new_files = dict((path, change.diff) for path, change in
+                     new_state.items() if change.modtype != '-')
+    for path in sorted(set(old_files) | set(new_files)):
+        if path not in old_files:
+            yield SnapshotChange(path, CHANGE_ADDED)
+        elif path not in new_files:
+            yield SnapshotChange(path, CHANGE_REMOVED)
+        elif old_files[path] != new_files[path]:
+            yield SnapshotChange(path, CHANGE_MODIFIED)
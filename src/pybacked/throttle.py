@@ -0,0 +1,441 @@
+import contextlib
+import json
+import os
+import pybacked.instrumentation
+import signal
+import threading
+import time
+
+# seconds between two checks of the control file for changes
+CONTROL_POLL_INTERVAL = 1.0
+
+_local = threading.local()
+# increased by the reload signal, throttles reload when it changed
+_generation = 0
+
+
+class TokenBucket:
+    """
+    A token bucket limiting the rate of a resource. Consuming more tokens
+    than available puts the bucket into debt, which is paid off by sleeping,
+    so large requests are limited correctly on average.
+
+    :param rate: The number of tokens added per second
+    :type rate: float
+    :param burst: The maximum number of tokens the bucket holds (default is
+        one second worth of tokens)
+    :type burst: float, optional
+    """
+    def __init__(self, rate, burst=None):
+        self.tokens = 0.0
+        self.set_rate(rate, burst)
+        self.tokens = self.burst
+        self.last = time.monotonic()
+
+    def set_rate(self, rate, burst=None):
+        """
+        Change the rate of the bucket.
+
+        :param rate: The number of tokens added per second
+        :type rate: float
+        :param burst: The maximum number of tokens the bucket holds
+        :type burst: float, optional
+        :return: void
+        :rtype: None
+        """
+        self.rate = rate
+        if burst is None:
+            self.burst = rate
+        else:
+            self.burst = burst
+        self.tokens = min(self.tokens, self.burst)
+
+    def consume(self, amount):
+        """
+        Take tokens from the bucket and sleep until the bucket is out of debt.
+
+        :param amount: The number of tokens
+        :type amount: float
+        :return: The number of seconds slept
+        :rtype: float
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return 0.0
+        delay = -self.tokens / self.rate
+        time.sleep(delay)
+        return delay
+
+
+class DutyCycle:
+    """
+    Limits the CPU time used by the current thread to a fraction of the wall
+    time. The CPU time is checked at most once per period.
+
+    :param limit: The fraction of the wall time the thread may use the CPU,
+        between 0 and 1
+    :type limit: float
+    :param period: The length of a measurement period in seconds (default is
+        0.1)
+    :type period: float, optional
+    """
+    def __init__(self, limit, period=0.1):
+        self.limit = limit
+        self.period = period
+        self.reset()
+
+    def reset(self):
+        """
+        Start a new measurement period.
+
+        :return: void
+        :rtype: None
+        """
+        self.wall = time.monotonic()
+        self.cpu = time.thread_time()
+
+    def check(self):
+        """
+        Sleep if the thread used more CPU time than allowed in the current
+        period.
+
+        :return: The number of seconds slept
+        :rtype: float
+        """
+        wall = time.monotonic() - self.wall
+        if wall < self.period:
+            return 0.0
+        cpu = time.thread_time() - self.cpu
+        delay = cpu / self.limit - wall
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            delay = 0.0
+        self.reset()
+        return delay
+
+
+class Throttle:
+    """
+    Enforces the read and write bandwidth and CPU limits of a backup or
+    restore run. A Throttle is activated for a thread with activate(), the
+    read loops then report their work through read(), write() and cpu().
+    The time spent sleeping is kept in seconds and recorded as the "throttle"
+    phase of the active Stats object.
+
+    :param read_limit: The maximum read bandwidth in bytes per second
+    :type read_limit: int, optional
+    :param write_limit: The maximum write bandwidth in bytes per second
+    :type write_limit: int, optional
+    :param cpu_limit: The maximum fraction of a CPU core
+    :type cpu_limit: float, optional
+    :param control_file: A json file with read_limit, write_limit and
+        cpu_limit keys, which override the given limits. Keys which are
+        missing keep the given limit, null removes the limit.
+    :type control_file: str, optional
+    """
+    def __init__(self, read_limit=None, write_limit=None, cpu_limit=None,
+                 control_file=None):
+        self.defaults = {"read_limit": read_limit,
+                         "write_limit": write_limit,
+                         "cpu_limit": cpu_limit}
+        self.read_bucket = None
+        self.write_bucket = None
+        self.duty_cycle = None
+        self.seconds = 0.0
+        self.control_file = control_file
+        self.control_mtime = None
+        self.next_poll = 0.0
+        self.generation = _generation
+        self.set_limits(read_limit, write_limit, cpu_limit)
+
+    def set_limits(self, read_limit=None, write_limit=None, cpu_limit=None):
+        """
+        Change the limits of the throttle. A limit of None removes the limit.
+
+        :param read_limit: The maximum read bandwidth in bytes per second
+        :type read_limit: int, optional
+        :param write_limit: The maximum write bandwidth in bytes per second
+        :type write_limit: int, optional
+        :param cpu_limit: The maximum fraction of a CPU core
+        :type cpu_limit: float, optional
+        :return: void
+        :rtype: None
+        :raises ValueError: If a limit isn't a positive number
+        """
+        check_limit("read_limit", read_limit)
+        check_limit("write_limit", write_limit)
+        check_limit("cpu_limit", cpu_limit)
+        self.read_bucket = update_bucket(self.read_bucket, read_limit)
+        self.write_bucket = update_bucket(self.write_bucket, write_limit)
+        if cpu_limit is None:
+            self.duty_cycle = None
+        elif self.duty_cycle is None:
+            self.duty_cycle = DutyCycle(cpu_limit)
+        else:
+            self.duty_cycle.limit = cpu_limit
+
+    def load_control(self):
+        """
+        Read the limits from the control file. The current limits are kept if
+        the file doesn't exist or can't be parsed, as it may be in the middle
+        of being written, or if it holds a limit which isn't a positive
+        number.
+
+        :return: void
+        :rtype: None
+        """
+        try:
+            file = open(self.control_file, 'r')
+        except FileNotFoundError:
+            return
+        try:
+            content = json.loads(file.read())
+        except ValueError:
+            return
+        finally:
+            file.close()
+        limits = dict(self.defaults)
+        for key in limits:
+            if key in content:
+                limits[key] = content[key]
+        try:
+            self.set_limits(**limits)
+        except ValueError:
+            return
+
+    def poll(self):
+        """
+        Reload the control file if it changed or the reload signal was
+        received. The file is checked at most every CONTROL_POLL_INTERVAL
+        seconds.
+
+        :return: void
+        :rtype: None
+        """
+        if self.control_file is None:
+            return
+        now = time.monotonic()
+        if self.generation != _generation:
+            self.generation = _generation
+        elif now < self.next_poll:
+            return
+        else:
+            try:
+                mtime = os.stat(self.control_file).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime == self.control_mtime:
+                self.next_poll = now + CONTROL_POLL_INTERVAL
+                return
+            self.control_mtime = mtime
+        self.next_poll = now + CONTROL_POLL_INTERVAL
+        self.load_control()
+
+    def read(self, nbytes):
+        """
+        Account for read bytes and sleep if the read limit is exceeded.
+
+        :param nbytes: The number of read bytes
+        :type nbytes: int
+        :return: void
+        :rtype: None
+        """
+        self.poll()
+        if self.read_bucket is not None:
+            self.wait(self.read_bucket.consume(nbytes))
+
+    def write(self, nbytes):
+        """
+        Account for written bytes and sleep if the write limit is exceeded.
+
+        :param nbytes: The number of written bytes
+        :type nbytes: int
+        :return: void
+        :rtype: None
+        """
+        self.poll()
+        if self.write_bucket is not None:
+            self.wait(self.write_bucket.consume(nbytes))
+
+    def cpu(self):
+        """
+        Sleep if the CPU limit is exceeded.
+
+        :return: void
+        :rtype: None
+        """
+        if self.duty_cycle is not None:
+            self.wait(self.duty_cycle.check())
+
+    def wait(self, seconds):
+        """
+        Record the time slept by the throttle.
+
+        :param seconds: The number of seconds slept
+        :type seconds: float
+        :return: void
+        :rtype: None
+        """
+        if seconds > 0:
+            self.seconds += seconds
+            stats = pybacked.instrumentation.current()
+            if stats is not None:
+                stats.add_time("throttle", seconds)
+
+
+def check_limit(name, limit):
+    """
+    Check that a limit is None or a positive number.
+
+    :param name: The name of the limit used in the error message
+    :type name: str
+    :param limit: The limit
+    :type limit: float
+    :return: void
+    :rtype: None
+    :raises ValueError: If the limit isn't a positive number
+    """
+    if limit is None:
+        return
+    if isinstance(limit, bool) or not isinstance(limit, (int, float)) or \
+            not limit > 0:
+        raise ValueError("The " + name + " has to be a positive number, " +
+                         "not " + repr(limit))
+
+
+def update_bucket(bucket, rate):
+    """
+    Apply a new rate to a token bucket.
+
+    :param bucket: The current bucket or None
+    :type bucket: TokenBucket
+    :param rate: The new rate or None to remove the limit
+    :type rate: float
+    :return: The updated bucket or None
+    :rtype: TokenBucket
+    """
+    if rate is None:
+        return None
+    elif bucket is None:
+        return TokenBucket(rate)
+    bucket.set_rate(rate)
+    return bucket
+
+
+def from_config(config):
+    """
+    Create the Throttle for a configuration.
+
+    :param config: The configuration
+    :type config: Configuration
+    :return: The Throttle, or None if the configuration has neither limits
+        nor a control file
+    :rtype: Throttle
+    """
+    if config.read_limit is None and config.write_limit is None and \
+            config.cpu_limit is None and config.throttle_control is None:
+        return None
+    return Throttle(config.read_limit, config.write_limit, config.cpu_limit,
+                    config.throttle_control)
+
+
+@contextlib.contextmanager
+def activate(throttle):
+    """
+    Activate a Throttle for the current thread. If throttle is None, nothing
+    is throttled inside of the context.
+
+    :param throttle: The Throttle to activate
+    :type throttle: Throttle
+    """
+    previous = getattr(_local, "throttle", None)
+    _local.throttle = throttle
+    try:
+        yield throttle
+    finally:
+        _local.throttle = previous
+
+
+def cpu():
+    """
+    Enforce the CPU limit of the active Throttle. Does nothing if no Throttle
+    is active in the current thread.
+
+    :return: void
+    :rtype: None
+    """
+    throttle = getattr(_local, "throttle", None)
+    if throttle is not None:
+        throttle.cpu()
+
+
+def current():
+    """
+    Return the Throttle active in the current thread.
+
+    :return: The active Throttle or None
+    :rtype: Throttle
+    """
+    return getattr(_local, "throttle", None)
+
+
+def read(nbytes):
+    """
+    Enforce the read limit of the active Throttle. Does nothing if no
+    Throttle is active in the current thread.
+
+    :param nbytes: The number of read bytes
+    :type nbytes: int
+    :return: void
+    :rtype: None
+    """
+    throttle = getattr(_local, "throttle", None)
+    if throttle is not None:
+        throttle.read(nbytes)
+
+
+def write(nbytes):
+    """
+    Enforce the write limit of the active Throttle. Does nothing if no
+    Throttle is active in the current thread.
+
+    :param nbytes: The number of written bytes
+    :type nbytes: int
+    :return: void
+    :rtype: None
+    """
+    throttle = getattr(_local, "throttle", None)
+    if throttle is not None:
+        throttle.write(nbytes)
+
+
+def request_reload(signum=None, frame=None):
+    """
+    Make all throttles reload their control file. This is the handler
+    installed by install_signal_handler(), but can also be called directly.
+
+    :return: void
+    :rtype: None
+    """
+    global _generation
+    _generation += 1
+
+
+def install_signal_handler(signum=None):
+    """
+    Reload the control files of all throttles when the process receives a
+    signal. Has to be called from the main thread.
+
+    :param signum: The signal (default is SIGUSR1)
+    :type signum: int, optional
+    :return: void
+    :rtype: None
+    """
+    if signum is None:
+        signum = signal.SIGUSR1
+    signal.signal(signum, request_reload)
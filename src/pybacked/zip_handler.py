@@ -1,6 +1,12 @@
 import os
-import shutil
-import tempfile
+import pybacked
+import pybacked.cancellation
+import pybacked.fileio
+import pybacked.hooks
+import pybacked.instrumentation
+import pybacked.progress
+import pybacked.throttle
+import struct
 import zipfile
 
 
@@ -20,14 +26,173 @@ def archive_write(archivepath, data, filename, compression, compressionlevel):
     :type compressionlevel: int
     :return: void
     """
-    archive = zipfile.ZipFile(archivepath, mode='a',
-                              compression=compression,
-                              compresslevel=compressionlevel)
-    archive.writestr(filename, data)
+    with pybacked.instrumentation.phase("write"):
+        archive = zipfile.ZipFile(archivepath, mode='a',
+                                  compression=compression,
+                                  compresslevel=compressionlevel)
+        pybacked.instrumentation.count("archives_opened")
+        archive.writestr(filename, data)
+        pybacked.instrumentation.count("members_written")
+        pybacked.instrumentation.count("bytes_out",
+                                       archive.getinfo(filename).compress_size)
+        archive.close()
+
+
+@pybacked.hooks.hooked("append_archdata", path="destination",
+                       archive="archivepath")
+def append_archdata(archivepath, filename, destination, fadvise=False):
+    """
+    Extract a file from an archive and append its content to the destination.
+    This is used to restore files, of which only the appended tail was
+    archived.
+
+    :param archivepath: The path to the archive containing the file
+    :type archivepath: str
+    :param filename: The archive name of the desired file.
+    :type filename: str
+    :param destination: The path of the file the data is appended to.
+    :type destination: str
+    :param fadvise: Drop the destination from the page cache after writing
+    :type fadvise: bool, optional
+    :return: void
+    :rtype: None
+    """
+    if not os.path.isfile(destination):
+        raise FileNotFoundError("The file to append to does not exist")
+    archive = zipfile.ZipFile(archivepath, mode='r')
+    pybacked.instrumentation.count("archives_opened")
+    member = archive.open(filename, mode='r')
+    file = open(destination, 'ab')
+    copy_member(member, file)
+    if fadvise:
+        pybacked.fileio.advise_dontneed(file, sync=True)
+    file.close()
+    member.close()
     archive.close()
 
 
-def create_archive(archivepath, filedict, compression, compressionlevel):
+def copy_member(source, destination):
+    """
+    Copy the data of an opened archive member to an opened file in chunks of
+    COPY_CHUNK_SIZE, while enforcing the limits of the active throttle.
+
+    :param source: The archive member opened for reading
+    :type source: zipfile.ZipExtFile
+    :param destination: The file opened for writing
+    :type destination: file object
+    :return: void
+    :rtype: None
+    """
+    while True:
+        chunk = source.read(pybacked.COPY_CHUNK_SIZE)
+        if not chunk:
+            break
+        pybacked.throttle.read(len(chunk))
+        destination.write(chunk)
+        pybacked.throttle.write(len(chunk))
+        pybacked.throttle.cpu()
+
+
+def copy_member_raw(sourcepath, info, destination, arcname=None):
+    """
+    Copy a member of an archive to another opened archive without
+    decompressing and recompressing its data. The compressed data is copied
+    as is, together with the CRC and the sizes of the member.
+
+    :param sourcepath: The path to the archive holding the member
+    :type sourcepath: str
+    :param info: The ZipInfo of the member in the source archive
+    :type info: zipfile.ZipInfo
+    :param destination: The archive opened for writing
+    :type destination: zipfile.ZipFile
+    :param arcname: The name of the member in the destination archive
+        (default is the name in the source archive)
+    :type arcname: str, optional
+    :return: void
+    :rtype: None
+    """
+    if arcname is None:
+        arcname = info.filename
+    zinfo = zipfile.ZipInfo(arcname, info.date_time)
+    zinfo.compress_type = info.compress_type
+    zinfo.CRC = info.CRC
+    zinfo.compress_size = info.compress_size
+    zinfo.file_size = info.file_size
+    zinfo.external_attr = info.external_attr
+    zinfo.create_system = info.create_system
+    # the sizes are known up front, so no data descriptor follows the data
+    zinfo.flag_bits = info.flag_bits & ~0x08
+
+    source = open(sourcepath, 'rb')
+    try:
+        source.seek(info.header_offset)
+        header = struct.unpack(zipfile.structFileHeader,
+                               source.read(zipfile.sizeFileHeader))
+        # skip the filename and extra field of the local header
+        source.seek(header[zipfile._FH_FILENAME_LENGTH] +
+                    header[zipfile._FH_EXTRA_FIELD_LENGTH], 1)
+
+        # zipfile has no public interface to write precompressed data, so
+        # the member is added the same way ZipFile.write() adds its members
+        destination._writecheck(zinfo)
+        destination._didModify = True
+        zinfo.header_offset = destination.fp.tell()
+        destination.fp.write(zinfo.FileHeader())
+        remaining = info.compress_size
+        while remaining > 0:
+            chunk = source.read(min(remaining, pybacked.COPY_CHUNK_SIZE))
+            if not chunk:
+                raise zipfile.BadZipFile("Truncated member " + info.filename)
+            pybacked.throttle.read(len(chunk))
+            destination.fp.write(chunk)
+            pybacked.throttle.write(len(chunk))
+            remaining -= len(chunk)
+    finally:
+        source.close()
+    destination.filelist.append(zinfo)
+    destination.NameToInfo[zinfo.filename] = zinfo
+    destination.start_dir = destination.fp.tell()
+    pybacked.instrumentation.count("members_written")
+    pybacked.instrumentation.count("bytes_out", zinfo.compress_size)
+
+
+def write_member_chain(destination, arcname, parts):
+    """
+    Write the concatenated data of several archive members as a single member
+    to an opened archive. This is used to merge a file archived as a chain
+    of appended tails into one member, which requires recompressing it.
+
+    :param destination: The archive opened for writing
+    :type destination: zipfile.ZipFile
+    :param arcname: The name of the member in the destination archive
+    :type arcname: str
+    :param parts: List of archivepath, member name tuples in the order in
+        which their data is concatenated
+    :type parts: list
+    :return: void
+    :rtype: None
+    """
+    last_archive = zipfile.ZipFile(parts[-1][0], mode='r')
+    zinfo = zipfile.ZipInfo(arcname,
+                            last_archive.getinfo(parts[-1][1]).date_time)
+    last_archive.close()
+    zinfo.compress_type = destination.compression
+    zinfo._compresslevel = destination.compresslevel
+    member = destination.open(zinfo, mode='w')
+    for archivepath, filename in parts:
+        archive = zipfile.ZipFile(archivepath, mode='r')
+        pybacked.instrumentation.count("archives_opened")
+        source = archive.open(filename, mode='r')
+        copy_member(source, member)
+        source.close()
+        archive.close()
+    member.close()
+    pybacked.instrumentation.count("members_written")
+    pybacked.instrumentation.count("bytes_out", zinfo.compress_size)
+
+
+def create_archive(archivepath, filedict, compression, compressionlevel,
+                   offsets=None, fadvise=False):
     """
     Write filedict to zip-archive data subdirectory. Will check wether archive
     at archivepath exists before writing. If file exists will raise a
@@ -38,20 +203,37 @@ def create_archive(archivepath, filedict, compression, compressionlevel):
             pairs
     :param compression: desired compression methods (see zipfile documentation)
     :param compressionlevel: compression level (see zipfile documentation)
+    :param offsets: dictionary containing filepath, offset key-value pairs for
+            files of which only the data after offset is written to the
+            archive (appended files)
+    :param fadvise: advise sequential reads and drop each file from the page
+            cache after it was archived
     :return: void
     """
+    if offsets is None:
+        offsets = dict()
+
     if os.path.isfile(archivepath):
         raise FileExistsError("Specified file already exists")
     else:
         archive = zipfile.ZipFile(archivepath, mode='x',
                                   compression=compression,
                                   compresslevel=compressionlevel)
-        for filepath, filename in filedict.items():
-            archive.write(filepath, arcname="data/" + filename)
-    archive.close()
+        pybacked.instrumentation.count("archives_opened")
+        try:
+            for filepath, filename in filedict.items():
+                pybacked.cancellation.check()
+                write_member(archive, filepath, "data/" + filename,
+                             offsets.get(filepath, 0), fadvise)
+        finally:
+            # closing writes the central directory of the archive
+            with pybacked.instrumentation.phase("write"):
+                archive.close()
 
 
-def extract_archdata(archivepath, filename, destination):
+@pybacked.hooks.hooked("extract_archdata", path="destination",
+                       archive="archivepath")
+def extract_archdata(archivepath, filename, destination, fadvise=False):
     """
     Extract a file from a archive and write it to the destination. If the
     destination path already exists extract_archdata will not overwrite but
@@ -63,6 +245,8 @@ def extract_archdata(archivepath, filename, destination):
     :type filename: str
     :param destination: The path at which the extracted file is to be placed.
     :type destination: str
+    :param fadvise: Drop the destination from the page cache after writing
+    :type fadvise: bool, optional
     :return: void
     :rtype: None
     """
@@ -70,13 +254,21 @@ def extract_archdata(archivepath, filename, destination):
     if os.path.exists(destination):
         raise FileExistsError("The specified destination is already in use")
     archive = zipfile.ZipFile(archivepath, mode='r')
-    with tempfile.TemporaryDirectory() as tmpdir:
-        archive.extract(filename, path=tmpdir)
+    pybacked.instrumentation.count("archives_opened")
+    member = archive.open(filename, mode='r')
 
-        # create directories for the destination
-        os.makedirs(os.path.dirname(destination), exist_ok=True)
+    # create directories for the destination
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
 
-        shutil.copy(os.path.abspath(tmpdir + "/" + filename), destination)
+    file = open(destination, 'xb')
+    copy_member(member, file)
+    if pybacked.hooks.enabled:
+        pybacked.hooks.annotate(bytes=file.tell())
+    if fadvise:
+        pybacked.fileio.advise_dontneed(file, sync=True)
+    file.close()
+    member.close()
+    archive.close()
 
 
 def read_bin(archivepath, filelist):
@@ -92,6 +284,7 @@ def read_bin(archivepath, filelist):
     datadict = dict()
     if os.path.isfile(archivepath):
         archive = zipfile.ZipFile(archivepath, mode='r')
+        pybacked.instrumentation.count("archives_opened")
     else:
         raise FileNotFoundError("Specified file does not exist")
     for filename in filelist:
@@ -117,6 +310,7 @@ def read_diff_log(archivepath):
     :rtype: str
     """
     arch = zipfile.ZipFile(archivepath, mode='r')
+    pybacked.instrumentation.count("archives_opened")
     diff_log_file = arch.open("diff-log.csv")
     diff_log_bin = diff_log_file.read()
     diff_log = diff_log_bin.decode()
@@ -125,6 +319,65 @@ def read_diff_log(archivepath):
     return diff_log
 
 
+@pybacked.hooks.hooked("write_member", path="filepath")
+def write_member(archive, filepath, arcname, offset=0, fadvise=False):
+    """
+    Write the data of a file starting at offset to an opened archive. The
+    member is compressed with the compression settings of the archive.
+
+    :param archive: The zip-archive opened for writing
+    :type archive: zipfile.ZipFile
+    :param filepath: The path to the file
+    :type filepath: str
+    :param arcname: The name of the member in the archive
+    :type arcname: str
+    :param offset: The position in the file from which on data is written
+    :type offset: int, optional
+    :param fadvise: Advise sequential reads and drop the file from the page
+        cache after it was written to the archive
+    :type fadvise: bool, optional
+    :return: void
+    :rtype: None
+    """
+    zinfo = zipfile.ZipInfo.from_file(filepath, arcname=arcname)
+    zinfo.compress_type = archive.compression
+    zinfo._compresslevel = archive.compresslevel
+    file = open(filepath, 'rb')
+    if fadvise:
+        pybacked.fileio.advise_sequential(file)
+    file.seek(offset)
+    member = archive.open(zinfo, mode='w')
+    throttle = pybacked.throttle.current()
+    if throttle is not None:
+        position = archive.fp.tell()
+    while True:
+        with pybacked.instrumentation.phase("read"):
+            chunk = file.read(pybacked.COPY_CHUNK_SIZE)
+        if not chunk:
+            break
+        pybacked.instrumentation.count("bytes_in", len(chunk))
+        with pybacked.instrumentation.phase("compress"):
+            member.write(chunk)
+        if throttle is not None:
+            # the compressed data is written through to the archive file
+            written = archive.fp.tell()
+            throttle.read(len(chunk))
+            throttle.write(written - position)
+            throttle.cpu()
+            position = written
+    with pybacked.instrumentation.phase("compress"):
+        member.close()
+    pybacked.instrumentation.count("members_written")
+    pybacked.instrumentation.count("bytes_out", zinfo.compress_size)
+    if pybacked.hooks.enabled:
+        pybacked.hooks.annotate(archive=archive.filename,
+                                bytes=zinfo.file_size)
+    pybacked.progress.update(filepath, zinfo.file_size)
+    if fadvise:
+        pybacked.fileio.advise_dontneed(file)
+    file.close()
+
+
 def zip_extract(archivepath, filelist, extractpath):
     """
     Extract a list of files to a specific location
@@ -136,6 +389,7 @@ def zip_extract(archivepath, filelist, extractpath):
     """
     if os.path.isfile(archivepath):
         archive = zipfile.ZipFile(archivepath, mode='r')
+        pybacked.instrumentation.count("archives_opened")
     else:
         raise FileNotFoundError("Specified file does not exist")
     archive.extractall(path=extractpath, members=filelist)
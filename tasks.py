@@ -68,7 +68,7 @@ def clean_tox(c):
 @task
 def lint(c, scope):
     if scope == "all":
-        c.run("flake8 src tests tasks.py setup.py")
+        c.run("flake8 src tests benchmarks tasks.py setup.py")
     elif scope == "src":
         c.run("flake8 src")
     elif scope == "tests":
@@ -0,0 +1,72 @@
+"""
+Helpers shared by the test modules. The paths of the test data are relative,
+so the tests have to be run from the root of the repository.
+"""
+import os
+import pybacked
+import pybacked.config
+import pybacked.restore
+import shutil
+import zipfile
+
+STORAGE = "./tests/testdata/ext_test/storage"
+
+
+def write_file(path, content, mode='w'):
+    file = open(path, mode)
+    file.write(content)
+    file.close()
+
+
+def read_file(path):
+    file = open(path, 'rb')
+    content = file.read()
+    file.close()
+    return content
+
+
+def read_tree(directory):
+    """
+    Read every file below a directory.
+
+    :return: A dictionary of relative path, content key-value pairs
+    :rtype: dict
+    """
+    tree = dict()
+    for root, dirs, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            tree[os.path.relpath(path, directory)] = read_file(path)
+    return tree
+
+
+def create_config(tmpdir, name, **kwargs):
+    """
+    Copy the ext_test storage into tmpdir, create an empty archive directory
+    next to it and return a configuration backing up the one to the other.
+    The keyword arguments are passed on to the Configuration.
+
+    :rtype: pybacked.config.Configuration
+    """
+    storage = os.path.abspath(tmpdir + "/storage")
+    archive = os.path.abspath(tmpdir + "/archive")
+    shutil.copytree(os.path.abspath(STORAGE), storage)
+    os.mkdir(archive)
+    return pybacked.config.Configuration(name, storage, archive,
+                                         pybacked.DIFF_HASH,
+                                         zipfile.ZIP_DEFLATED, 9,
+                                         pybacked.HASH_SHA256, **kwargs)
+
+
+def restore_tree(config, tmpdir, archname):
+    """
+    Restore an archive into a directory below tmpdir and read it.
+
+    :return: The tree of the restored archive, see read_tree()
+    :rtype: dict
+    """
+    restore_dir = os.path.abspath(tmpdir + "/restored-" + archname)
+    pybacked.restore.restore(config, archname, alt_dir=restore_dir)
+    tree = read_tree(restore_dir)
+    shutil.rmtree(restore_dir)
+    return tree
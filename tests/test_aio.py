@@ -0,0 +1,70 @@
+import asyncio
+import concurrent.futures
+import os
+import pybacked
+import pybacked.aio as aio
+import pybacked.config
+import pytest
+import tempfile
+import threading
+import zipfile
+
+
+def create_config(name, archive):
+    storage = os.path.abspath("./tests/testdata/ext_test/storage")
+    os.mkdir(archive)
+    return pybacked.config.Configuration(name, storage, archive,
+                                         pybacked.DIFF_DATE,
+                                         zipfile.ZIP_DEFLATED, 9)
+
+
+def test_backup_restore():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = create_config("aio", os.path.abspath(tmpdir + "/archive"))
+        restored = os.path.abspath(tmpdir + "/restored")
+        events = []
+        stats = asyncio.run(aio.backup(config, progress=events.append))
+        assert stats.changes['+'][0] == 4
+        assert events[-1].finished
+
+        stats = asyncio.run(aio.restore(config, "arch1.zip", restored))
+        assert stats.changes['+'][0] == 4
+        assert os.path.isfile(restored + "/subdir/subdir/doc4.txt")
+
+
+def test_backup_many():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        configs = [create_config("aio" + str(i),
+                                 os.path.abspath(tmpdir + "/archive" + str(i)))
+                   for i in range(3)]
+        events = []
+        results = asyncio.run(aio.backup_many(
+            configs, limit=2,
+            progress=lambda config, event: events.append(config.name)))
+        assert [stats.changes['+'][0] for stats in results] == [4, 4, 4]
+        assert set(events) == {"aio0", "aio1", "aio2"}
+        for config in configs:
+            assert "arch1.zip" in os.listdir(config.archive)
+
+
+def test_backup_cancel():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = create_config("aio", os.path.abspath(tmpdir + "/archive"))
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        blocker = threading.Event()
+
+        async def main():
+            # keep the only worker busy, so the backup starts only after the
+            # task was cancelled
+            executor.submit(blocker.wait)
+            task = asyncio.ensure_future(aio.backup(config, executor))
+            await asyncio.sleep(0)
+            task.cancel()
+            await asyncio.sleep(0)
+            blocker.set()
+            await task
+
+        with pytest.raises(asyncio.CancelledError):
+            asyncio.run(main())
+        executor.shutdown()
+        assert os.listdir(config.archive) == []
@@ -1,3 +1,4 @@
+import json
 import os.path
 import platform
 import pybacked
@@ -5,6 +6,8 @@ import pybacked.backup
 import pybacked.config
 import pybacked.diff
 import pybacked.logging
+import pybacked.manifest
+import pybacked.restore
 import shutil
 import tempfile
 import zipfile
@@ -38,6 +41,197 @@ def test_get_archive_name():
     assert result == expected
 
 
+def test_get_archive_name_empty():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        result = pybacked.backup.get_new_archive_name(tmpdir)
+    assert result == "arch1.zip"
+
+
+def test_get_archive_name_numeric():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for number in (9, 10):
+            archive = zipfile.ZipFile(
+                os.path.abspath(tmpdir + "/arch" + str(number) + ".zip"),
+                mode='x')
+            archive.close()
+        result = pybacked.backup.get_new_archive_name(tmpdir)
+    assert result == "arch11.zip"
+
+
+def test_get_archive_name_manifest(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        entry = pybacked.manifest.ManifestEntry(1, "arch1.zip", 1.0, 10, 1)
+        pybacked.manifest.write_manifest(tmpdir, [entry])
+
+        def listdir(path):
+            raise AssertionError("the archive directory was listed")
+
+        # with a manifest neither numbering nor lookups list the directory
+        monkeypatch.setattr(os, "listdir", listdir)
+        assert pybacked.backup.get_new_archive_name(tmpdir) == "arch2.zip"
+        assert pybacked.restore.get_archive_list(tmpdir) == \
+            [os.path.abspath(tmpdir + "/arch1.zip")]
+
+
+def test_backup_lists_archive_once(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        storage = os.path.abspath(tmpdir + "/storage")
+        archive = os.path.abspath(tmpdir + "/archive")
+        shutil.copytree(os.path.abspath("./tests/testdata/ext_test/storage"),
+                        storage)
+        os.mkdir(archive)
+        config = pybacked.config.Configuration("listdir", storage, archive,
+                                               pybacked.DIFF_HASH,
+                                               zipfile.ZIP_DEFLATED, 9,
+                                               pybacked.HASH_SHA256)
+        pybacked.backup.backup(config)
+        file = open(storage + "/doc1.txt", 'w')
+        file.write("edit 1")
+        file.close()
+
+        listed = []
+        listdir = os.listdir
+
+        def counting_listdir(path):
+            if os.path.abspath(path) == archive:
+                listed.append(path)
+            return listdir(path)
+
+        monkeypatch.setattr(os, "listdir", counting_listdir)
+        pybacked.backup.backup(config)
+        # only the recovery at the start of the backup lists the directory,
+        # the lookups of the files read the manifest
+        assert len(listed) == 2
+
+
+def test_backup_unlisted_archives():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        storage = os.path.abspath(tmpdir + "/storage")
+        archive = os.path.abspath(tmpdir + "/archive")
+        shutil.copytree(os.path.abspath("./tests/testdata/ext_test/storage"),
+                        storage)
+        os.mkdir(archive)
+        config = pybacked.config.Configuration("unlisted", storage, archive,
+                                               pybacked.DIFF_HASH,
+                                               zipfile.ZIP_DEFLATED, 9,
+                                               pybacked.HASH_SHA256)
+        pybacked.backup.backup(config)
+        file = open(storage + "/doc1.txt", 'w')
+        file.write("edit 1")
+        file.close()
+        pybacked.backup.backup(config)
+        # a backup killed before it recorded its complete archive
+        entries = pybacked.manifest.read_manifest(archive)
+        pybacked.manifest.write_manifest(archive, entries[:1])
+        # and one killed while it wrote its archive
+        leftover = zipfile.ZipFile(archive + "/arch3.zip", mode='x')
+        leftover.writestr("data/doc1.txt", "partial")
+        leftover.close()
+
+        # lookups trust the manifest until the next backup records it
+        assert pybacked.restore.get_archive_list(archive) == \
+            [archive + "/arch1.zip"]
+
+        file = open(storage + "/doc1.txt", 'w')
+        file.write("edit 2")
+        file.close()
+        pybacked.backup.backup(config)
+        entries = pybacked.manifest.read_manifest(archive)
+        assert [entry.filename for entry in entries] == \
+            ["arch1.zip", "arch2.zip", "arch3.zip"]
+        assert pybacked.manifest.is_complete(archive + "/arch3.zip")
+        restored = os.path.abspath(tmpdir + "/restored")
+        pybacked.restore.restore(config, "arch3.zip", alt_dir=restored)
+        file = open(restored + "/doc1.txt", 'r')
+        assert file.read() == "edit 2"
+        file.close()
+
+        # a copied in archive doesn't block later backups
+        shutil.copy(archive + "/arch3.zip", archive + "/arch4.zip")
+        pybacked.backup.backup(config)
+        assert pybacked.manifest.read_last_entry(archive).filename == \
+            "arch5.zip"
+
+
+def test_get_chain():
+    kinds = [pybacked.ARCHIVE_INCREMENTAL, pybacked.ARCHIVE_FULL,
+             pybacked.ARCHIVE_INCREMENTAL]
+    entries = [pybacked.manifest.ManifestEntry(
+        number + 1, "arch" + str(number + 1) + ".zip", 0.0, 0, 0, kind)
+        for number, kind in enumerate(kinds)]
+    assert pybacked.backup.get_chain(entries) == entries[1:]
+    assert pybacked.backup.get_chain(entries[:1]) == entries[:1]
+    assert pybacked.backup.get_chain([]) == []
+
+
+def test_is_full_due():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = pybacked.config.Configuration("full", tmpdir, tmpdir,
+                                               pybacked.DIFF_DATE,
+                                               zipfile.ZIP_STORED, 0)
+        kinds = [pybacked.ARCHIVE_FULL, pybacked.ARCHIVE_INCREMENTAL]
+        entries = [pybacked.manifest.ManifestEntry(
+            number + 1, "arch" + str(number + 1) + ".zip", 1000.0, 100, 1,
+            kind) for number, kind in enumerate(kinds)]
+        pybacked.manifest.write_manifest(tmpdir, entries)
+        assert not pybacked.backup.is_full_due(config, 2000.0)
+
+        config.full_every = 3
+        assert not pybacked.backup.is_full_due(config, 2000.0)
+        config.full_every = 2
+        assert pybacked.backup.is_full_due(config, 2000.0)
+
+        config.full_every = None
+        config.full_interval = 1000.0
+        assert not pybacked.backup.is_full_due(config, 1999.0)
+        assert pybacked.backup.is_full_due(config, 2000.0)
+
+        config.full_interval = None
+        config.full_chain_size = 201
+        assert not pybacked.backup.is_full_due(config, 2000.0)
+        config.full_chain_size = 200
+        assert pybacked.backup.is_full_due(config, 2000.0)
+
+
+def test_backup_periodic_full():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        storage = os.path.abspath(tmpdir + "/storage")
+        archive = os.path.abspath(tmpdir + "/archive")
+        shutil.copytree(os.path.abspath("./tests/testdata/ext_test/storage"),
+                        storage)
+        os.mkdir(archive)
+        config = pybacked.config.Configuration("full", storage, archive,
+                                               pybacked.DIFF_HASH,
+                                               zipfile.ZIP_DEFLATED, 9,
+                                               pybacked.HASH_SHA256,
+                                               full_every=2)
+        states = []
+        for number in range(4):
+            file = open(storage + "/doc1.txt", 'w')
+            file.write("edit " + str(number))
+            file.close()
+            pybacked.backup.backup(config)
+            states.append(pybacked.diff.diff_log_deserialize(
+                archive + "/arch" + str(number + 1) + ".zip").diffdict)
+
+        entries = pybacked.manifest.read_manifest(archive)
+        assert [entry.kind for entry in entries] == \
+            [pybacked.ARCHIVE_FULL, pybacked.ARCHIVE_INCREMENTAL,
+             pybacked.ARCHIVE_FULL, pybacked.ARCHIVE_INCREMENTAL]
+        # the full archives hold every file, the incremental archives only
+        # the changes since the full archive before them
+        assert len(states[2]) == 4
+        assert list(states[3]) == ["doc1.txt"]
+        assert pybacked.restore.get_lookup_list(archive) == \
+            [archive + "/arch4.zip", archive + "/arch3.zip"]
+
+        restored = os.path.abspath(tmpdir + "/restored")
+        pybacked.restore.restore(config, "arch4.zip", alt_dir=restored)
+        file = open(restored + "/doc1.txt", 'r')
+        assert file.read() == "edit 3"
+        file.close()
+
+
 class TestBackup:
     def test_backup(self):
         with tempfile.TemporaryDirectory() as tmpdir:
@@ -156,7 +350,7 @@ class TestBackup:
             expected_namelist.sort()
 
             # perform a backup
-            pybacked.backup.backup(config)
+            stats = pybacked.backup.backup(config)
 
             # test if archive was created successfully
             new_archive = os.path.abspath(archive + "/arch3.zip")
@@ -200,3 +394,65 @@ class TestBackup:
             diff_log_file.close()
             arch.close()
             assert diff_log == expected_log.encode()
+
+            # STAGE 5: stats are returned and recorded in the metadata
+            assert stats.counters["members_written"] == 4
+            # every file and directory of the storage is stat'ed once
+            assert stats.counters["files_stat"] == 6
+            assert stats.counters["bytes_hashed"] > 0
+            assert "hash" in stats.phases
+            assert "lookup" in stats.phases
+            arch = zipfile.ZipFile(new_archive, mode='r')
+            metadata = json.loads(arch.read("metadata.json"))
+            arch.close()
+            assert metadata["stats"]["counters"]["bytes_in"] == \
+                stats.counters["bytes_in"]
+
+    def test_backup_append(self):
+        """
+        Test if appended files are detected and only the appended tail is
+        written to the archive.
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            storage = os.path.abspath(tmpdir + "/storage")
+            archive = os.path.abspath(tmpdir + "/archive")
+            restored = os.path.abspath(tmpdir + "/restored")
+            shutil.copytree(
+                os.path.abspath("./tests/testdata/ext_test/storage"), storage)
+            shutil.copytree(
+                os.path.abspath("./tests/testdata/ext_test/archive_linux"),
+                archive)
+
+            config = pybacked.config.Configuration("test3", storage, archive,
+                                                   pybacked.DIFF_HASH,
+                                                   zipfile.ZIP_DEFLATED, 9,
+                                                   pybacked.HASH_SHA256,
+                                                   detect_append=True)
+            pybacked.backup.backup(config)
+
+            # append to doc2.txt and perform another backup
+            doc2_path = os.path.abspath(storage + "/subdir/doc2.txt")
+            doc2_file = open(doc2_path, 'ab')
+            doc2_file.write(b"appended line\n")
+            doc2_file.close()
+            pybacked.backup.backup(config)
+
+            # STAGE 1: only the tail is archived and logged as appended
+            new_archive = os.path.abspath(archive + "/arch4.zip")
+            arch = zipfile.ZipFile(new_archive, mode='r')
+            doc2_tail = arch.read("data/subdir/doc2.txt")
+            arch.close()
+            diffcache = pybacked.diff.diff_log_deserialize(new_archive)
+            assert doc2_tail == b"appended line\n"
+            assert diffcache.diffdict["subdir/doc2.txt"].difftype == 'a'
+
+            # STAGE 2: restore concatenates the tail to the archived base
+            pybacked.restore.restore(config, "arch4.zip", alt_dir=restored)
+            doc2_file = open(doc2_path, 'rb')
+            doc2 = doc2_file.read()
+            doc2_file.close()
+            restored_file = open(
+                os.path.abspath(restored + "/subdir/doc2.txt"), 'rb')
+            doc2_restored = restored_file.read()
+            restored_file.close()
+            assert doc2_restored == doc2
@@ -0,0 +1,55 @@
+import os
+import pybacked
+import pybacked.backup
+import pybacked.cancellation as cancellation
+import pybacked.config
+import pybacked.hooks
+import pytest
+import tempfile
+import zipfile
+
+
+class TestCancelToken:
+    def test_cancel(self):
+        token = cancellation.CancelToken()
+        assert not token.is_cancelled()
+        token.cancel()
+        assert token.is_cancelled()
+
+
+def test_check():
+    # no token active
+    cancellation.check()
+    token = cancellation.CancelToken()
+    with cancellation.activate(token):
+        cancellation.check()
+        token.cancel()
+        with pytest.raises(cancellation.Cancelled):
+            cancellation.check()
+    cancellation.check()
+
+
+def test_backup_cancelled():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        storage = os.path.abspath("./tests/testdata/ext_test/storage")
+        archive = os.path.abspath(tmpdir + "/archive")
+        os.mkdir(archive)
+        config = pybacked.config.Configuration("cancel", storage, archive,
+                                               pybacked.DIFF_DATE,
+                                               zipfile.ZIP_DEFLATED, 9)
+        token = cancellation.CancelToken()
+
+        class Canceller:
+            # cancel after the first member was written to the archive
+            def on_start(self, record):
+                pass
+
+            def on_end(self, record):
+                if record.event == "write_member":
+                    token.cancel()
+
+        with cancellation.activate(token), \
+                pybacked.hooks.registered(Canceller()):
+            with pytest.raises(cancellation.Cancelled):
+                pybacked.backup.backup(config)
+        assert os.listdir(archive) == []
@@ -0,0 +1,97 @@
+import os
+import pybacked
+import pybacked.backup
+import pybacked.catalog as catalog
+import pybacked.index
+import pybacked.manifest
+import pytest
+import tempfile
+from helpers import create_config, write_file
+
+
+def get_keys(rows):
+    return [(row.path, row.archive, row.modtype) for row in rows]
+
+
+def test_get_literal_prefix():
+    assert catalog.get_literal_prefix("subdir/*.txt") == "subdir/"
+    assert catalog.get_literal_prefix("doc[12].txt") == "doc"
+    assert catalog.get_literal_prefix("*/doc2.txt") == ""
+    assert catalog.get_literal_prefix("doc1.txt") == "doc1.txt"
+
+
+def test_get_prefixed():
+    paths = ["a", "sub/a", "sub/b", "subdir/c", "z"]
+    assert list(catalog.get_prefixed(paths, "sub/")) == ["sub/a", "sub/b"]
+    assert list(catalog.get_prefixed(paths, "sub")) == \
+        ["sub/a", "sub/b", "subdir/c"]
+    assert list(catalog.get_prefixed(paths, "x")) == []
+
+
+def test_catalog():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = create_config(tmpdir, "catalog")
+        pybacked.backup.backup(config)
+        instance = catalog.Catalog(config.archive)
+        instance.refresh()
+        assert instance.paths == ["doc1.txt", "subdir/doc2.txt",
+                                  "subdir/doc3.txt", "subdir/subdir/doc4.txt"]
+
+        write_file(config.storage + "/doc1.txt", "edited content")
+        write_file(config.storage + "/subdir/doc5.txt", "new file")
+        pybacked.backup.backup(config)
+        instance.refresh()
+        assert instance.paths == ["doc1.txt", "subdir/doc2.txt",
+                                  "subdir/doc3.txt", "subdir/doc5.txt",
+                                  "subdir/subdir/doc4.txt"]
+
+        rows = list(instance.glob("doc1.txt"))
+        assert get_keys(rows) == [("doc1.txt", "arch1.zip", "+"),
+                                  ("doc1.txt", "arch2.zip", "*")]
+        entries = pybacked.manifest.read_manifest(config.archive)
+        assert [row.timestamp for row in rows] == \
+            [entry.timestamp for entry in entries]
+        assert rows[0].state != rows[1].state
+
+        assert get_keys(instance.glob("*/doc[45].txt")) == \
+            [("subdir/doc5.txt", "arch2.zip", "+"),
+             ("subdir/subdir/doc4.txt", "arch1.zip", "+")]
+        assert get_keys(instance.glob("subdir/*")) == \
+            get_keys(instance.prefix("subdir/"))
+        assert [row.path for row in instance.prefix("subdir/subdir/")] == \
+            ["subdir/subdir/doc4.txt"]
+        assert get_keys(instance.regex(r"doc[13]")) == \
+            [("doc1.txt", "arch1.zip", "+"), ("doc1.txt", "arch2.zip", "*"),
+             ("subdir/doc3.txt", "arch1.zip", "+")]
+        assert list(instance.search("missing*")) == []
+        with pytest.raises(ValueError):
+            instance.search("doc1.txt", "unknown")
+
+
+def test_catalog_rebuild():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = create_config(tmpdir, "catalog")
+        pybacked.backup.backup(config)
+        write_file(config.storage + "/doc1.txt", "edited content")
+        pybacked.backup.backup(config)
+        index = pybacked.index.ArchiveIndex(config.archive)
+        instance = catalog.Catalog(config.archive, index)
+        instance.refresh()
+        assert len(list(instance.glob("doc1.txt"))) == 2
+
+        # removing an archive rebuilds the catalog
+        os.remove(config.archive + "/arch2.zip")
+        entries = pybacked.manifest.read_manifest(config.archive)
+        pybacked.manifest.write_manifest(config.archive, entries[:1])
+        instance.refresh()
+        assert get_keys(instance.glob("doc1.txt")) == \
+            [("doc1.txt", "arch1.zip", "+")]
+
+
+def test_search():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = create_config(tmpdir, "catalog")
+        pybacked.backup.backup(config)
+        assert [row.path for row in catalog.search(
+            config, "subdir/", catalog.SEARCH_PREFIX)] == \
+            ["subdir/doc2.txt", "subdir/doc3.txt", "subdir/subdir/doc4.txt"]
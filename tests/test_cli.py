@@ -0,0 +1,112 @@
+import io
+import os
+import pybacked
+import pybacked.backup
+import pybacked.cli as cli
+import pybacked.config
+import pybacked.manifest
+import pytest
+import tempfile
+from helpers import create_config
+
+
+def create_config_file(tmpdir):
+    config = create_config(tmpdir, "cli")
+    config_path = os.path.abspath(tmpdir + "/config.json")
+    pybacked.config.write_config([config], config_path)
+    return config, config_path
+
+
+def test_get_config():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config, config_path = create_config_file(tmpdir)
+        assert cli.get_config(config_path, "cli") == config
+        with pytest.raises(KeyError):
+            cli.get_config(config_path, "missing")
+
+
+def test_diff():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config, config_path = create_config_file(tmpdir)
+        pybacked.backup.backup(config)
+        file = open(config.storage + "/doc1.txt", 'w')
+        file.write("edited content")
+        file.close()
+        file = open(config.storage + "/new.txt", 'w')
+        file.write("new file")
+        file.close()
+        pybacked.backup.backup(config)
+
+        output = io.StringIO()
+        assert cli.main(["diff", config_path, "cli", "arch1.zip",
+                         "arch2.zip"], output) == 0
+        assert output.getvalue() == "* doc1.txt\n+ new.txt\n"
+        output = io.StringIO()
+        cli.main(["diff", config_path, "cli", "arch2.zip", "arch1.zip"],
+                 output)
+        assert output.getvalue() == "* doc1.txt\n- new.txt\n"
+        with pytest.raises(SystemExit):
+            cli.main(["diff", config_path, "missing", "arch1.zip",
+                      "arch2.zip"], output)
+
+
+def test_search():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config, config_path = create_config_file(tmpdir)
+        pybacked.backup.backup(config)
+        output = io.StringIO()
+        assert cli.main(["search", config_path, "cli", "*/doc4.txt"],
+                        output) == 0
+        fields = output.getvalue().split("\t")
+        assert fields[:3] == ["subdir/subdir/doc4.txt", "arch1.zip", "+"]
+        assert fields[3].endswith("+00:00")
+        output = io.StringIO()
+        cli.main(["search", config_path, "cli", "--prefix", "subdir/sub"],
+                 output)
+        assert output.getvalue().startswith("subdir/subdir/doc4.txt\t")
+        output = io.StringIO()
+        cli.main(["search", config_path, "cli", "--regex", "doc[12]"],
+                 output)
+        assert [line.split("\t")[0] for line in
+                output.getvalue().splitlines()] == ["doc1.txt",
+                                                    "subdir/doc2.txt"]
+
+
+def test_parse_time():
+    assert cli.parse_time("1600000000.5") == 1600000000.5
+    assert cli.parse_time("2020-09-13T12:26:40+00:00") == 1600000000.0
+    with pytest.raises(ValueError):
+        cli.parse_time("yesterday")
+
+
+def test_restore():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config, config_path = create_config_file(tmpdir)
+        pybacked.backup.backup(config)
+        file = open(config.storage + "/doc1.txt", 'w')
+        file.write("edited content")
+        file.close()
+        pybacked.backup.backup(config)
+        entries = pybacked.manifest.read_manifest(config.archive)
+        restored = os.path.abspath(tmpdir + "/restored")
+
+        output = io.StringIO()
+        assert cli.main(["restore", config_path, "cli", "--at",
+                         str(entries[0].timestamp), "--alt-dir", restored],
+                        output) == 0
+        assert output.getvalue() == "arch1.zip\n"
+        file = open(restored + "/doc1.txt", 'r')
+        assert file.read() != "edited content"
+        file.close()
+
+        output = io.StringIO()
+        assert cli.main(["restore", config_path, "cli", "arch2.zip",
+                         "--path", "doc1.txt", "--alt-dir", restored],
+                        output) == 0
+        assert output.getvalue() == "arch2.zip: doc1.txt restored\n"
+        file = open(restored + "/doc1.txt", 'r')
+        assert file.read() == "edited content"
+        file.close()
+
+        assert cli.main(["restore", config_path, "cli", "--at", "0",
+                         "--alt-dir", restored], output) == 1
@@ -23,7 +23,14 @@ class TestConfigurationClass:
         # create expected dictionary
         expected = {"name": "1", "storage": "2", "archive": "3",
                     "diff_algorithm": 4, "compression_algorithm": 5,
-                    "compresslevel": 6, "hash_algorithm": 7}
+                    "compresslevel": 6, "hash_algorithm": 7,
+                    "detect_append": False, "full_verify_interval": None,
+                    "fadvise": False, "metrics_dir": None,
+                    "read_limit": None, "write_limit": None,
+                    "cpu_limit": None, "throttle_control": None,
+                    "retention": None, "reverse_incremental": False,
+                    "full_every": None, "full_interval": None,
+                    "full_chain_size": None}
 
         result = instance.get_dict()
         assert result == expected
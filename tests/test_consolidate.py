@@ -0,0 +1,216 @@
+import os
+import pybacked
+import pybacked.backup
+import pybacked.consolidate as consolidate
+import pybacked.diff
+import pybacked.manifest
+import pybacked.restore
+import pytest
+import shutil
+import tempfile
+import zipfile
+from helpers import create_config, read_tree, write_file
+
+
+def create_chain(tmpdir):
+    """
+    Create an archive directory with three archives. The second archive
+    edits doc1.txt, appends to doc2.txt and adds new.txt, the third archive
+    appends to doc2.txt again.
+    """
+    config = create_config(tmpdir, "consolidate", detect_append=True)
+    storage = config.storage
+    pybacked.backup.backup(config)
+    write_file(storage + "/doc1.txt", "edited content")
+    write_file(storage + "/subdir/doc2.txt", "first tail\n", 'a')
+    write_file(storage + "/new.txt", "new file")
+    pybacked.backup.backup(config)
+    write_file(storage + "/subdir/doc2.txt", "second tail\n", 'a')
+    pybacked.backup.backup(config)
+    return config
+
+
+def test_fold_archives():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = create_chain(tmpdir)
+        chain = [os.path.abspath(config.archive + "/arch" + str(i) + ".zip")
+                 for i in range(1, 4)]
+        state = consolidate.fold_archives(chain)
+        assert len(state) == 5
+        assert state["doc1.txt"].parts == chain[1:2]
+        assert state["subdir/doc2.txt"].parts == chain
+        assert state["subdir/doc2.txt"].modtype == '+'
+        assert state["doc1.txt"].modtype == '+'
+        assert state["subdir/doc3.txt"].parts == chain[:1]
+
+        state = consolidate.fold_archives(chain[1:])
+        assert state["doc1.txt"].modtype == '*'
+        assert state["subdir/doc2.txt"].modtype == 'a'
+        assert state["new.txt"].modtype == '+'
+
+
+def test_merge_changes():
+    added = consolidate.FileChange('+', "1", ["arch1.zip"])
+    edited = consolidate.FileChange('*', "2", ["arch2.zip"])
+    appended = consolidate.FileChange('a', "3", ["arch3.zip"])
+    removed = consolidate.FileChange('-', "4", [])
+    assert consolidate.merge_changes(added, removed) is None
+    result = consolidate.merge_changes(added, edited)
+    assert (result.modtype, result.diff, result.parts) == \
+        ('+', "2", ["arch2.zip"])
+    result = consolidate.merge_changes(removed, added)
+    assert (result.modtype, result.parts) == ('*', ["arch1.zip"])
+    result = consolidate.merge_changes(edited, appended)
+    assert (result.modtype, result.diff, result.parts) == \
+        ('*', "3", ["arch2.zip", "arch3.zip"])
+    result = consolidate.merge_changes(appended, appended)
+    assert (result.modtype, result.parts) == \
+        ('a', ["arch3.zip", "arch3.zip"])
+    result = consolidate.merge_changes(edited, removed)
+    assert result.modtype == '-'
+
+
+def test_consolidate():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = create_chain(tmpdir)
+        expected_dir = os.path.abspath(tmpdir + "/expected")
+        restored_dir = os.path.abspath(tmpdir + "/restored")
+        pybacked.restore.restore(config, "arch3.zip", alt_dir=expected_dir)
+        arch1 = zipfile.ZipFile(config.archive + "/arch1.zip", mode='r')
+        doc3_info = arch1.getinfo("data/subdir/doc3.txt")
+        arch1.close()
+
+        entry = consolidate.consolidate(config)
+        assert entry.filename == "arch3.zip"
+        assert entry.kind == pybacked.ARCHIVE_FULL
+        assert entry.members == 5
+        assert pybacked.manifest.read_manifest(config.archive)[2] == entry
+
+        # STAGE 1: the consolidated archive holds the complete state
+        archive = zipfile.ZipFile(config.archive + "/arch3.zip", mode='r')
+        assert archive.testzip() is None
+        info = archive.getinfo("data/subdir/doc3.txt")
+        assert (info.CRC, info.compress_size) == \
+            (doc3_info.CRC, doc3_info.compress_size)
+        archive.close()
+        diffcache = pybacked.diff.diff_log_deserialize(
+            config.archive + "/arch3.zip")
+        assert len(diffcache.diffdict) == 5
+        assert {diff.difftype for diff in diffcache.diffdict.values()} == \
+            {'+'}
+
+        # STAGE 2: restores start at the full archive
+        stats = pybacked.restore.restore(config, "arch3.zip",
+                                         alt_dir=restored_dir)
+        assert stats.changes['+'][0] == 5
+        assert read_tree(restored_dir) == read_tree(expected_dir)
+        assert read_tree(restored_dir) == read_tree(config.storage)
+
+        # STAGE 3: lookups stop at the full archive
+        assert pybacked.restore.get_lookup_list(config.archive) == \
+            [os.path.abspath(config.archive + "/arch3.zip")]
+        pybacked.backup.backup(config)
+        diffcache = pybacked.diff.diff_log_deserialize(
+            config.archive + "/arch4.zip")
+        assert diffcache.diffdict == {}
+
+
+def test_write_archive_closes_sources(monkeypatch):
+    counts = {"open": 0, "most": 0}
+
+    class CountedZipFile(zipfile.ZipFile):
+        def __init__(self, file, mode='r', *args, **kwargs):
+            super().__init__(file, mode, *args, **kwargs)
+            counts["open"] += 1
+            counts["most"] = max(counts["most"], counts["open"])
+
+        def close(self):
+            if self.fp is not None:
+                counts["open"] -= 1
+            super().close()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = create_chain(tmpdir)
+        archive_list = [config.archive + "/arch" + str(number) + ".zip"
+                        for number in (1, 2, 3)]
+        changes = consolidate.fold_archives(archive_list)
+        monkeypatch.setattr(zipfile, "ZipFile", CountedZipFile)
+        consolidate.write_archive(tmpdir + "/merged.zip", changes, 0,
+                                  zipfile.ZIP_DEFLATED, 9)
+        # the new archive and at most one source archive are open at once
+        assert counts["open"] == 0
+        assert counts["most"] == 2
+
+
+def test_consolidate_prune():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = create_chain(tmpdir)
+        consolidate.consolidate(config, "arch2.zip", prune=True)
+        assert sorted(os.listdir(config.archive)) == \
+            ["arch2.zip", "arch3.zip", pybacked.manifest.MANIFEST_NAME]
+        entries = pybacked.manifest.read_manifest(config.archive)
+        assert [entry.kind for entry in entries] == \
+            [pybacked.ARCHIVE_FULL, pybacked.ARCHIVE_INCREMENTAL]
+
+        restored_dir = os.path.abspath(tmpdir + "/restored")
+        pybacked.restore.restore(config, "arch3.zip", alt_dir=restored_dir)
+        assert read_tree(restored_dir) == read_tree(config.storage)
+
+
+def test_consolidate_prune_interrupted(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = create_chain(tmpdir)
+        entries = pybacked.manifest.read_manifest(config.archive)
+        listed = [(entry.filename, entry.kind) for entry in entries]
+        write_manifest = pybacked.manifest.write_manifest
+
+        def killed(archive_dir, entries):
+            raise KeyboardInterrupt()
+
+        # killed after the journal was written, before anything changed
+        monkeypatch.setattr(pybacked.manifest, "write_manifest", killed)
+        with pytest.raises(KeyboardInterrupt):
+            consolidate.consolidate(config, "arch2.zip", prune=True)
+        monkeypatch.setattr(pybacked.manifest, "write_manifest",
+                            write_manifest)
+        assert os.path.isfile(
+            pybacked.manifest.get_journal_path(config.archive))
+        # the cached manifest wasn't changed
+        assert [(entry.filename, entry.kind) for entry in entries] == listed
+        restored_dir = os.path.abspath(tmpdir + "/restored")
+        pybacked.restore.restore(config, "arch3.zip", alt_dir=restored_dir)
+        assert read_tree(restored_dir) == read_tree(config.storage)
+
+        # the next run completes the change
+        assert pybacked.manifest.recover(config.archive)
+        assert sorted(os.listdir(config.archive)) == \
+            ["arch2.zip", "arch3.zip", pybacked.manifest.MANIFEST_NAME]
+        entries = pybacked.manifest.read_manifest(config.archive)
+        assert [entry.kind for entry in entries] == \
+            [pybacked.ARCHIVE_FULL, pybacked.ARCHIVE_INCREMENTAL]
+        shutil.rmtree(restored_dir)
+        pybacked.restore.restore(config, "arch3.zip", alt_dir=restored_dir)
+        assert read_tree(restored_dir) == read_tree(config.storage)
+
+
+def test_consolidate_reverse():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = create_chain(tmpdir)
+        config.reverse_incremental = True
+        write_file(config.storage + "/doc1.txt", "edited again")
+        pybacked.backup.backup(config)
+        first = read_tree(config.storage)
+        write_file(config.storage + "/doc1.txt", "edited once more")
+        pybacked.backup.backup(config)
+
+        # the archives after a reverse delta aren't pruned
+        consolidate.consolidate(config, "arch4.zip", prune=True)
+        assert sorted(os.listdir(config.archive)) == \
+            ["arch1.zip", "arch2.zip", "arch3.zip", "arch4.zip",
+             "arch5.zip", pybacked.manifest.MANIFEST_NAME]
+        entries = pybacked.manifest.read_manifest(config.archive)
+        assert [entry.kind for entry in entries[3:]] == \
+            [pybacked.ARCHIVE_FULL, pybacked.ARCHIVE_FULL]
+        restored_dir = os.path.abspath(tmpdir + "/restored")
+        pybacked.restore.restore(config, "arch4.zip", alt_dir=restored_dir)
+        assert read_tree(restored_dir) == first
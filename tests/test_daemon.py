@@ -0,0 +1,93 @@
+import os
+import pybacked
+import pybacked.config
+import pybacked.daemon as daemon
+import tempfile
+import threading
+import time
+import zipfile
+
+
+def test_handle():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        storage = os.path.abspath("./tests/testdata/ext_test/storage")
+        archive = os.path.abspath(tmpdir + "/archive")
+        os.mkdir(archive)
+        config = pybacked.config.Configuration("daemon", storage, archive,
+                                               pybacked.DIFF_DATE,
+                                               zipfile.ZIP_DEFLATED, 9)
+        instance = daemon.Daemon([config], tmpdir + "/pybacked.sock")
+        response = instance.handle({"op": "backup", "config": "daemon"})
+        assert response["ok"]
+        assert response["stats"]["changes"]["+"]["files"] == 4
+        response = instance.handle({"op": "status"})
+        assert response == {"ok": True, "configs": ["daemon"],
+                            "archives": {"daemon": 1}}
+        response = instance.handle({"op": "search", "config": "daemon",
+                                    "pattern": "*/doc4.txt"})
+        assert response["ok"]
+        assert [row[:3] for row in response["rows"]] == \
+            [["subdir/subdir/doc4.txt", "arch1.zip", "+"]]
+        response = instance.handle({"op": "search", "config": "daemon",
+                                    "pattern": "doc", "mode": "unknown"})
+        assert not response["ok"]
+        response = instance.handle({"op": "fetch", "config": "daemon",
+                                    "path": "doc1.txt",
+                                    "timestamp": time.time(),
+                                    "dest": tmpdir + "/fetched"})
+        assert response["ok"]
+        assert response["archives"] == [archive + "/arch1.zip"]
+        response = instance.handle({"op": "restore", "config": "daemon",
+                                    "timestamp": 0.0,
+                                    "alt_dir": tmpdir + "/restored"})
+        assert not response["ok"]
+        response = instance.handle({"op": "backup", "config": "missing"})
+        assert not response["ok"]
+        response = instance.handle({"op": "unknown"})
+        assert not response["ok"]
+
+
+def test_serve():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        storage = os.path.abspath("./tests/testdata/ext_test/storage")
+        archive = os.path.abspath(tmpdir + "/archive")
+        restored = os.path.abspath(tmpdir + "/restored")
+        socket_path = os.path.abspath(tmpdir + "/pybacked.sock")
+        os.mkdir(archive)
+        config = pybacked.config.Configuration("daemon", storage, archive,
+                                               pybacked.DIFF_DATE,
+                                               zipfile.ZIP_DEFLATED, 9)
+        instance = daemon.Daemon([config], socket_path)
+        thread = threading.Thread(target=instance.serve_forever)
+        thread.start()
+        try:
+            for i in range(100):
+                if os.path.exists(socket_path):
+                    break
+                time.sleep(0.01)
+            response = daemon.send_request(socket_path,
+                                           {"op": "backup",
+                                            "config": "daemon"})
+            assert response["ok"]
+            response = daemon.send_request(socket_path,
+                                           {"op": "restore",
+                                            "config": "daemon",
+                                            "archive": "arch1.zip",
+                                            "alt_dir": restored})
+            assert response["ok"]
+            assert os.path.isfile(restored + "/subdir/subdir/doc4.txt")
+            response = daemon.send_request(socket_path,
+                                           {"op": "fetch",
+                                            "config": "daemon",
+                                            "path": "doc1.txt",
+                                            "dest": restored + "/fetched"})
+            assert response["ok"]
+            assert response["status"] == "restored"
+            assert response["archives"] == [archive + "/arch1.zip"]
+            assert os.path.isfile(restored + "/fetched")
+            response = daemon.send_request(socket_path, {"op": "shutdown"})
+            assert response["ok"]
+        finally:
+            instance.shutdown()
+            thread.join()
+        assert not os.path.exists(socket_path)
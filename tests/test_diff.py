@@ -1,10 +1,13 @@
+import os
 import time
 import platform
 import pybacked.zip_handler
 import pytest
+import tempfile
+import zipfile
 from os.path import abspath as abspath
 from os.path import getmtime as getmtime
-from pybacked import DIFF_DATE, DIFF_HASH, HASH_SHA1, HASH_SHA256
+from pybacked import DIFF_DATE, DIFF_HASH, DIFF_STAT, HASH_SHA1, HASH_SHA256
 from pybacked import diff, restore
 
 
@@ -357,3 +360,30 @@ class TestDiffLogDeserialization:
         result = diff.diff_log_deserialize(arch, basepath)
 
         assert result == expected_diffcache
+
+
+def test_detect_stat():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filepath = abspath(tmpdir + "/doc.txt")
+        archive = abspath(tmpdir + "/arch1.zip")
+        file = open(filepath, 'w')
+        file.write("content")
+        file.close()
+        state = restore.get_stat_state(filepath)
+        pybacked.zip_handler.archive_write(
+            archive, "filename,modtype,diff\r\ndoc.txt,+," + state + "\r\n",
+            "diff-log.csv", zipfile.ZIP_DEFLATED, 9)
+
+        # unchanged files aren't detected
+        assert diff.detect(filepath, tmpdir, DIFF_STAT) is None
+
+        # a change of size is detected, even if mtime is preserved
+        mtime_ns = os.stat(filepath).st_mtime_ns
+        file = open(filepath, 'a')
+        file.write("more")
+        file.close()
+        os.utime(filepath, ns=(mtime_ns, mtime_ns))
+        probe_diff = diff.detect(filepath, tmpdir, DIFF_STAT)
+
+        assert probe_diff.difftype == '*'
+        assert probe_diff.state == restore.get_stat_state(filepath)
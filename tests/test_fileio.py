@@ -0,0 +1,39 @@
+import os
+import pytest
+import tempfile
+from pybacked import fileio
+
+
+@pytest.fixture
+def advice_log(monkeypatch):
+    # record the advice instead of passing it to the kernel
+    log = []
+    monkeypatch.setattr(os, "posix_fadvise",
+                        lambda fd, offset, length, advice: log.append(advice),
+                        raising=False)
+    monkeypatch.setattr(os, "POSIX_FADV_SEQUENTIAL", 2, raising=False)
+    monkeypatch.setattr(os, "POSIX_FADV_DONTNEED", 4, raising=False)
+    monkeypatch.setattr(os, "fdatasync", lambda fd: log.append("sync"),
+                        raising=False)
+    return log
+
+
+def test_advise_sequential(advice_log):
+    with tempfile.TemporaryFile() as file:
+        fileio.advise_sequential(file)
+    assert advice_log == [os.POSIX_FADV_SEQUENTIAL]
+
+
+def test_advise_dontneed(advice_log):
+    with tempfile.TemporaryFile() as file:
+        fileio.advise_dontneed(file)
+        fileio.advise_dontneed(file, sync=True)
+    assert advice_log == [os.POSIX_FADV_DONTNEED, "sync",
+                          os.POSIX_FADV_DONTNEED]
+
+
+def test_advise_unsupported(monkeypatch):
+    monkeypatch.delattr(os, "posix_fadvise", raising=False)
+    with tempfile.TemporaryFile() as file:
+        fileio.advise_sequential(file)
+        fileio.advise_dontneed(file, sync=True)
@@ -0,0 +1,57 @@
+import os.path
+import tempfile
+from pybacked import HASH_SHA256
+from pybacked import hash_cache
+
+
+class TestHashCache:
+    def test_constructor_empty(self):
+        instance = hash_cache.HashCache(60)
+        assert instance.verify_interval == 60
+        assert instance.entries == {}
+
+    def test_lookup_valid(self):
+        instance = hash_cache.HashCache(60)
+        instance.update("file1", 10, "sample", "hash", HASH_SHA256, now=100)
+        result = instance.lookup("file1", 10, "sample", HASH_SHA256, now=120)
+        assert result == "hash"
+
+    def test_lookup_changed(self):
+        instance = hash_cache.HashCache(60)
+        instance.update("file1", 10, "sample", "hash", HASH_SHA256, now=100)
+        assert instance.lookup("file1", 11, "sample", HASH_SHA256,
+                               now=120) is None
+        assert instance.lookup("file1", 10, "other", HASH_SHA256,
+                               now=120) is None
+        assert instance.lookup("file2", 10, "sample", HASH_SHA256,
+                               now=120) is None
+
+    def test_lookup_expired(self):
+        instance = hash_cache.HashCache(60)
+        instance.update("file1", 10, "sample", "hash", HASH_SHA256, now=100)
+        result = instance.lookup("file1", 10, "sample", HASH_SHA256, now=160)
+        assert result is None
+
+
+def test_serialize_hash_cache():
+    instance = hash_cache.HashCache(60)
+    instance.update("file1", 10, "sample", "hash", HASH_SHA256, now=100.5)
+    expected = "filepath,size,sample,hash,algorithm,verified\r\n" \
+               "file1,10,sample,hash,sha256,100.5\r\n"
+    assert hash_cache.serialize_hash_cache(instance) == expected
+
+
+def test_write_read_hash_cache():
+    instance = hash_cache.HashCache(60)
+    instance.update("file1", 10, "sample", "hash", HASH_SHA256, now=100.5)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        hash_cache.write_hash_cache(instance, tmpdir)
+        assert os.path.isfile(os.path.abspath(tmpdir + "/hash-cache.csv"))
+        result = hash_cache.read_hash_cache(tmpdir, 60)
+    assert result == instance
+
+
+def test_read_hash_cache_missing():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        result = hash_cache.read_hash_cache(tmpdir, 60)
+    assert result == hash_cache.HashCache(60)
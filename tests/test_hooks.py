@@ -0,0 +1,96 @@
+import io
+import os.path
+import pybacked.hooks as hooks
+from pybacked import DIFF_HASH, HASH_SHA256
+from pybacked import diff
+
+
+class Recorder:
+    def __init__(self):
+        self.started = []
+        self.ended = []
+
+    def on_start(self, record):
+        self.started.append(record.event)
+
+    def on_end(self, record):
+        self.ended.append((record.event, dict(record.context)))
+
+
+def test_register():
+    recorder = Recorder()
+    hooks.register(recorder)
+    assert hooks.enabled
+    hooks.unregister(recorder)
+    assert not hooks.enabled
+
+
+def test_nested_records():
+    with hooks.registered(Recorder()):
+        outer = hooks.start("outer", path="a")
+        inner = hooks.start("inner")
+        hooks.annotate(bytes=3)
+        hooks.end(inner)
+        hooks.end(outer)
+    assert inner.parent is outer
+    assert inner.context == {"bytes": 3}
+    assert outer.child_seconds == inner.seconds
+    assert outer.own_seconds == outer.seconds - inner.seconds
+
+
+def test_hooked():
+    @hooks.hooked("probe", path="filepath")
+    def probe(filepath, size=0):
+        hooks.annotate(bytes=size)
+        return filepath
+
+    recorder = Recorder()
+    # without a consumer no event is recorded
+    assert probe("file1") == "file1"
+    with hooks.registered(recorder):
+        probe("file2", size=4)
+        probe(filepath="file3")
+    assert recorder.started == ["probe", "probe"]
+    assert recorder.ended == [("probe", {"path": "file2", "bytes": 4}),
+                              ("probe", {"path": "file3", "bytes": 0})]
+
+
+def test_detect_events():
+    filepath = os.path.abspath(
+        "./tests/testdata/archive_hash/test_sample1.txt")
+    archive_path = os.path.abspath("./tests/testdata/archive_hash")
+    recorder = Recorder()
+    with hooks.registered(recorder):
+        diff.detect(filepath, archive_path, DIFF_HASH, HASH_SHA256)
+    events = [event for event, context in recorder.ended]
+    assert events == ["get_arch_state", "get_current_state", "detect"]
+    assert recorder.ended[1][1] == {"path": filepath,
+                                    "bytes": os.path.getsize(filepath)}
+
+
+def test_profile_aggregator():
+    aggregator = hooks.ProfileAggregator()
+    with hooks.registered(aggregator):
+        outer = hooks.start("outer")
+        hooks.end(hooks.start("inner"))
+        hooks.end(hooks.start("inner"))
+        hooks.end(outer)
+    assert aggregator.stats["inner"][0] == 2
+    assert aggregator.stats["outer"][0] == 1
+    assert aggregator.stats["outer"][2] == outer.seconds
+
+    stream = io.StringIO()
+    aggregator.print_stats(stream, sort="ncalls")
+    lines = stream.getvalue().splitlines()
+    assert lines[1].endswith("inner")
+    assert lines[2].endswith("outer")
+
+
+def test_slow_file_report():
+    report = hooks.SlowFileReport(top_n=2)
+    for seconds, path in [(1.0, "a"), (3.0, "b"), (2.0, "c")]:
+        record = hooks.Record("hash", {"path": path})
+        record.seconds = seconds
+        report.on_end(record)
+    result = report.report()
+    assert result == {"hash": [(3.0, {"path": "b"}), (2.0, {"path": "c"})]}
@@ -0,0 +1,89 @@
+import os
+import pybacked
+import pybacked.backup
+import pybacked.diff
+import pybacked.index as index
+import pybacked.restore
+import shutil
+import tempfile
+from helpers import create_config
+
+
+class TestArchiveIndex:
+    def test_refresh(self):
+        archive = os.path.abspath("./tests/testdata/ext_test/archive")
+        instance = index.ArchiveIndex(archive)
+        instance.refresh()
+        assert instance.archives == \
+            sorted(pybacked.restore.get_archive_list(archive))
+        for filename in ("doc1.txt", "subdir/doc3.txt"):
+            assert instance.find(filename) == \
+                pybacked.restore.find_diff_archive(
+                    instance.history[filename][-1].archive, filename)
+            assert pybacked.restore.get_arch_state(
+                filename, archive, pybacked.DIFF_HASH, instance) == \
+                pybacked.restore.get_arch_state(filename, archive,
+                                                pybacked.DIFF_HASH)
+        assert instance.find("subdir/doc2.txt") is None
+
+    def test_refresh_rebuild(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            archive = os.path.abspath(tmpdir + "/archive")
+            shutil.copytree(
+                os.path.abspath("./tests/testdata/ext_test/archive"), archive)
+            instance = index.ArchiveIndex(archive)
+            instance.refresh()
+            os.remove(os.path.abspath(archive + "/arch2.zip"))
+            instance.refresh()
+            assert instance.archives == \
+                [os.path.abspath(archive + "/arch1.zip")]
+
+    def test_get_arch_size(self):
+        instance = index.ArchiveIndex("archive")
+        instance.positions = {"arch1.zip": 0, "arch2.zip": 1, "arch3.zip": 2,
+                              "arch4.zip": 3}
+        instance.history["file"] = [
+            index.IndexEntry("arch1.zip", '+', "", 10),
+            index.IndexEntry("arch2.zip", 'a', "", 5),
+            index.IndexEntry("arch3.zip", 'a', "", 3)]
+        assert instance.get_arch_size("file") == 18
+        # the chain is cut at the newest full archive
+        instance.root = 1
+        assert instance.get_arch_size("file") is None
+        instance.root = 0
+        instance.history["file"].append(
+            index.IndexEntry("arch4.zip", '-', "", 0))
+        assert instance.get_arch_size("file") is None
+        assert instance.get_arch_size("missing") is None
+
+
+def test_backup_restore_index():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = create_config(tmpdir, "index", detect_append=True)
+        storage = config.storage
+        archive = config.archive
+        restored = os.path.abspath(tmpdir + "/restored")
+        instance = index.ArchiveIndex(archive)
+        instance.refresh()
+        pybacked.backup.backup(config, index=instance)
+        assert len(instance.archives) == 1
+
+        doc2_path = os.path.abspath(storage + "/subdir/doc2.txt")
+        doc2_file = open(doc2_path, 'ab')
+        doc2_file.write(b"appended line\n")
+        doc2_file.close()
+        pybacked.backup.backup(config, index=instance)
+        assert len(instance.archives) == 2
+        assert instance.find("subdir/doc2.txt")["modtype"] == 'a'
+        diffcache = pybacked.diff.diff_log_deserialize(instance.archives[1])
+        assert list(diffcache.diffdict) == ["subdir/doc2.txt"]
+
+        pybacked.restore.restore(config, "arch2.zip", alt_dir=restored,
+                                 index=instance)
+        doc2_file = open(doc2_path, 'rb')
+        expected = doc2_file.read()
+        doc2_file.close()
+        doc2_file = open(os.path.abspath(restored + "/subdir/doc2.txt"),
+                         'rb')
+        assert doc2_file.read() == expected
+        doc2_file.close()
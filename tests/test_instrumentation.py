@@ -0,0 +1,63 @@
+import pybacked.instrumentation as instrumentation
+
+
+class TestStats:
+    def test_constructor_empty(self):
+        instance = instrumentation.Stats()
+        assert instance.phases == {}
+        assert instance.counters == dict.fromkeys(instrumentation.COUNTERS,
+                                                  0)
+        assert instance.total == 0.0
+
+    def test_add_time(self):
+        instance = instrumentation.Stats()
+        instance.add_time("hash", 1.5)
+        instance.add_time("hash", 0.5)
+        assert instance.phases == {"hash": [2.0, 2]}
+
+    def test_count(self):
+        instance = instrumentation.Stats()
+        instance.count("bytes_hashed", 10)
+        instance.count("bytes_hashed")
+        assert instance.counters["bytes_hashed"] == 11
+
+    def test_phase(self):
+        instance = instrumentation.Stats()
+        with instance.phase("scan"):
+            pass
+        assert instance.phases["scan"][1] == 1
+        assert instance.phases["scan"][0] >= 0
+
+    def test_get_dict(self):
+        instance = instrumentation.Stats(initialphases={"hash": [2.0, 2]},
+                                         initialcounters={"bytes_in": 3})
+        instance.total = 4.0
+        result = instance.get_dict()
+        assert result["total_seconds"] == 4.0
+        assert result["phases"] == {"hash": {"seconds": 2.0, "calls": 2}}
+        assert result["counters"]["bytes_in"] == 3
+
+    def test_equal(self):
+        instance1 = instrumentation.Stats(initialcounters={"bytes_in": 3})
+        instance2 = instrumentation.Stats(initialcounters={"bytes_in": 3})
+        assert instance1 == instance2
+
+
+def test_activate():
+    stats = instrumentation.Stats()
+    with instrumentation.activate(stats):
+        assert instrumentation.current() is stats
+        instrumentation.count("files_stat")
+        with instrumentation.phase("scan"):
+            pass
+    assert instrumentation.current() is None
+    assert stats.counters["files_stat"] == 1
+    assert stats.phases["scan"][1] == 1
+
+
+def test_inactive():
+    # counting and timing without an active Stats object does nothing
+    instrumentation.count("files_stat")
+    with instrumentation.phase("scan"):
+        pass
+    assert instrumentation.current() is None
@@ -69,6 +69,31 @@ def test_create_metadata_string():
     assert result == expected
 
 
+def test_create_metadata_string_stats():
+    timestamp = time.time()
+    stats = {"total_seconds": 1.0, "phases": {}, "counters": {"bytes_in": 1}}
+    metadata = pybacked.logging.MetadataContainer(timestamp=timestamp,
+                                                  stats=stats)
+    expected = "{" + f'"timestamp": {timestamp}, "stats": ' \
+        '{"total_seconds": 1.0, "phases": {}, "counters": {"bytes_in": 1}}}'
+    result = pybacked.logging.create_metadata_string(metadata)
+    assert result == expected
+
+
+def test_create_metadata_string_kind():
+    metadata = pybacked.logging.MetadataContainer(
+        timestamp=1.5, kind=pybacked.ARCHIVE_FULL)
+    expected = '{"timestamp": 1.5, "kind": "full"}'
+    result = pybacked.logging.create_metadata_string(metadata)
+    assert result == expected
+
+
+def test_create_log_rows():
+    rows = [["subdir/doc2.txt", "+", "hash"]]
+    expected = "filename,modtype,diff\r\nsubdir/doc2.txt,+,hash\r\n"
+    assert pybacked.logging.create_log_rows(rows) == expected
+
+
 def test_write_metadata():
     with tempfile.TemporaryDirectory() as tmpdir:
         timestamp = time.time()
@@ -107,6 +132,7 @@ class TestMetadataContainer:
     def test_constructor_empty(self):
         instance = pybacked.logging.MetadataContainer()
         assert instance.timestamp is None
+        assert instance.stats is None
 
     def test_constructor_full(self):
         timestamp = time.time()
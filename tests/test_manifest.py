@@ -0,0 +1,148 @@
+import os
+import pybacked
+import pybacked.backup
+import pybacked.config
+import pybacked.manifest as manifest
+import pybacked.restore
+import shutil
+import tempfile
+import zipfile
+
+
+def test_get_archive_number():
+    assert manifest.get_archive_number("arch1.zip") == 1
+    assert manifest.get_archive_number("arch10042.zip") == 10042
+    assert manifest.get_archive_number("arch1.zip.tmp") is None
+    assert manifest.get_archive_number("test_archive.zip") is None
+
+
+def test_serialize_deserialize():
+    entries = [manifest.ManifestEntry(2, "arch2.zip", 20.5, 200, 2),
+               manifest.ManifestEntry(10, "arch10.zip", None, 100, 1)]
+    result = manifest.deserialize_manifest(
+        manifest.serialize_manifest(entries))
+    assert result == entries
+
+
+def test_write_read_manifest():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        assert manifest.read_manifest(tmpdir) is None
+        assert manifest.read_last_entry(tmpdir) is None
+        manifest.write_manifest(tmpdir, [])
+        assert manifest.read_manifest(tmpdir) == []
+        assert manifest.read_last_entry(tmpdir) is None
+
+        entries = [manifest.ManifestEntry(i, "arch" + str(i) + ".zip",
+                                          float(i), i * 100, i)
+                   for i in range(1, 201)]
+        manifest.write_manifest(tmpdir, entries)
+        assert manifest.read_manifest(tmpdir) == entries
+        # the manifest is larger than the tail block
+        assert manifest.read_last_entry(tmpdir) == entries[-1]
+        assert os.listdir(tmpdir) == [manifest.MANIFEST_NAME]
+
+
+def test_append_entry_upgrade():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # manifest written before the kind column was added
+        file = open(manifest.get_manifest_path(tmpdir), 'w', newline='')
+        file.write("sequence,filename,timestamp,size,members\r\n"
+                   "1,arch1.zip,1.0,100,1\r\n")
+        file.close()
+        entry = manifest.ManifestEntry(2, "arch2.zip", 2.0, 200, 2,
+                                       pybacked.ARCHIVE_FULL)
+        manifest.append_entry(tmpdir, entry)
+        assert manifest.read_header(manifest.get_manifest_path(tmpdir)) == \
+            list(manifest.MANIFEST_FIELDS)
+        assert manifest.read_manifest(tmpdir) == \
+            [manifest.ManifestEntry(1, "arch1.zip", 1.0, 100, 1), entry]
+        assert manifest.read_last_entry(tmpdir) == entry
+
+
+def test_append_entry_rebuild():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        archive = os.path.abspath(tmpdir + "/archive")
+        shutil.copytree(
+            os.path.abspath("./tests/testdata/ext_test/archive"), archive)
+        entry = manifest.ManifestEntry(3, "arch3.zip", 3.0, 300, 3)
+        manifest.append_entry(archive, entry)
+        entries = manifest.read_manifest(archive)
+        assert [item.filename for item in entries] == \
+            ["arch1.zip", "arch2.zip", "arch3.zip"]
+        assert entries[0].members == 1
+        assert entries[0].size == \
+            os.path.getsize(os.path.abspath(archive + "/arch1.zip"))
+        assert entries[2] == entry
+
+
+def test_archive_order():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        storage = os.path.abspath(tmpdir + "/storage")
+        archive = os.path.abspath(tmpdir + "/archive")
+        os.mkdir(storage)
+        os.mkdir(archive)
+        config = pybacked.config.Configuration("manifest", storage, archive,
+                                               pybacked.DIFF_DATE,
+                                               zipfile.ZIP_DEFLATED, 9)
+        for i in range(11):
+            file = open(os.path.abspath(storage + "/doc" + str(i) + ".txt"),
+                        'w')
+            file.write(str(i))
+            file.close()
+            pybacked.backup.backup(config)
+
+        expected = [os.path.abspath(archive + "/arch" + str(i) + ".zip")
+                    for i in range(11, 0, -1)]
+        assert pybacked.restore.get_archive_list(archive) == expected
+        assert manifest.read_last_entry(archive).filename == "arch11.zip"
+        assert manifest.read_last_entry(archive).members == 1
+
+        # without the manifest, the archives are ordered by their number
+        os.remove(manifest.get_manifest_path(archive))
+        assert pybacked.restore.get_archive_list(archive) == expected
+
+
+def test_find_entry_at():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        entries = [manifest.ManifestEntry(1, "arch1.zip", 100.0, 10, 1),
+                   manifest.ManifestEntry(2, "arch2.zip", None, 10, 1),
+                   manifest.ManifestEntry(3, "arch3.zip", 200.0, 10, 1),
+                   manifest.ManifestEntry(4, "arch4.zip", 200.0, 10, 1)]
+        manifest.write_manifest(tmpdir, entries)
+        assert manifest.find_entry_at(tmpdir, 50.0) is None
+        assert manifest.find_entry_at(tmpdir, 100.0).filename == "arch1.zip"
+        assert manifest.find_entry_at(tmpdir, 150.0).filename == "arch1.zip"
+        # the newer of two archives with the same timestamp is found
+        assert manifest.find_entry_at(tmpdir, 250.0).filename == "arch4.zip"
+
+        # the timestamp index is reused until the manifest changes
+        timestamps, dated = manifest.get_timestamp_index(
+            tmpdir, manifest.read_manifest(tmpdir))
+        assert timestamps == [100.0, 200.0, 200.0]
+        assert manifest.get_timestamp_index(
+            tmpdir, manifest.read_manifest(tmpdir))[0] is timestamps
+        manifest.write_manifest(tmpdir, entries[:1])
+        assert manifest.find_entry_at(tmpdir, 250.0).filename == "arch1.zip"
+
+
+def test_reconcile_manifest():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        assert manifest.reconcile_manifest(tmpdir) == []
+        entry = manifest.ManifestEntry(1, "arch1.zip", 1.0, 10, 1)
+        manifest.write_manifest(tmpdir, [entry])
+        archive = zipfile.ZipFile(tmpdir + "/arch3.zip", mode='x')
+        archive.writestr("metadata.json", '{"timestamp": 3.0}')
+        archive.close()
+        file = open(tmpdir + "/arch2.zip", 'wb')
+        file.write(b"truncated")
+        file.close()
+        assert manifest.find_unlisted(tmpdir, [entry]) == \
+            ["arch2.zip", "arch3.zip"]
+        assert not manifest.is_complete(tmpdir + "/arch2.zip")
+
+        assert manifest.reconcile_manifest(tmpdir) == ["arch3.zip"]
+        assert not os.path.exists(tmpdir + "/arch2.zip")
+        entries = manifest.read_manifest(tmpdir)
+        assert [(entry.filename, entry.timestamp) for entry in entries] == \
+            [("arch1.zip", 1.0), ("arch3.zip", 3.0)]
+        assert manifest.reconcile_manifest(tmpdir) == []
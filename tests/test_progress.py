@@ -0,0 +1,85 @@
+import os
+import pybacked
+import pybacked.backup
+import pybacked.config
+import pybacked.progress as progress
+import pybacked.restore
+import tempfile
+import zipfile
+
+
+class TestProgressReporter:
+    def test_rate_limit(self):
+        events = []
+        reporter = progress.ProgressReporter(events.append, interval=3600)
+        reporter.start_phase("scan", files_total=3)
+        reporter.update("a")
+        reporter.update("b")
+        assert events == []
+        reporter.finish_phase()
+        assert len(events) == 1
+        assert events[0].finished
+        assert events[0].files_done == 2
+        assert events[0].path == "b"
+        assert events[0].eta == 0.0
+
+    def test_update_emits(self):
+        events = []
+        reporter = progress.ProgressReporter(events.append, interval=0)
+        reporter.start_phase("archive", files_total=4, bytes_total=400)
+        reporter.update("a", 100)
+        assert len(events) == 1
+        event = events[0]
+        assert event.phase == "archive"
+        assert event.bytes_done == 100
+        assert not event.finished
+        assert event.rate[1] > 0
+        assert event.smoothed_rate == event.rate
+        assert event.eta is not None and event.eta >= 0
+
+    def test_smoothing(self):
+        events = []
+        reporter = progress.ProgressReporter(events.append, interval=3600,
+                                             smoothing=0.5)
+        reporter.start_phase("scan")
+        reporter.smoothed_rate = (10.0, 0.0)
+        reporter.emit(reporter.last_time + 1.0, False)
+        assert events[0].rate == (0.0, 0.0)
+        assert events[0].smoothed_rate == (5.0, 0.0)
+        assert events[0].eta is None
+
+    def test_inactive(self):
+        # the module functions don't fail without an active reporter
+        progress.start_phase("scan")
+        progress.update("a", 1)
+        progress.finish_phase()
+        assert progress.current() is None
+
+
+def test_count_files():
+    storage = os.path.abspath("./tests/testdata/ext_test/storage")
+    assert progress.count_files(storage) == 4
+
+
+def test_backup_restore_progress():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        storage = os.path.abspath("./tests/testdata/ext_test/storage")
+        archive = os.path.abspath(tmpdir + "/archive")
+        restored = os.path.abspath(tmpdir + "/restored")
+        os.mkdir(archive)
+        config = pybacked.config.Configuration("progress", storage, archive,
+                                               pybacked.DIFF_DATE,
+                                               zipfile.ZIP_DEFLATED, 9)
+        events = []
+        pybacked.backup.backup(config, progress=events.append)
+        finished = [event for event in events if event.finished]
+        assert [event.phase for event in finished] == ["scan", "archive"]
+        assert finished[0].files_done == finished[0].files_total == 4
+        assert finished[1].bytes_done == finished[1].bytes_total > 0
+
+        events = []
+        pybacked.restore.restore(config, "arch1.zip", alt_dir=restored,
+                                 progress=events.append)
+        assert events[-1].phase == "restore"
+        assert events[-1].finished
+        assert events[-1].files_done == events[-1].files_total == 4
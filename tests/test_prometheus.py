@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import zipfile
+import pybacked
+import pybacked.backup
+import pybacked.config
+from pybacked import instrumentation
+from pybacked import prometheus
+
+
+def create_stats():
+    stats = instrumentation.Stats(initialcounters={"bytes_in": 100,
+                                                   "bytes_out": 25})
+    stats.add_time("hash", 0.005)
+    stats.add_time("hash", 2.0)
+    stats.count_change('+', 10)
+    stats.count_change('*', 20)
+    stats.total = 3.0
+    return stats
+
+
+def test_escape_label():
+    assert prometheus.escape_label('a"b\\c\nd') == 'a\\"b\\\\c\\nd'
+
+
+def test_format_metrics():
+    result = prometheus.format_metrics("conf", "backup", create_stats(),
+                                       archive_size=50, timestamp=1000.0)
+    lines = result.splitlines()
+    labels = 'config="conf",operation="backup"'
+    assert 'pybacked_phase_duration_seconds_bucket{' + labels + \
+        ',phase="hash",le="0.01"} 1' in lines
+    assert 'pybacked_phase_duration_seconds_bucket{' + labels + \
+        ',phase="hash",le="10.0"} 2' in lines
+    assert 'pybacked_phase_duration_seconds_bucket{' + labels + \
+        ',phase="hash",le="+Inf"} 2' in lines
+    assert 'pybacked_phase_duration_seconds_count{' + labels + \
+        ',phase="hash"} 2' in lines
+    assert 'pybacked_changed_files{' + labels + ',difftype="*"} 1' in lines
+    assert 'pybacked_changed_bytes{' + labels + ',difftype="+"} 10' in lines
+    assert 'pybacked_archive_size_bytes{' + labels + '} 50' in lines
+    assert 'pybacked_compression_ratio{' + labels + '} 4.0' in lines
+    assert 'pybacked_last_success_timestamp_seconds{' + labels + \
+        '} 1000.0' in lines
+    assert lines[-1] == "# EOF"
+
+
+def test_get_textfile_path():
+    result = prometheus.get_textfile_path("/metrics", "my config/1",
+                                          "restore")
+    assert result == os.path.abspath("/metrics/pybacked_my_config_1_"
+                                     "restore.prom")
+
+
+def test_write_textfile():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.abspath(tmpdir + "/test.prom")
+        prometheus.write_textfile(path, "old\n")
+        prometheus.write_textfile(path, "new\n")
+        file = open(path, 'r')
+        content = file.read()
+        file.close()
+        assert content == "new\n"
+        assert os.listdir(tmpdir) == ["test.prom"]
+
+
+def test_backup_export():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        storage = os.path.abspath(tmpdir + "/storage")
+        archive = os.path.abspath(tmpdir + "/archive")
+        metrics = os.path.abspath(tmpdir + "/metrics")
+        shutil.copytree(os.path.abspath("./tests/testdata/full_storage"),
+                        storage)
+        os.mkdir(archive)
+        os.mkdir(metrics)
+        config = pybacked.config.Configuration("test1", storage, archive,
+                                               pybacked.DIFF_DATE,
+                                               zipfile.ZIP_DEFLATED, 9,
+                                               metrics_dir=metrics)
+        pybacked.backup.backup(config)
+
+        path = prometheus.get_textfile_path(metrics, "test1", "backup")
+        file = open(path, 'r')
+        content = file.read()
+        file.close()
+
+    assert 'pybacked_changed_files{config="test1",operation="backup",' \
+        'difftype="+"} 4' in content
@@ -1,14 +1,20 @@
 import hashlib
 import io
 import os
+import pybacked
 import pytest
 import tempfile
 import zipfile
 from pybacked import HASH_SHA256
-from pybacked import DIFF_CONT, DIFF_DATE, DIFF_HASH
+from pybacked import DIFF_CONT, DIFF_DATE, DIFF_HASH, DIFF_STAT
+from pybacked import backup
 from pybacked import config
+from pybacked import hash_cache
+from pybacked import index
+from pybacked import manifest
 from pybacked import restore
 from pybacked import zip_handler
+from helpers import create_config, read_file, write_file
 
 
 def test_get_archive_list():
@@ -20,6 +26,24 @@ def test_get_archive_list():
     assert archive_list == expected_list
 
 
+def test_get_restore_chain():
+    archive_list = ["arch1.zip", "arch2.zip", "arch3.zip", "arch4.zip"]
+    assert restore.get_restore_chain(archive_list, {}, 2) == [0, 1, 2]
+    kinds = {"arch2.zip": pybacked.ARCHIVE_FULL}
+    assert restore.get_restore_chain(archive_list, kinds, 3) == [1, 2, 3]
+    assert restore.get_restore_chain(archive_list, kinds, 1) == [1]
+    assert restore.get_restore_chain(archive_list, kinds, 0) == [0]
+
+    kinds = {"arch1.zip": pybacked.ARCHIVE_REVERSE,
+             "arch2.zip": pybacked.ARCHIVE_REVERSE,
+             "arch3.zip": pybacked.ARCHIVE_FULL}
+    assert restore.get_restore_chain(archive_list, kinds, 2) == [2]
+    assert restore.get_restore_chain(archive_list, kinds, 0) == [2, 1, 0]
+    assert restore.get_restore_chain(archive_list, kinds, 3) == [2, 3]
+    with pytest.raises(ValueError):
+        restore.get_restore_chain(archive_list[:2], kinds, 1)
+
+
 def test_find_diff_success():
     log_path = os.path.abspath("./tests/testdata/diff-log.csv")
     filename = "test_sample1.txt"
@@ -94,6 +118,84 @@ def test_get_file_hash():
     assert restore.get_file_hash(filepath, HASH_SHA256) == expected_hash
 
 
+def test_get_file_hash_mmap(monkeypatch):
+    # force the memory mapped path with chunks smaller than the file
+    monkeypatch.setattr(pybacked, "MMAP_THRESHOLD", 1)
+    monkeypatch.setattr(pybacked, "HASH_CHUNK_SIZE", 7)
+    filepath = os.path.abspath(
+        "./tests/testdata/archive_hash/test_sample1.txt")
+    file = io.open(filepath, "rb")
+    content = file.read()
+    file.close()
+    expected_hash = hashlib.sha256(content).hexdigest()
+    expected_prefix = hashlib.sha256(content[:10]).hexdigest()
+    assert restore.get_file_hash(filepath, HASH_SHA256) == expected_hash
+    assert restore.get_file_hash(filepath, HASH_SHA256,
+                                 length=10) == expected_prefix
+
+
+def test_get_file_hash_length():
+    filepath = os.path.abspath(
+        "./tests/testdata/archive_hash/test_sample1.txt")
+    file = io.open(filepath, "rb")
+    expected_hash = hashlib.sha256(file.read(10)).hexdigest()
+    file.close()
+    assert restore.get_file_hash(filepath, HASH_SHA256,
+                                 length=10) == expected_hash
+
+
+@pytest.mark.parametrize("threshold", [pybacked.MMAP_THRESHOLD, 1])
+def test_compare_file_content(monkeypatch, threshold):
+    monkeypatch.setattr(pybacked, "MMAP_THRESHOLD", threshold)
+    monkeypatch.setattr(pybacked, "HASH_CHUNK_SIZE", 7)
+    filepath = os.path.abspath("./tests/testdata/test_sample1.txt")
+    content = restore.get_file_content(filepath)
+    changed = content[:-1] + bytes([content[-1] ^ 1])
+    assert restore.compare_file_content(filepath, content)
+    assert not restore.compare_file_content(filepath, changed)
+    assert not restore.compare_file_content(filepath, content + b"x")
+    assert not restore.compare_file_content(filepath, None)
+
+
+def test_get_sample_hash_small():
+    # files smaller than three sample blocks are hashed completely
+    filepath = os.path.abspath(
+        "./tests/testdata/archive_hash/test_sample1.txt")
+    expected_hash = restore.get_file_hash(filepath, HASH_SHA256)
+    assert restore.get_sample_hash(filepath, HASH_SHA256) == expected_hash
+
+
+def test_get_sample_hash_large():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filepath = os.path.abspath(tmpdir + "/large.bin")
+        file = open(filepath, 'wb')
+        file.write(b"a" * 4 + b"b" * 4 + b"c" * 4)
+        file.close()
+        hash_handler = hashlib.sha256(b"aa" + b"bb" + b"cc")
+        expected_hash = hash_handler.hexdigest()
+        result = restore.get_sample_hash(filepath, HASH_SHA256, block_size=2)
+    assert result == expected_hash
+
+
+def test_get_tiered_hash():
+    filepath = os.path.abspath(
+        "./tests/testdata/archive_hash/test_sample1.txt")
+    size = os.path.getsize(filepath)
+    sample = restore.get_sample_hash(filepath, HASH_SHA256)
+    full_hash = restore.get_file_hash(filepath, HASH_SHA256)
+
+    # a valid cache entry is returned without computing the full hash
+    cache = hash_cache.HashCache(60)
+    cache.update(filepath, size, sample, "cached", HASH_SHA256)
+    assert restore.get_tiered_hash(filepath, HASH_SHA256, cache) == "cached"
+
+    # an expired cache entry is verified and replaced by the full hash
+    cache = hash_cache.HashCache(0)
+    cache.update(filepath, size, sample, "cached", HASH_SHA256)
+    assert restore.get_tiered_hash(filepath, HASH_SHA256, cache) == full_hash
+    assert cache.entries[filepath][2] == full_hash
+
+
 def test_get_edit_date():
     filepath = os.path.abspath("./tests/testdata/test_sample1.txt")
     expected_time = os.path.getmtime(filepath)
@@ -132,6 +234,26 @@ def test_get_arch_state_hash():
     assert result == expected_hash
 
 
+def test_get_stat_state():
+    filepath = os.path.abspath("./tests/testdata/test_sample1.txt")
+    stat_result = os.stat(filepath)
+    expected = f"{stat_result.st_size}:{stat_result.st_mtime_ns}:" \
+               f"{stat_result.st_ctime_ns}:{stat_result.st_ino}"
+    assert restore.get_stat_state(filepath) == expected
+
+
+def test_get_stat_state_none():
+    filepath = os.path.abspath("./tests/testdata/non-existent-file.txt")
+    assert restore.get_stat_state(filepath) is None
+    assert restore.get_stat_state(os.path.abspath("./tests/testdata")) is None
+
+
+def test_get_current_state_stat():
+    filepath = os.path.abspath("./tests/testdata/test_sample1.txt")
+    expected = restore.get_stat_state(filepath)
+    assert restore.get_current_state(filepath, DIFF_STAT) == expected
+
+
 def test_get_file_content():
     filepath = os.path.abspath("./tests/testdata/test_sample1.txt")
 
@@ -190,6 +312,103 @@ def test_restore_archive_state():
         assert doc3_zip.encode() == doc3_content
 
 
+def create_fetch_config(tmpdir, reverse_incremental=False):
+    configuration = create_config(tmpdir, "fetch", detect_append=True,
+                                  reverse_incremental=reverse_incremental)
+    storage = configuration.storage
+    originals = dict()
+    for number in range(3):
+        if number > 0:
+            write_file(storage + "/subdir/doc2.txt",
+                       "tail " + str(number) + "\n", 'a')
+        if number == 1:
+            write_file(storage + "/new.txt", "new file")
+        originals["arch" + str(number + 1) + ".zip"] = read_file(
+            storage + "/subdir/doc2.txt")
+        backup.backup(configuration)
+    return configuration, originals
+
+
+def test_fetch():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        configuration, originals = create_fetch_config(tmpdir)
+        archive_index = index.ArchiveIndex(configuration.archive)
+        archive_index.refresh()
+        dest = os.path.abspath(tmpdir + "/fetched")
+        for used_index in (None, archive_index):
+            for archname, content in originals.items():
+                result = restore.fetch(configuration, "subdir/doc2.txt",
+                                       archname, dest, used_index)
+                assert result.status == restore.FETCH_RESTORED
+                assert result.size == len(content)
+                assert read_file(dest) == content
+            # the appended tails are read from every archive since the base
+            result = restore.fetch(configuration, "subdir/doc2.txt",
+                                   dest=dest, index=used_index)
+            assert result.archives == [configuration.archive + "/arch" +
+                                       str(number) + ".zip"
+                                       for number in (1, 2, 3)]
+
+            result = restore.fetch(configuration, "new.txt", "arch1.zip",
+                                   dest, used_index)
+            assert result.status == restore.FETCH_MISSING
+            assert result.archives == []
+
+        # by default the file is restored to the storage directory
+        os.remove(configuration.storage + "/doc1.txt")
+        result = restore.fetch(configuration,
+                               configuration.storage + "/doc1.txt")
+        assert result.filename == "doc1.txt"
+        assert result.destination == configuration.storage + "/doc1.txt"
+        assert os.path.isfile(configuration.storage + "/doc1.txt")
+
+
+def test_fetch_failed(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        configuration, originals = create_fetch_config(tmpdir)
+        current = configuration.storage + "/subdir/doc2.txt"
+        content = read_file(current)
+
+        def failing(*args):
+            raise OSError("read error")
+
+        monkeypatch.setattr(zip_handler, "append_archdata", failing)
+        with pytest.raises(OSError):
+            restore.fetch(configuration, "subdir/doc2.txt")
+        # the current file is kept and no partial file is left behind
+        assert read_file(current) == content
+        assert sorted(os.listdir(configuration.storage + "/subdir")) == \
+            ["doc2.txt", "doc3.txt", "subdir"]
+
+
+def test_fetch_empty():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        configuration = config.Configuration(
+            "fetch", tmpdir, tmpdir, DIFF_HASH, zipfile.ZIP_DEFLATED, 9,
+            HASH_SHA256)
+        archive_index = index.ArchiveIndex(tmpdir)
+        archive_index.refresh()
+        for used_index in (None, archive_index):
+            result = restore.fetch(configuration, "doc1.txt",
+                                   index=used_index)
+            assert result.status == restore.FETCH_MISSING
+            assert result.archives == []
+
+
+def test_fetch_deleted():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        configuration, originals = create_fetch_config(tmpdir, True)
+        dest = os.path.abspath(tmpdir + "/fetched")
+        # the reverse delta of arch1 removes the file added afterwards
+        result = restore.fetch(configuration, "new.txt", "arch1.zip", dest)
+        assert result.status == restore.FETCH_DELETED
+        assert result.archives == [configuration.archive + "/arch1.zip"]
+        assert not os.path.exists(dest)
+        result = restore.fetch(configuration, "subdir/doc2.txt", "arch1.zip",
+                               dest)
+        assert read_file(dest) == originals["arch1.zip"]
+
+
 class TestRestore:
     def test_restore_orig_dir(self):
         # test pybacked.restore.restore for original source directory
@@ -268,3 +487,49 @@ class TestRestore:
 
             assert doc1_zip.encode() == doc1_content
             assert doc3_zip.encode() == doc3_content
+
+    def test_restore_stats(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            archive = os.path.abspath("./tests/testdata/ext_test/archive")
+            configuration = config.Configuration("testconfig1", "storage",
+                                                 archive, DIFF_DATE,
+                                                 zipfile.ZIP_DEFLATED, 9)
+            stats = restore.restore(configuration, "arch2.zip",
+                                    alt_dir=tmpdir)
+        assert stats.changes['+'][0] == 2
+        assert stats.phases["extract"][1] == 2
+
+
+def test_restore_at():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        configuration, originals = create_fetch_config(tmpdir)
+        entries = manifest.read_manifest(configuration.archive)
+        assert restore.get_archive_at(configuration,
+                                      entries[1].timestamp) == "arch2.zip"
+        assert restore.get_archive_at(configuration,
+                                      entries[2].timestamp + 3600) == \
+            "arch3.zip"
+        with pytest.raises(ValueError):
+            restore.get_archive_at(configuration, entries[0].timestamp - 1)
+
+        restore_dir = os.path.abspath(tmpdir + "/restored")
+        restore.restore_at(configuration, entries[0].timestamp,
+                           alt_dir=restore_dir)
+        assert read_file(restore_dir + "/subdir/doc2.txt") == \
+            originals["arch1.zip"]
+        assert not os.path.exists(restore_dir + "/new.txt")
+
+        dest = os.path.abspath(tmpdir + "/fetched")
+        result = restore.fetch_at(configuration, "subdir/doc2.txt",
+                                  entries[1].timestamp, dest)
+        assert result.status == restore.FETCH_RESTORED
+        assert read_file(dest) == originals["arch2.zip"]
+
+
+def test_restore_entry_unknown_modtype():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        destination = os.path.abspath(tmpdir + "/doc1.txt")
+        # the row is skipped without touching the archive or destination
+        restore.restore_entry(tmpdir + "/missing.zip", "data/doc1.txt",
+                              destination, '?')
+        assert not os.path.exists(destination)
@@ -0,0 +1,224 @@
+import os
+import pybacked
+import pybacked.backup
+import pybacked.consolidate
+import pybacked.manifest
+import pybacked.restore
+import pybacked.retention as retention
+import pytest
+import tempfile
+from helpers import create_config, read_tree, restore_tree, write_file
+
+# 2024-01-15 12:00:00 UTC
+NOW = 1705320000.0
+HOUR = 3600
+DAY = 86400
+
+
+def create_archives(tmpdir, ages, reverse_incremental=False):
+    """
+    Create an archive directory with one archive per age (in seconds before
+    NOW). Each backup edits, appends to, adds and removes files.
+    """
+    config = create_config(tmpdir, "retention", detect_append=True,
+                           reverse_incremental=reverse_incremental)
+    storage = config.storage
+    for number in range(len(ages)):
+        if number > 0:
+            write_file(storage + "/doc1.txt", "edit " + str(number))
+            write_file(storage + "/subdir/doc2.txt", "tail\n", 'a')
+            write_file(storage + "/new" + str(number) + ".txt", "new")
+            if number > 1:
+                os.remove(storage + "/new" + str(number - 1) + ".txt")
+        pybacked.backup.backup(config)
+    entries = pybacked.manifest.read_manifest(config.archive)
+    for entry, age in zip(entries, ages):
+        entry.timestamp = NOW - age
+    pybacked.manifest.write_manifest(config.archive, entries)
+    return config
+
+
+def restore_all(config, tmpdir, names):
+    trees = dict()
+    for name in names:
+        trees[name] = restore_tree(config, tmpdir, name)
+    return trees
+
+
+def test_get_bucket():
+    assert retention.get_bucket(NOW, "hour") == (2024, 1, 15, 12)
+    assert retention.get_bucket(NOW, "day") == (2024, 1, 15)
+    assert retention.get_bucket(NOW, "week") == (2024, 3)
+    assert retention.get_bucket(NOW, "month") == (2024, 1)
+    assert retention.get_bucket(NOW, "year") == (2024,)
+    with pytest.raises(ValueError):
+        retention.get_bucket(NOW, "fortnight")
+
+
+def test_select_archives():
+    ages = [90 * DAY, 60 * DAY, 59 * DAY, 10 * DAY, 10 * DAY - HOUR,
+            2 * HOUR, HOUR + 60, HOUR, 0]
+    entries = [pybacked.manifest.ManifestEntry(
+        number + 1, "arch" + str(number + 1) + ".zip", NOW - age, 0, 0)
+        for number, age in enumerate(ages)]
+    kept = retention.select_archives(entries, retention.DEFAULT_RULES, NOW)
+    # arch3 is the newest of its month, arch2 the newest of the month before,
+    # arch4 and arch5 share a day, arch6 and arch7 share an hour
+    assert kept == {"arch1.zip", "arch3.zip", "arch5.zip", "arch7.zip",
+                    "arch8.zip", "arch9.zip"}
+
+    entries.insert(0, pybacked.manifest.ManifestEntry(0, "legacy.zip", None,
+                                                      0, 0))
+    kept = retention.select_archives(entries, {}, NOW)
+    assert kept == {"legacy.zip", "arch9.zip"}
+
+
+def test_get_groups():
+    entries = [pybacked.manifest.ManifestEntry(
+        number, "arch" + str(number) + ".zip", NOW, 0, 0)
+        for number in range(1, 6)]
+    groups = retention.get_groups(entries, {"arch3.zip", "arch5.zip"})
+    assert [[entry.sequence for entry in group] for group in groups] == \
+        [[1, 2, 3], [4, 5]]
+
+
+def test_get_groups_reverse():
+    kinds = [pybacked.ARCHIVE_INCREMENTAL, pybacked.ARCHIVE_REVERSE,
+             pybacked.ARCHIVE_REVERSE, pybacked.ARCHIVE_REVERSE,
+             pybacked.ARCHIVE_FULL]
+    entries = [pybacked.manifest.ManifestEntry(
+        number + 1, "arch" + str(number + 1) + ".zip", NOW, 0, 0, kind)
+        for number, kind in enumerate(kinds)]
+    # reverse deltas are folded into the previous kept reverse delta, the
+    # incremental archive before them isn't needed by any kept archive
+    groups = retention.get_groups(entries, {"arch2.zip", "arch5.zip"})
+    assert [[entry.sequence for entry in group] for group in groups] == \
+        [[4, 3, 2]]
+    groups = retention.get_groups(entries, {"arch3.zip", "arch5.zip"})
+    assert [[entry.sequence for entry in group] for group in groups] == \
+        [[4, 3]]
+    # the full archive the reverse deltas step back from is kept
+    kept = retention.select_archives(entries + [
+        pybacked.manifest.ManifestEntry(6, "arch6.zip", NOW, 0, 0)], {}, NOW)
+    assert kept == {"arch5.zip", "arch6.zip"}
+
+
+def test_apply_retention():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = create_archives(tmpdir, [3 * DAY, 3 * DAY - 60,
+                                          2 * DAY, 2 * DAY - 60, 0])
+        expected = restore_all(config, tmpdir, ["arch2.zip", "arch4.zip",
+                                                "arch5.zip"])
+        result = retention.apply_retention(config, {"day": None}, NOW)
+        assert result.kept == ["arch2.zip", "arch4.zip", "arch5.zip"]
+        assert result.pruned == ["arch1.zip", "arch3.zip"]
+        assert result.reclaimed > 0
+        assert sorted(os.listdir(config.archive)) == \
+            ["arch2.zip", "arch4.zip", "arch5.zip",
+             pybacked.manifest.MANIFEST_NAME]
+        assert pybacked.restore.get_archive_list(config.archive) == \
+            [os.path.abspath(config.archive + "/" + name)
+             for name in ["arch5.zip", "arch4.zip", "arch2.zip"]]
+        entries = pybacked.manifest.read_manifest(config.archive)
+        assert [entry.timestamp for entry in entries] == \
+            [NOW - 3 * DAY + 60, NOW - 2 * DAY + 60, NOW]
+        assert restore_all(config, tmpdir, expected) == expected
+
+        # the numbering continues after the newest archive
+        pybacked.backup.backup(config)
+        assert os.path.isfile(config.archive + "/arch6.zip")
+
+
+def test_apply_retention_interrupted(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = create_archives(tmpdir, [3 * DAY, 3 * DAY - 60,
+                                          2 * DAY, 2 * DAY - 60, 0])
+        expected = restore_all(config, tmpdir, ["arch2.zip", "arch4.zip",
+                                                "arch5.zip"])
+        write_manifest = pybacked.manifest.write_manifest
+
+        def killed(archive_dir, entries):
+            raise KeyboardInterrupt()
+
+        # killed after the journal was written, before anything changed
+        monkeypatch.setattr(pybacked.manifest, "write_manifest", killed)
+        with pytest.raises(KeyboardInterrupt):
+            retention.apply_retention(config, {"day": None}, NOW)
+        monkeypatch.setattr(pybacked.manifest, "write_manifest",
+                            write_manifest)
+        assert os.path.isfile(
+            pybacked.manifest.get_journal_path(config.archive))
+
+        # the next run completes the change
+        result = retention.apply_retention(config, {"day": None}, NOW)
+        assert result.pruned == []
+        assert sorted(os.listdir(config.archive)) == \
+            ["arch2.zip", "arch4.zip", "arch5.zip",
+             pybacked.manifest.MANIFEST_NAME]
+        assert restore_all(config, tmpdir, expected) == expected
+
+
+def test_apply_retention_fold_failed(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = create_archives(tmpdir, [3 * DAY, 3 * DAY - 60,
+                                          2 * DAY, 2 * DAY - 60, 0])
+        before = read_tree(config.archive)
+        write_archive = pybacked.consolidate.write_archive
+        calls = []
+
+        def failing(*args):
+            calls.append(args)
+            if len(calls) == 2:
+                raise OSError("disk full")
+            write_archive(*args)
+
+        # the second group fails, the first one isn't committed either
+        monkeypatch.setattr(pybacked.consolidate, "write_archive", failing)
+        with pytest.raises(OSError):
+            retention.apply_retention(config, {"day": None}, NOW)
+        assert read_tree(config.archive) == before
+
+
+def test_apply_retention_full():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = create_archives(tmpdir, [3 * DAY, 2 * DAY, DAY, 0])
+        pybacked.consolidate.consolidate(config, "arch2.zip")
+        expected = restore_all(config, tmpdir, ["arch3.zip", "arch4.zip"])
+        result = retention.apply_retention(config, {"day": DAY}, NOW)
+        assert result.pruned == ["arch1.zip", "arch2.zip"]
+        entries = pybacked.manifest.read_manifest(config.archive)
+        # the full archive was folded into its successor
+        assert [entry.kind for entry in entries] == \
+            [pybacked.ARCHIVE_FULL, pybacked.ARCHIVE_INCREMENTAL]
+        assert restore_all(config, tmpdir, expected) == expected
+
+
+def test_apply_retention_reverse():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = create_archives(tmpdir, [400 * DAY, 3 * DAY, 2 * DAY, DAY,
+                                          0], reverse_incremental=True)
+        expected = restore_all(config, tmpdir, ["arch1.zip", "arch5.zip"])
+
+        result = retention.apply_retention(config, {"year": None}, NOW)
+        assert result.kept == ["arch1.zip", "arch5.zip"]
+        entries = pybacked.manifest.read_manifest(config.archive)
+        assert [entry.kind for entry in entries] == \
+            [pybacked.ARCHIVE_REVERSE, pybacked.ARCHIVE_FULL]
+        assert restore_all(config, tmpdir, expected) == expected
+
+
+def test_apply_retention_dry_run():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = create_archives(tmpdir, [2 * DAY, DAY, 0])
+        before = read_tree(config.archive)
+        result = retention.apply_retention(config, {}, NOW, dry_run=True)
+        assert result.dry_run
+        assert result.pruned == ["arch1.zip", "arch2.zip"]
+        assert result.reclaimed > 0
+        assert read_tree(config.archive) == before
+
+        estimate = result.reclaimed
+        result = retention.apply_retention(config, {}, NOW)
+        assert result.pruned == ["arch1.zip", "arch2.zip"]
+        # the dry run doesn't account for the rewritten diff-logs
+        assert abs(result.reclaimed - estimate) < 1024
@@ -0,0 +1,180 @@
+import os
+import pybacked
+import pybacked.backup
+import pybacked.diff
+import pybacked.index
+import pybacked.manifest
+import pybacked.reverse as reverse
+import pytest
+import tempfile
+from helpers import create_config, read_tree, restore_tree, write_file
+
+
+def create_reverse_config(tmpdir):
+    return create_config(tmpdir, "reverse", detect_append=True,
+                         reverse_incremental=True)
+
+
+def run_backups(config, index=None):
+    """
+    Back up the storage three times, editing, appending to, adding and
+    removing files in between. Returns the storage tree of every backup.
+    """
+    trees = []
+    pybacked.backup.backup(config, index=index)
+    trees.append(read_tree(config.storage))
+    write_file(config.storage + "/doc1.txt", "edited content")
+    write_file(config.storage + "/subdir/doc2.txt", "tail\n", 'a')
+    write_file(config.storage + "/new.txt", "new file")
+    pybacked.backup.backup(config, index=index)
+    trees.append(read_tree(config.storage))
+    os.remove(config.storage + "/subdir/doc3.txt")
+    os.remove(config.storage + "/new.txt")
+    write_file(config.storage + "/subdir/doc2.txt", "second tail\n", 'a')
+    pybacked.backup.backup(config, index=index)
+    trees.append(read_tree(config.storage))
+    return trees
+
+
+def test_get_changes():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = create_reverse_config(tmpdir)
+        diffcache = pybacked.diff.collect(config.storage, config.archive,
+                                          config.diff_algorithm,
+                                          config.hash_algorithm)
+        changes = reverse.get_changes(diffcache)
+        assert sorted(changes) == ["doc1.txt", "subdir/doc2.txt",
+                                   "subdir/doc3.txt",
+                                   "subdir/subdir/doc4.txt"]
+        assert changes["doc1.txt"].difftype == '+'
+
+
+def test_get_base():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = create_reverse_config(tmpdir)
+        assert reverse.get_base(config.archive) is None
+        pybacked.backup.backup(config)
+        assert reverse.get_base(config.archive).filename == "arch1.zip"
+
+        config.reverse_incremental = False
+        write_file(config.storage + "/doc1.txt", "edited content")
+        pybacked.backup.backup(config)
+        assert reverse.get_base(config.archive) is None
+
+
+def test_reverse_backup():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = create_reverse_config(tmpdir)
+        trees = run_backups(config)
+        entries = pybacked.manifest.read_manifest(config.archive)
+        assert [entry.filename for entry in entries] == \
+            ["arch1.zip", "arch2.zip", "arch3.zip"]
+        assert [entry.kind for entry in entries] == \
+            [pybacked.ARCHIVE_REVERSE, pybacked.ARCHIVE_REVERSE,
+             pybacked.ARCHIVE_FULL]
+        assert sorted(os.listdir(config.archive)) == \
+            ["arch1.zip", "arch2.zip", "arch3.zip",
+             pybacked.manifest.MANIFEST_NAME]
+
+        # the newest archive holds the complete state
+        log = reverse.get_log(config.archive + "/arch3.zip")
+        assert sorted(log) == ["doc1.txt", "subdir/doc2.txt",
+                               "subdir/subdir/doc4.txt"]
+        assert entries[2].members == 3
+        # the reverse delta only steps back one version
+        log = reverse.get_log(config.archive + "/arch2.zip")
+        assert {filename: diff.difftype for filename, diff in log.items()} \
+            == {"subdir/doc2.txt": '*', "subdir/doc3.txt": '+',
+                "new.txt": '+'}
+        log = reverse.get_log(config.archive + "/arch1.zip")
+        assert {filename: diff.difftype for filename, diff in log.items()} \
+            == {"doc1.txt": '*', "subdir/doc2.txt": '*', "new.txt": '-'}
+
+        for number, tree in enumerate(trees):
+            assert restore_tree(config, tmpdir,
+                                "arch" + str(number + 1) + ".zip") == tree
+
+        # unchanged files aren't archived again
+        write_file(config.storage + "/doc1.txt", "edited again")
+        pybacked.backup.backup(config)
+        log = reverse.get_log(config.archive + "/arch3.zip")
+        assert list(log) == ["doc1.txt"]
+
+
+def test_reverse_backup_index():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = create_reverse_config(tmpdir)
+        index = pybacked.index.ArchiveIndex(config.archive)
+        trees = run_backups(config, index)
+        fresh = pybacked.index.ArchiveIndex(config.archive)
+        fresh.refresh()
+        assert index.signature == fresh.signature
+        assert index.kinds == fresh.kinds
+        for number, tree in enumerate(trees):
+            assert restore_tree(config, tmpdir,
+                                "arch" + str(number + 1) + ".zip") == tree
+
+
+def test_reverse_backup_interrupted(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = create_reverse_config(tmpdir)
+        pybacked.backup.backup(config)
+        first = read_tree(config.storage)
+        write_file(config.storage + "/doc1.txt", "edited content")
+        write_file(config.storage + "/new.txt", "new file")
+        replace = os.replace
+
+        def killed(source, destination):
+            if destination.endswith("arch1.zip"):
+                raise KeyboardInterrupt()
+            replace(source, destination)
+
+        # killed after the manifest was written, before the delta replaced
+        # the previous full archive
+        monkeypatch.setattr(os, "replace", killed)
+        with pytest.raises(KeyboardInterrupt):
+            pybacked.backup.backup(config)
+        monkeypatch.setattr(os, "replace", replace)
+        assert pybacked.manifest.read_manifest(config.archive)[0].kind == \
+            pybacked.ARCHIVE_REVERSE
+        second = read_tree(config.storage)
+        # a stale delta of a backup killed before the commit
+        write_file(config.archive + "/.reverse-stale.tmp", "stale")
+
+        # the next backup completes the commit and removes the stale delta
+        write_file(config.storage + "/doc1.txt", "edited again")
+        pybacked.backup.backup(config)
+        entries = pybacked.manifest.read_manifest(config.archive)
+        assert [entry.kind for entry in entries] == \
+            [pybacked.ARCHIVE_REVERSE, pybacked.ARCHIVE_REVERSE,
+             pybacked.ARCHIVE_FULL]
+        assert sorted(os.listdir(config.archive)) == \
+            ["arch1.zip", "arch2.zip", "arch3.zip",
+             pybacked.manifest.MANIFEST_NAME]
+        assert restore_tree(config, tmpdir, "arch1.zip") == first
+        assert restore_tree(config, tmpdir, "arch2.zip") == second
+        assert restore_tree(config, tmpdir, "arch3.zip") == \
+            read_tree(config.storage)
+
+
+def test_reverse_after_incremental():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = create_reverse_config(tmpdir)
+        config.reverse_incremental = False
+        pybacked.backup.backup(config)
+        first = read_tree(config.storage)
+        write_file(config.storage + "/doc1.txt", "edited content")
+        config.reverse_incremental = True
+        pybacked.backup.backup(config)
+        second = read_tree(config.storage)
+        write_file(config.storage + "/new.txt", "new file")
+        pybacked.backup.backup(config)
+
+        entries = pybacked.manifest.read_manifest(config.archive)
+        assert [entry.kind for entry in entries] == \
+            [pybacked.ARCHIVE_INCREMENTAL, pybacked.ARCHIVE_REVERSE,
+             pybacked.ARCHIVE_FULL]
+        assert restore_tree(config, tmpdir, "arch1.zip") == first
+        assert restore_tree(config, tmpdir, "arch2.zip") == second
+        assert restore_tree(config, tmpdir, "arch3.zip") == \
+            read_tree(config.storage)
@@ -0,0 +1,60 @@
+import os
+import pybacked
+import pybacked.config
+import pybacked.scheduler as scheduler
+import tempfile
+import zipfile
+
+
+def create_config(name, storage, archive):
+    return pybacked.config.Configuration(name, storage, archive,
+                                         pybacked.DIFF_DATE,
+                                         zipfile.ZIP_DEFLATED, 9)
+
+
+def test_get_device_missing():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        missing = os.path.abspath(tmpdir + "/missing/archive")
+        assert scheduler.get_device(missing) == os.stat(tmpdir).st_dev
+
+
+def test_group_by_device(monkeypatch):
+    devices = {"/a": 1, "/b": 2, "/c": 3, "/d": 4, "/e": 5}
+    monkeypatch.setattr(scheduler, "get_device", devices.get)
+    configs = [create_config("1", "/a", "/b"),
+               create_config("2", "/c", "/d"),
+               create_config("3", "/b", "/e"),
+               create_config("4", "/d", "/d")]
+    groups = scheduler.group_by_device(configs)
+    names = [[config.name for config in group] for group in groups]
+    assert names == [["1", "3"], ["2", "4"]]
+
+
+def test_run():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        storage = os.path.abspath("./tests/testdata/ext_test/storage")
+        configs = []
+        for i in range(3):
+            archive = os.path.abspath(tmpdir + "/archive" + str(i))
+            os.mkdir(archive)
+            configs.append(create_config("config" + str(i), storage,
+                                         archive))
+        # the archive directory of the last configuration is missing
+        configs[2].archive = os.path.abspath(tmpdir + "/missing/archive")
+        config_path = os.path.abspath(tmpdir + "/config.json")
+        pybacked.config.write_config(configs, config_path)
+
+        results, total = scheduler.run_config_file(config_path)
+        assert [result.config.name for result in results] == \
+            ["config0", "config1", "config2"]
+        assert results[0].error is None
+        assert results[0].stats.changes['+'][0] == 4
+        assert results[2].error is not None
+        assert total >= results[0].seconds
+
+        summary = scheduler.format_summary(results, total)
+        lines = summary.splitlines()
+        assert lines[0].startswith("config0")
+        assert lines[0].endswith("ok")
+        assert "failed" in lines[2]
+        assert lines[3].startswith("total")
@@ -0,0 +1,170 @@
+import os
+import pybacked
+import pybacked.backup
+import pybacked.config
+import pybacked.index
+import pybacked.manifest
+import pybacked.snapshot as snapshot
+import pytest
+import tempfile
+import zipfile
+from helpers import create_config, read_file, write_file
+
+
+def create_archives(tmpdir):
+    """
+    Create an archive directory with two archives. The second archive edits
+    doc1.txt, appends to doc2.txt and adds new/new.txt.
+    """
+    config = create_config(tmpdir, "snapshot", detect_append=True)
+    storage = config.storage
+    pybacked.backup.backup(config)
+    write_file(storage + "/doc1.txt", "edited content")
+    write_file(storage + "/subdir/doc2.txt", "tail\n", 'a')
+    os.mkdir(storage + "/new")
+    write_file(storage + "/new/new.txt", "new file")
+    pybacked.backup.backup(config)
+    return config
+
+
+def test_normalize_path():
+    assert snapshot.normalize_path("") == ""
+    assert snapshot.normalize_path("/") == ""
+    assert snapshot.normalize_path(".") == ""
+    assert snapshot.normalize_path("./subdir/") == "subdir"
+    assert snapshot.normalize_path("subdir\\doc2.txt") == "subdir/doc2.txt"
+
+
+def test_snapshot():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = create_archives(tmpdir)
+        with snapshot.Snapshot(config) as view:
+            assert view.listdir() == ["doc1.txt", "new", "subdir"]
+            assert view.listdir("subdir") == ["doc2.txt", "doc3.txt",
+                                              "subdir"]
+            with pytest.raises(NotADirectoryError):
+                view.listdir("doc1.txt")
+            with pytest.raises(FileNotFoundError):
+                view.listdir("missing")
+
+            for path in ("doc1.txt", "subdir/doc2.txt", "new/new.txt"):
+                file = view.open(path)
+                assert file.read() == read_file(config.storage + "/" + path)
+                file.close()
+                status = view.stat(path)
+                assert not status.is_dir
+                assert status.size == \
+                    os.path.getsize(config.storage + "/" + path)
+            # the appended file is streamed from both archives
+            assert view.stat("subdir/doc2.txt").archives == \
+                [config.archive + "/arch1.zip", config.archive + "/arch2.zip"]
+            file = view.open("subdir/doc2.txt", 'r', encoding="UTF-8")
+            assert file.read().endswith("tail\n")
+            file.close()
+
+            assert view.stat("subdir").is_dir
+            assert view.exists("new/new.txt")
+            assert not view.exists("missing.txt")
+            with pytest.raises(FileNotFoundError):
+                view.open("missing.txt")
+            with pytest.raises(IsADirectoryError):
+                view.open("subdir")
+            with pytest.raises(ValueError):
+                view.open("doc1.txt", 'w')
+
+            assert list(view.walk()) == [
+                ("", ["new", "subdir"], ["doc1.txt"]),
+                ("new", [], ["new.txt"]),
+                ("subdir", ["subdir"], ["doc2.txt", "doc3.txt"]),
+                ("subdir/subdir", [], ["doc4.txt"])]
+
+
+def test_snapshot_old_state():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = create_archives(tmpdir)
+        index = pybacked.index.ArchiveIndex(config.archive)
+        index.refresh()
+        for used_index in (None, index):
+            with snapshot.Snapshot(config, "arch1.zip", used_index) as view:
+                assert view.listdir() == ["doc1.txt", "subdir"]
+                assert not view.exists("new/new.txt")
+                file = view.open("doc1.txt")
+                assert file.read() != b"edited content"
+                file.close()
+                # only the diff-log of the snapshot archive is read
+                assert list(view.logs) == [config.archive + "/arch1.zip"]
+
+
+def test_snapshot_resolve_cached():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = create_archives(tmpdir)
+        view = snapshot.Snapshot(config)
+        # the newest archive holds doc1.txt, older logs aren't read
+        assert view.resolve("doc1.txt") == [config.archive + "/arch2.zip"]
+        assert list(view.logs) == [config.archive + "/arch2.zip"]
+        assert view.resolved["doc1.txt"] == [config.archive + "/arch2.zip"]
+        assert view.resolve("subdir/doc3.txt") == \
+            [config.archive + "/arch1.zip"]
+        assert view.resolve("missing.txt") is None
+        view.close()
+
+
+def test_compare():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = create_archives(tmpdir)
+        os.remove(config.storage + "/subdir/doc3.txt")
+        pybacked.backup.backup(config)
+        index = pybacked.index.ArchiveIndex(config.archive)
+        index.refresh()
+        for used_index in (None, index):
+            assert list(snapshot.compare(config, "arch1.zip", "arch2.zip",
+                                         used_index)) == [
+                snapshot.SnapshotChange("doc1.txt", snapshot.CHANGE_MODIFIED),
+                snapshot.SnapshotChange("new/new.txt", snapshot.CHANGE_ADDED),
+                snapshot.SnapshotChange("subdir/doc2.txt",
+                                        snapshot.CHANGE_MODIFIED)]
+            # comparing backwards inverts the changes
+            assert list(snapshot.compare(config, "arch2.zip", "arch1.zip",
+                                         used_index)) == [
+                snapshot.SnapshotChange("doc1.txt", snapshot.CHANGE_MODIFIED),
+                snapshot.SnapshotChange("new/new.txt",
+                                        snapshot.CHANGE_REMOVED),
+                snapshot.SnapshotChange("subdir/doc2.txt",
+                                        snapshot.CHANGE_MODIFIED)]
+            assert list(snapshot.compare(config, "arch2.zip", "arch2.zip",
+                                         used_index)) == []
+
+
+def test_compare_across_full():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = create_archives(tmpdir)
+        os.remove(config.storage + "/subdir/doc3.txt")
+        config.full_every = 1
+        pybacked.backup.backup(config)
+        assert pybacked.manifest.read_last_entry(config.archive).kind == \
+            pybacked.ARCHIVE_FULL
+        # the full archive isn't replayed from arch1.zip, so the states are
+        # compared file by file
+        assert list(snapshot.compare(config, "arch1.zip", "arch3.zip")) == [
+            snapshot.SnapshotChange("doc1.txt", snapshot.CHANGE_MODIFIED),
+            snapshot.SnapshotChange("new/new.txt", snapshot.CHANGE_ADDED),
+            snapshot.SnapshotChange("subdir/doc2.txt",
+                                    snapshot.CHANGE_MODIFIED),
+            snapshot.SnapshotChange("subdir/doc3.txt",
+                                    snapshot.CHANGE_REMOVED)]
+        assert list(snapshot.compare(config, "arch2.zip", "arch3.zip")) == [
+            snapshot.SnapshotChange("subdir/doc3.txt",
+                                    snapshot.CHANGE_REMOVED)]
+
+
+def test_snapshot_empty():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = pybacked.config.Configuration("snapshot", tmpdir, tmpdir,
+                                               pybacked.DIFF_HASH,
+                                               zipfile.ZIP_DEFLATED, 9,
+                                               pybacked.HASH_SHA256)
+        index = pybacked.index.ArchiveIndex(tmpdir)
+        index.refresh()
+        for used_index in (None, index):
+            with pytest.raises(FileNotFoundError):
+                snapshot.Snapshot(config, index=used_index)
@@ -0,0 +1,168 @@
+import json
+import os
+import pybacked
+import pybacked.backup
+import pybacked.config
+import pybacked.instrumentation
+import pybacked.throttle as throttle
+import pytest
+import tempfile
+import zipfile
+
+
+class Clock:
+    """
+    Replaces time.monotonic, time.thread_time and time.sleep, so that
+    throttling can be tested without sleeping.
+    """
+    def __init__(self, monkeypatch):
+        self.now = 0.0
+        self.cpu_time = 0.0
+        self.slept = []
+        monkeypatch.setattr(throttle.time, "monotonic", lambda: self.now)
+        monkeypatch.setattr(throttle.time, "thread_time",
+                            lambda: self.cpu_time)
+        monkeypatch.setattr(throttle.time, "sleep", self.sleep)
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class TestTokenBucket:
+    def test_burst(self, monkeypatch):
+        clock = Clock(monkeypatch)
+        bucket = throttle.TokenBucket(100)
+        assert bucket.consume(100) == 0.0
+        assert bucket.consume(50) == 0.5
+        assert clock.slept == [0.5]
+
+    def test_refill(self, monkeypatch):
+        clock = Clock(monkeypatch)
+        bucket = throttle.TokenBucket(100)
+        bucket.consume(100)
+        clock.now += 0.25
+        assert bucket.consume(50) == 0.25
+
+    def test_set_rate(self, monkeypatch):
+        Clock(monkeypatch)
+        bucket = throttle.TokenBucket(100)
+        bucket.set_rate(10)
+        assert bucket.burst == 10
+        assert bucket.consume(20) == 1.0
+
+
+class TestDutyCycle:
+    def test_check(self, monkeypatch):
+        clock = Clock(monkeypatch)
+        duty_cycle = throttle.DutyCycle(0.5)
+        clock.now += 0.2
+        clock.cpu_time += 0.2
+        assert duty_cycle.check() == 0.2
+        # below the limit
+        clock.now += 0.2
+        clock.cpu_time += 0.05
+        assert duty_cycle.check() == 0.0
+
+    def test_period(self, monkeypatch):
+        clock = Clock(monkeypatch)
+        duty_cycle = throttle.DutyCycle(0.5)
+        clock.now += 0.05
+        clock.cpu_time += 0.05
+        assert duty_cycle.check() == 0.0
+
+
+class TestThrottle:
+    def test_read_write(self, monkeypatch):
+        Clock(monkeypatch)
+        stats = pybacked.instrumentation.Stats()
+        instance = throttle.Throttle(read_limit=100, write_limit=10)
+        with pybacked.instrumentation.activate(stats):
+            instance.read(200)
+            instance.write(20)
+        assert instance.seconds == 2.0
+        assert stats.phases["throttle"] == [2.0, 2]
+
+    def test_control_file(self, monkeypatch):
+        clock = Clock(monkeypatch)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            control = os.path.abspath(tmpdir + "/throttle.json")
+            instance = throttle.Throttle(read_limit=100, write_limit=100,
+                                         control_file=control)
+            # a missing control file keeps the configured limits
+            instance.poll()
+            assert instance.read_bucket.rate == 100
+
+            file = open(control, 'w')
+            file.write(json.dumps({"read_limit": 10, "write_limit": None,
+                                   "cpu_limit": 0.5}))
+            file.close()
+            # the file is only checked every CONTROL_POLL_INTERVAL
+            instance.poll()
+            assert instance.read_bucket.rate == 100
+            clock.now += throttle.CONTROL_POLL_INTERVAL
+            instance.poll()
+            assert instance.read_bucket.rate == 10
+            assert instance.write_bucket is None
+            assert instance.duty_cycle.limit == 0.5
+
+    def test_invalid_limits(self, monkeypatch):
+        clock = Clock(monkeypatch)
+        for limits in ({"read_limit": 0}, {"write_limit": -10},
+                       {"cpu_limit": 0.0}, {"read_limit": "fast"},
+                       {"cpu_limit": True}):
+            with pytest.raises(ValueError):
+                throttle.Throttle(**limits)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            control = os.path.abspath(tmpdir + "/throttle.json")
+            instance = throttle.Throttle(read_limit=100, cpu_limit=0.5,
+                                         control_file=control)
+            file = open(control, 'w')
+            file.write(json.dumps({"read_limit": 10, "cpu_limit": 0}))
+            file.close()
+            # a control file with an invalid limit keeps the current limits
+            clock.now += throttle.CONTROL_POLL_INTERVAL
+            instance.poll()
+            assert instance.read_bucket.rate == 100
+            assert instance.duty_cycle.limit == 0.5
+            instance.read(100)
+
+    def test_request_reload(self, monkeypatch):
+        Clock(monkeypatch)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            control = os.path.abspath(tmpdir + "/throttle.json")
+            instance = throttle.Throttle(control_file=control)
+            instance.poll()
+            file = open(control, 'w')
+            file.write(json.dumps({"read_limit": 10}))
+            file.close()
+            throttle.request_reload()
+            instance.poll()
+            assert instance.read_bucket.rate == 10
+
+
+def test_inactive():
+    # the module functions don't fail without an active throttle
+    throttle.read(1)
+    throttle.write(1)
+    throttle.cpu()
+    assert throttle.current() is None
+
+
+def test_backup_throttled(monkeypatch):
+    clock = Clock(monkeypatch)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        storage = os.path.abspath("./tests/testdata/ext_test/storage")
+        archive = os.path.abspath(tmpdir + "/archive")
+        os.mkdir(archive)
+        config = pybacked.config.Configuration("throttle", storage, archive,
+                                               pybacked.DIFF_DATE,
+                                               zipfile.ZIP_DEFLATED, 9)
+        assert throttle.from_config(config) is None
+
+        # the limit is below the size of the storage, so the backup has to
+        # be throttled once the burst is used up
+        config.read_limit = 16
+        stats = pybacked.backup.backup(config)
+        assert stats.phases["throttle"][0] == sum(clock.slept)
+        assert sum(clock.slept) > 0
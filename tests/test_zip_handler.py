@@ -1,5 +1,7 @@
 import io
 import os.path as osp
+import pybacked.cancellation
+import pytest
 import tempfile
 import zipfile
 
@@ -101,3 +103,143 @@ def test_extract_archdata():
         file.close()
 
     assert file_content.replace(b"\r", b"") == expected
+
+
+def test_extract_archdata_fadvise():
+    archive = osp.abspath("./tests/testdata/ext_test/archive/arch2.zip")
+    archname = "data/subdir/doc3.txt"
+    expected = b"Document 3 \xc2\xa7\n\xc2\xa7"
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        destination = osp.abspath(tmpdir + "/subdir/randomname.abc")
+        zip_handler.extract_archdata(archive, archname, destination,
+                                     fadvise=True)
+
+        file = open(destination, 'rb')
+        file_content = file.read()
+        file.close()
+
+    assert file_content.replace(b"\r", b"") == expected
+
+
+def test_create_archive_offsets():
+    filepath = osp.abspath("./tests/testdata/test_sample1.txt")
+    filedict = {filepath: "test_sample1.txt"}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        archivepath = osp.abspath(tmpdir + "/probe_archive.zip")
+        zip_handler.create_archive(archivepath, filedict,
+                                   compression=zipfile.ZIP_DEFLATED,
+                                   compressionlevel=9, offsets={filepath: 3},
+                                   fadvise=True)
+
+        probe_archive = zipfile.ZipFile(archivepath)
+        probe_data = probe_archive.read("data/test_sample1.txt")
+        probe_archive.close()
+
+    control_file = io.open(filepath, "rb")
+    control_data = control_file.read()
+    control_file.close()
+
+    assert probe_data == control_data[3:]
+
+
+def test_append_archdata():
+    archive = osp.abspath("./tests/testdata/ext_test/archive/arch2.zip")
+    archname = "data/subdir/doc3.txt"
+    with tempfile.TemporaryDirectory() as tmpdir:
+        destination = osp.abspath(tmpdir + "/doc3.txt")
+        file = open(destination, 'wb')
+        file.write(b"prefix")
+        file.close()
+        zip_handler.append_archdata(archive, archname, destination)
+
+        file = open(destination, 'rb')
+        file_content = file.read()
+        file.close()
+
+    assert file_content.replace(b"\r", b"") == \
+        b"prefixDocument 3 \xc2\xa7\n\xc2\xa7"
+
+
+def test_copy_member_raw():
+    source = osp.abspath("./tests/testdata/ext_test/archive/arch2.zip")
+    archname = "data/subdir/doc3.txt"
+    with tempfile.TemporaryDirectory() as tmpdir:
+        archivepath = osp.abspath(tmpdir + "/archive.zip")
+        source_archive = zipfile.ZipFile(source, mode='r')
+        info = source_archive.getinfo(archname)
+        expected = source_archive.read(archname)
+        source_archive.close()
+
+        archive = zipfile.ZipFile(archivepath, mode='w',
+                                  compression=zipfile.ZIP_STORED)
+        zip_handler.copy_member_raw(source, info, archive, "data/copy.txt")
+        archive.writestr("other.txt", "other")
+        archive.close()
+
+        archive = zipfile.ZipFile(archivepath, mode='r')
+        assert archive.testzip() is None
+        copy_info = archive.getinfo("data/copy.txt")
+        assert copy_info.compress_type == info.compress_type
+        assert copy_info.compress_size == info.compress_size
+        assert archive.read("data/copy.txt") == expected
+        assert archive.read("other.txt") == b"other"
+        archive.close()
+
+
+def test_write_member_chain():
+    source = osp.abspath("./tests/testdata/ext_test/archive/arch2.zip")
+    archname = "data/subdir/doc3.txt"
+    with tempfile.TemporaryDirectory() as tmpdir:
+        archivepath = osp.abspath(tmpdir + "/archive.zip")
+        archive = zipfile.ZipFile(archivepath, mode='w',
+                                  compression=zipfile.ZIP_DEFLATED)
+        zip_handler.write_member_chain(archive, "data/chain.txt",
+                                       [(source, archname),
+                                        (source, archname)])
+        archive.close()
+
+        source_archive = zipfile.ZipFile(source, mode='r')
+        expected = source_archive.read(archname) * 2
+        source_archive.close()
+        archive = zipfile.ZipFile(archivepath, mode='r')
+        assert archive.read("data/chain.txt") == expected
+        archive.close()
+
+
+def test_create_archive_cancelled():
+    storage = osp.abspath("./tests/testdata/ext_test/storage")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        archivepath = osp.abspath(tmpdir + "/archive.zip")
+        token = pybacked.cancellation.CancelToken()
+        token.cancel()
+        with pybacked.cancellation.activate(token):
+            with pytest.raises(pybacked.cancellation.Cancelled):
+                zip_handler.create_archive(
+                    archivepath, {storage + "/doc1.txt": "doc1.txt"},
+                    zipfile.ZIP_DEFLATED, 9)
+        # the archive was closed, which wrote its central directory
+        archive = zipfile.ZipFile(archivepath, mode='r')
+        assert archive.namelist() == []
+        archive.close()
+
+
+def test_copy_member_raw_closes_source(monkeypatch):
+    source = osp.abspath("./tests/testdata/ext_test/archive/arch2.zip")
+    opened = []
+
+    def tracking_open(*args, **kwargs):
+        file = open(*args, **kwargs)
+        opened.append(file)
+        return file
+
+    monkeypatch.setattr(zip_handler, "open", tracking_open, raising=False)
+    source_archive = zipfile.ZipFile(source, mode='r')
+    info = source_archive.getinfo("data/subdir/doc3.txt")
+    # writing to an archive opened for reading fails during the copy
+    with pytest.raises(ValueError):
+        zip_handler.copy_member_raw(source, info, source_archive,
+                                    "data/copy.txt")
+    source_archive.close()
+    assert len(opened) == 1
+    assert opened[0].closed